@@ -0,0 +1,40 @@
+################################################################################
+#
+# tests/test_arguments.py
+#
+# DESCRIPTION
+#
+#    Tests that the argument parser of each example command line builds and
+#    parses its defaults
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import importlib
+
+import pytest
+
+pytest.importorskip('tensorflow')
+
+
+################################################################################
+#
+# ARGUMENTS
+#
+################################################################################
+
+# entry points with the dataset source arguments of xnns/sources.py
+@pytest.mark.parametrize('module', ['mnist', 'cifar', 'tiny_imagenet', 'quantization', 'pruning', 'tracing'])
+def test_argument_parser(module):
+    parser = importlib.import_module('xnns.' + module).argument_parser()
+    args   = parser.parse_args([])
+    assert args.source in ['keras', 'tfrecords']
+    assert args.source_path is None
+    args   = parser.parse_args(['--source', 'synthetic', '--source-seed', '3'])
+    assert (args.source, args.source_seed) == ('synthetic', 3)
@@ -0,0 +1,45 @@
+################################################################################
+#
+# tests/test_data.py
+#
+# DESCRIPTION
+#
+#    Tests of the tf.data pipelines of xnns/data.py
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import numpy  as np
+import pytest
+
+tf = pytest.importorskip('tensorflow')
+
+from xnns import data
+
+
+################################################################################
+#
+# GLOBAL SHUFFLE
+#
+################################################################################
+
+# record shards of the same seed partition each epoch permutation
+def test_dataset_permutation_shards():
+    num_records, num_shards = 11, 3
+    sizes = [len(range(shard_index, num_records, num_shards)) for shard_index in range(num_shards)]
+    with tf.Graph().as_default():
+        datasets  = [data.dataset_permutation(num_records, 1, 5)] + [data.dataset_permutation(num_records, 1, 5, num_shards, shard_index) for shard_index in range(num_shards)]
+        iterators = [dataset.take(2*size).batch(2*size).make_initializable_iterator() for dataset, size in zip(datasets, [num_records] + sizes)]
+        with tf.Session() as session:
+            session.run([iterator.initializer for iterator in iterators])
+            full, *shards = session.run([iterator.get_next() for iterator in iterators])
+    for epoch in range(2):
+        permutation = full[epoch*num_records:(epoch + 1)*num_records]
+        for shard_index, (shard, size) in enumerate(zip(shards, sizes)):
+            np.testing.assert_array_equal(shard[epoch*size:(epoch + 1)*size], permutation[shard_index::num_shards])
@@ -0,0 +1,47 @@
+################################################################################
+#
+# tests/test_folding.py
+#
+# DESCRIPTION
+#
+#    Tests of the batch norm folding of xnns/folding.py against the frozen
+#    inference mode reference graph
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import numpy  as np
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from xnns import folding
+from xnns import inference
+
+
+################################################################################
+#
+# FOLDING
+#
+################################################################################
+
+# a small random weight model folds to the same outputs as the reference
+@pytest.mark.parametrize('model, levels', [('resnet', ['8,1,1', '16,1,2']), ('sequential_bn', None)])
+def test_folded_matches_reference(model, levels):
+    np.random.seed(0)
+    model_fn, image_size, crop_size, channels, scale, shift = inference.example_config('cifar', model, levels)
+    graph_def_reference, values = folding.reference_graph(model_fn, crop_size, channels, scale, shift, None)
+    graph_def_folded            = folding.folded_graph(folding.folded_function('cifar', model, levels), values, crop_size, channels, scale, shift)
+    batch = np.random.randint(0, 256, size=(4, crop_size, crop_size, channels), dtype=np.uint8)
+    outputs = []
+    for graph_def in [graph_def_reference, graph_def_folded]:
+        session, images, predictions = folding.load_graph(graph_def)
+        outputs.append(session.run(predictions, feed_dict={images: batch}))
+        session.close()
+    np.testing.assert_allclose(outputs[1], outputs[0], rtol=1e-4, atol=1e-4)
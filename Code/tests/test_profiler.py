@@ -0,0 +1,52 @@
+################################################################################
+#
+# tests/test_profiler.py
+#
+# DESCRIPTION
+#
+#    Tests of the static model_resnet_levels profile of xnns/profiler.py
+#    against a hand count
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+from xnns import profiler
+
+
+################################################################################
+#
+# PROFILE
+#
+################################################################################
+
+# 1 level of 1 bottleneck (width 2, strides 2) on a 3 channel 4 x 4 image with
+# 4 tail channels and 5 classes
+#    tail:    3x3x3x4 conv at 4 x 4
+#    level 0: bn 4, 1x1x4x2 conv / 2, bn 2, 3x3x2x2 conv, bn 2, 1x1x2x8 conv
+#             and the 1x1x4x8 projection / 2 at 2 x 2
+#    decoder: bn 8, 8x5 dense + 5 bias
+def test_profile_resnet():
+    rows = profiler.profile_resnet([(2, 1, 2)], 4, 3, 5, tail_channels=4)
+    assert [row['name'] for row in rows] == ['tail', 'level 0', 'decoder', 'total']
+    assert [row['shape'] for row in rows] == [(4, 4, 4), (8, 2, 2), (5, 1, 1), (5, 1, 1)]
+    assert [row['params'] for row in rows] == [108, 8 + 8 + 4 + 36 + 4 + 16 + 32, 16 + 45, 108 + 108 + 61]
+    assert [row['macs'] for row in rows] == [16*108, 4*(8 + 36 + 16 + 32), 40, 16*108 + 4*92 + 40]
+
+# pruned inner widths only change the inner convs and bns
+def test_profile_resnet_block_widths():
+    default  = profiler.profile_resnet([(4, 2, 1)], 8, 3, 10, tail_channels=8)
+    explicit = profiler.profile_resnet([(4, 2, 1)], 8, 3, 10, tail_channels=8, block_widths=[(4, 4), (4, 4)])
+    pruned   = profiler.profile_resnet([(4, 2, 1)], 8, 3, 10, tail_channels=8, block_widths=[(2, 3), (4, 4)])
+    assert default == explicit
+    assert pruned[1]['shape'] == default[1]['shape']
+    assert default[1]['params'] - pruned[1]['params'] == (8*4 + 2*4 + 9*4*4 + 2*4 + 4*16) - (8*2 + 2*2 + 9*2*3 + 2*3 + 3*16)
+
+# level specs from the command line form
+def test_parse_level_specs():
+    assert profiler.parse_level_specs(['16,3,1', '32,4,2']) == [(16, 3, 1), (32, 4, 2)]
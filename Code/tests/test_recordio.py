@@ -0,0 +1,96 @@
+################################################################################
+#
+# tests/test_recordio.py
+#
+# DESCRIPTION
+#
+#    Tests of the tfrecord offset index and random access reader of
+#    xnns/recordio.py
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import os
+import struct
+import threading
+
+import numpy  as np
+import pytest
+
+from xnns import recordio
+
+
+################################################################################
+#
+# TFRECORDS
+#
+################################################################################
+
+# tfrecord file of records (8 byte length, 4 byte crc, data, 4 byte crc)
+# the crcs are not checked by the offset index or the reader
+def write_tfrecords(path, records):
+    with open(path, 'wb') as file:
+        for record in records:
+            file.write(struct.pack('<Q', len(record)) + b'\0'*4 + record + b'\0'*4)
+
+# shards of records with different lengths
+@pytest.fixture
+def shards(tmp_path):
+    records   = [[bytes([shard, index])*(index + 1) for index in range(5 + shard)] for shard in range(3)]
+    tfrecords = [str(tmp_path / 'shard_{0:d}.tfrecords'.format(shard)) for shard in range(3)]
+    for path, shard_records in zip(tfrecords, records):
+        write_tfrecords(path, shard_records)
+    return tfrecords, records
+
+# offsets and lengths from the length headers
+def test_tfrecord_scan(shards):
+    tfrecords, records = shards
+    lengths            = [len(record) for record in records[0]]
+    offsets            = np.cumsum([0] + [length + 16 for length in lengths])[0:-1]
+    np.testing.assert_array_equal(recordio.tfrecord_scan(tfrecords[0]), np.stack([offsets, lengths], axis=1))
+
+# the sidecar index is used when present and gives the scanned locations
+def test_tfrecord_locations(shards):
+    tfrecords, records = shards
+    scanned            = recordio.tfrecord_locations(tfrecords)
+    np.save(tfrecords[1] + recordio.TFRECORD_INDEX_SUFFIX, recordio.tfrecord_scan(tfrecords[1]))
+    np.testing.assert_array_equal(recordio.tfrecord_locations(tfrecords), scanned)
+    np.testing.assert_array_equal(scanned[:, 0], np.repeat(np.arange(3), [len(shard_records) for shard_records in records]))
+    assert recordio.tfrecord_count(tfrecords) == sum(len(shard_records) for shard_records in records)
+
+# an index older than its shard is not used
+def test_tfrecord_locations_stale(shards):
+    tfrecords, records = shards
+    np.save(tfrecords[0] + recordio.TFRECORD_INDEX_SUFFIX, np.zeros((1, 2), dtype=np.int64))
+    os.utime(tfrecords[0] + recordio.TFRECORD_INDEX_SUFFIX, (0, 0))
+    assert recordio.tfrecord_index_is_current(tfrecords[0]) == False
+    np.testing.assert_array_equal(recordio.tfrecord_locations(tfrecords)[0:len(records[0]), 1:], recordio.tfrecord_scan(tfrecords[0]))
+
+# records by global index (shard order then record order) in any order
+def test_tfrecord_reader(shards):
+    tfrecords, records = shards
+    flat               = [record for shard_records in records for record in shard_records]
+    read               = recordio.tfrecord_reader(tfrecords, recordio.tfrecord_locations(tfrecords))
+    for indices in [np.arange(len(flat)), np.random.RandomState(0).permutation(len(flat)), np.array([3, 3, 17, 0, 4, 5])]:
+        assert list(read(indices)) == [flat[index] for index in indices]
+
+# parallel reads open each shard once and close releases them
+@pytest.mark.skipif(os.path.isdir('/proc/self/fd') == False, reason='needs /proc/self/fd')
+def test_tfrecord_reader_files(shards):
+    tfrecords, records = shards
+    num_fds            = len(os.listdir('/proc/self/fd'))
+    read               = recordio.tfrecord_reader(tfrecords, recordio.tfrecord_locations(tfrecords))
+    threads            = [threading.Thread(target=read, args=(np.random.RandomState(seed).permutation(18),)) for seed in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(os.listdir('/proc/self/fd')) == num_fds + len(tfrecords)
+    read.close()
+    assert len(os.listdir('/proc/self/fd')) == num_fds
@@ -0,0 +1,62 @@
+################################################################################
+#
+# tests/test_records.py
+#
+# DESCRIPTION
+#
+#    Tests of the sidecar index building and the missing shard check of
+#    xnns/records.py
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import os
+import struct
+
+import numpy  as np
+import pytest
+
+pytest.importorskip('tensorflow')
+
+from xnns import data
+from xnns import records
+
+
+################################################################################
+#
+# INDEXES
+#
+################################################################################
+
+# tfrecord file of records (the crcs are not checked by the index)
+def write_tfrecords(path, values):
+    with open(path, 'wb') as file:
+        for value in values:
+            file.write(struct.pack('<Q', len(value)) + b'\0'*4 + value + b'\0'*4)
+
+# missing indexes and indexes older than their shard are built, current ones
+# and missing shards are skipped
+def test_build_indexes(tmp_path):
+    tfrecords = [str(tmp_path / 'shard_{0:d}.tfrecords'.format(shard)) for shard in range(3)]
+    for path in tfrecords[0:2]:
+        write_tfrecords(path, [b'a', b'bb'])
+    assert records.build_indexes(tfrecords) == tfrecords[0:2]
+    assert records.build_indexes(tfrecords) == []
+
+    # re packed shard
+    write_tfrecords(tfrecords[1], [b'ccc'])
+    os.utime(tfrecords[1] + data.TFRECORD_INDEX_SUFFIX, (0, 0))
+    assert records.build_indexes(tfrecords) == [tfrecords[1]]
+    np.testing.assert_array_equal(np.load(tfrecords[1] + data.TFRECORD_INDEX_SUFFIX), [[0, 3]])
+
+# reading by global index fails when a shard of the split is missing
+def test_missing_shard(tmp_path, capsys):
+    with pytest.raises(SystemExit):
+        records.main(['--tfrecords-dir', str(tmp_path), '--split', 'val', '--count'])
+    assert 'missing' in capsys.readouterr().err
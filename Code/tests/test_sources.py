@@ -0,0 +1,88 @@
+################################################################################
+#
+# tests/test_sources.py
+#
+# DESCRIPTION
+#
+#    Tests of the offline dataset sources and binary cache of xnns/sources.py
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import gzip
+
+import numpy  as np
+import pytest
+
+from xnns import sources
+
+
+################################################################################
+#
+# CACHE
+#
+################################################################################
+
+# small (images, labels) training and testing arrays
+def small_arrays(seed=0):
+    state = np.random.RandomState(seed)
+    return tuple((state.randint(0, 256, size=(num, 4, 4, 3), dtype=np.uint8), state.randint(0, 10, size=(num,), dtype=np.int32)) for num in [6, 3])
+
+# saved arrays are loaded back memory mapped
+def test_cache_round_trip(tmp_path):
+    arrays   = small_arrays()
+    identity = {'source': 'synthetic', 'seed': 3}
+    sources.save_cache(str(tmp_path), 'cifar10', 'synthetic', identity, arrays)
+    loaded   = sources.load_cache(str(tmp_path), 'cifar10', 'synthetic', identity)
+    for split, loaded_split in zip(arrays, loaded):
+        for values, loaded_values in zip(split, loaded_split):
+            assert isinstance(loaded_values, np.memmap)
+            np.testing.assert_array_equal(loaded_values, values)
+
+# a changed source or a missing cache is not loaded
+def test_cache_stale(tmp_path):
+    sources.save_cache(str(tmp_path), 'cifar10', 'synthetic', {'source': 'synthetic', 'seed': 3}, small_arrays())
+    assert sources.load_cache(str(tmp_path), 'cifar10', 'synthetic', {'source': 'synthetic', 'seed': 4}) is None
+    assert sources.load_cache(str(tmp_path), 'mnist',   'synthetic', {'source': 'synthetic', 'seed': 3}) is None
+
+
+################################################################################
+#
+# LOCAL ARCHIVES
+#
+################################################################################
+
+# mnist idx file (gzip)
+def write_idx(path, values):
+    header = bytes([0, 0, 8, values.ndim]) + b''.join(dim.to_bytes(4, 'big') for dim in values.shape)
+    with gzip.open(str(path), 'wb') as file:
+        file.write(header + values.astype(np.uint8).tobytes())
+
+# a local idx directory is parsed once, then loaded from the cache
+def test_load_local_mnist(tmp_path):
+    state  = np.random.RandomState(0)
+    arrays = [(state.randint(0, 256, size=(num, 28, 28)).astype(np.uint8), state.randint(0, 10, size=(num,)).astype(np.uint8)) for num in [5, 2]]
+    (tmp_path / 'mnist').mkdir()
+    for prefix, (images, labels) in zip(['train', 't10k'], arrays):
+        write_idx(tmp_path / 'mnist' / '{0}-images-idx3-ubyte.gz'.format(prefix), images)
+        write_idx(tmp_path / 'mnist' / '{0}-labels-idx1-ubyte.gz'.format(prefix), labels)
+    for attempt in range(2):
+        loaded = sources.load('mnist', 'local', str(tmp_path / 'mnist'), str(tmp_path / 'cache'))
+        for (images, labels), (loaded_images, loaded_labels) in zip(arrays, loaded):
+            np.testing.assert_array_equal(loaded_images, images)
+            np.testing.assert_array_equal(loaded_labels, labels)
+            assert loaded_labels.dtype == np.int32
+    assert isinstance(loaded[0][0], np.memmap)
+
+# synthetic arrays have the dataset shapes and depend only on the seed
+def test_load_synthetic():
+    (images, labels), (images_test, labels_test) = sources.load_synthetic('mnist', 1)
+    assert images.shape == (60000, 28, 28) and images.dtype == np.uint8
+    assert labels_test.shape == (10000,) and labels_test.dtype == np.int32
+    np.testing.assert_array_equal(sources.load_synthetic('mnist', 1)[1][0], images_test)
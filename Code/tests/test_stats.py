@@ -0,0 +1,62 @@
+################################################################################
+#
+# tests/test_stats.py
+#
+# DESCRIPTION
+#
+#    Tests of the streaming channel statistics and normalization of
+#    xnns/stats.py
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import numpy  as np
+import pytest
+
+from xnns import stats
+
+
+################################################################################
+#
+# STREAMING STATISTICS
+#
+################################################################################
+
+# chunked statistics equal the statistics of the whole dataset
+@pytest.mark.parametrize('chunk_size', [1, 7, 1000])
+def test_channel_stats(chunk_size):
+    images    = np.random.RandomState(0).randint(0, 256, size=(50, 4, 5, 3)).astype(np.uint8)
+    mean, std = stats.channel_stats(images, chunk_size)
+    pixels    = images.reshape(-1, 3).astype(np.float64)
+    np.testing.assert_allclose(mean, np.mean(pixels, axis=0))
+    np.testing.assert_allclose(std,  np.std(pixels, axis=0))
+
+# merging with empty statistics changes nothing
+def test_channel_stats_merge_empty():
+    batch  = stats.channel_stats_batch(np.arange(24, dtype=np.float64).reshape(2, 4, 3))
+    merged = stats.channel_stats_merge(stats.channel_stats_init(3), batch)
+    assert merged[0] == batch[0]
+    np.testing.assert_allclose(merged[1], batch[1])
+    np.testing.assert_allclose(merged[2], batch[2])
+
+
+
+################################################################################
+#
+# NORMALIZATION
+#
+################################################################################
+
+# image*scale + shift is (image/255 - mean)/std
+def test_normalization():
+    mean, std    = [0.5, 0.25, 0.125], [0.2, 0.4, 0.8]
+    scale, shift = stats.normalization(mean, std)
+    assert scale.dtype == np.float32 and shift.dtype == np.float32
+    images       = np.array([0, 1, 128, 255], dtype=np.float64)[:, None]
+    np.testing.assert_allclose(images*scale + shift, (images/255.0 - np.array(mean))/np.array(std), rtol=1e-6, atol=1e-6)
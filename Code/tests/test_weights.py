@@ -0,0 +1,107 @@
+################################################################################
+#
+# tests/test_weights.py
+#
+# DESCRIPTION
+#
+#    Tests of the structured channel pruning of xnns/weights.py on hand made
+#    model_resnet_levels variable values
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import numpy  as np
+import pytest
+
+from xnns import weights
+
+
+################################################################################
+#
+# VALUES
+#
+################################################################################
+
+# random values of model_resnet_levels variables in tf.layers creation order
+# (tail conv, then per bottleneck bn, conv, bn, conv, bn, conv [, projection
+# conv], then the final bn and dense)
+def resnet_values(level_specs, in_channels, num_classes, tail_channels, seed=0):
+    state  = np.random.RandomState(seed)
+    values = {}
+    counts = {'conv2d': 0, 'batch_normalization': 0}
+    def name(kind):
+        index         = counts[kind]
+        counts[kind] += 1
+        return 'model/{0}'.format(kind if index == 0 else '{0}_{1:d}'.format(kind, index))
+    def conv(size, channels_in, channels_out):
+        values[name('conv2d') + '/kernel'] = state.randn(size, size, channels_in, channels_out).astype(np.float32)
+    def bn(channels):
+        layer = name('batch_normalization')
+        for variable in weights.BN_NAMES:
+            values[layer + '/' + variable] = state.rand(channels).astype(np.float32) + 0.1
+    conv(3, in_channels, tail_channels)
+    channels = tail_channels
+    for width, num_blocks, strides in level_specs:
+        for block in range(num_blocks):
+            bn(channels)
+            conv(1, channels, width)
+            bn(width)
+            conv(3, width, width)
+            bn(width)
+            conv(1, width, 4*width)
+            if block == 0:
+                conv(1, channels, 4*width)
+            channels = 4*width
+    bn(channels)
+    values['model/dense/kernel'] = state.randn(channels, num_classes).astype(np.float32)
+    values['model/dense/bias']   = np.zeros(num_classes, dtype=np.float32)
+    return values
+
+
+################################################################################
+#
+# PRUNING
+#
+################################################################################
+
+# pruned shapes match the block widths and the residual path is not pruned
+@pytest.mark.parametrize('criterion', ['bn_gamma', 'magnitude'])
+def test_prune_shapes(criterion):
+    level_specs          = [(4, 2, 1), (8, 1, 2)]
+    values               = resnet_values(level_specs, 3, 10, 8)
+    pruned, block_widths = weights.prune(values, level_specs, 0.5, criterion)
+    assert block_widths == [(2, 2), (2, 2), (4, 4)]
+    assert set(pruned.keys()) == set(values.keys())
+
+    # first bottleneck: conv2d_1 (8 -> 4), conv2d_2 (4 -> 4), conv2d_3 (4 -> 16)
+    assert pruned['model/conv2d_1/kernel'].shape == (1, 1, 8, 2)
+    assert pruned['model/conv2d_2/kernel'].shape == (3, 3, 2, 2)
+    assert pruned['model/conv2d_3/kernel'].shape == (1, 1, 2, 16)
+    assert pruned['model/batch_normalization_1/gamma'].shape == (2,)
+    assert pruned['model/batch_normalization_2/moving_variance'].shape == (2,)
+
+    # unpruned: tail, projections, bottleneck input bns and the decoder
+    for name in ['model/conv2d/kernel', 'model/conv2d_4/kernel', 'model/batch_normalization/gamma', 'model/batch_normalization_3/beta', 'model/dense/kernel']:
+        np.testing.assert_array_equal(pruned[name], values[name])
+
+# the kept channels are the most important ones, in their original order
+def test_prune_keeps_important_channels():
+    level_specs = [(4, 1, 1)]
+    values      = resnet_values(level_specs, 3, 10, 8)
+    values['model/batch_normalization_1/gamma'] = np.array([0.1, 3.0, 0.2, 2.0], dtype=np.float32)
+    pruned, block_widths = weights.prune(values, level_specs, 0.5, 'bn_gamma')
+    np.testing.assert_array_equal(pruned['model/conv2d_1/kernel'], values['model/conv2d_1/kernel'][:, :, :, [1, 3]])
+    keep_2 = weights.keep_channels(np.abs(values['model/batch_normalization_2/gamma']), 0.5)
+    np.testing.assert_array_equal(pruned['model/conv2d_2/kernel'], values['model/conv2d_2/kernel'][:, :, [1, 3], :][:, :, :, keep_2])
+    np.testing.assert_array_equal(pruned['model/conv2d_3/kernel'], values['model/conv2d_3/kernel'][:, :, keep_2, :])
+
+# at least 1 channel is kept
+def test_keep_channels():
+    np.testing.assert_array_equal(weights.keep_channels(np.array([1.0, 5.0, 3.0]), 0.0), [1])
+    np.testing.assert_array_equal(weights.keep_channels(np.array([1.0, 5.0, 3.0]), 0.67), [1, 2])
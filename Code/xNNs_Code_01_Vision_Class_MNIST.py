@@ -112,7 +112,7 @@ dataset_test  = tf.data.Dataset.from_tensor_slices((data_test,  labels_test))
 
 # transformation
 dataset_train = dataset_train.repeat().map(pre_processing_train).batch(TRAINING_BATCH_SIZE)
-dataset_test  = dataset_test.repeat().map(pre_processing_test).batch(TRAINING_BATCH_SIZE)
+dataset_test  = dataset_test.map(pre_processing_test).batch(TRAINING_BATCH_SIZE)
 
 # display
 # print(data_train.shape)
@@ -173,7 +173,7 @@ train_state = tf.placeholder(tf.bool, name='train_state')
 num_train         = len(data_train)
 num_test          = len(data_test)
 num_batches_train = int(num_train/TRAINING_BATCH_SIZE)
-num_batches_test  = int(num_test/TRAINING_BATCH_SIZE)
+num_batches_test  = int(np.ceil(num_test/TRAINING_BATCH_SIZE))
 
 # display
 # print(num_train)
@@ -234,7 +234,7 @@ for epoch_index in range(TRAINING_NUM_EPOCHS):
         predictions_test[row_start:row_end, :]  = predictions_batch
 
     # display
-    print('Epoch {0:3d}: top 1 accuracy on the test set is {1:5.2f} %'.format(epoch_index, (100.0*num_correct)/(TRAINING_BATCH_SIZE*num_batches_test)))
+    print('Epoch {0:3d}: top 1 accuracy on the test set is {1:5.2f} %'.format(epoch_index, (100.0*num_correct)/num_test))
 
     # save
     # saver.save(session, TRAINING_CHECKPOINT_FILE.format(epoch_index))
@@ -13,8 +13,11 @@
 #    2. File - New Python 3 notebook
 #    3. Cut and paste this file into the cell (feel free to divide into multiple
 #       cells)
-#    4. Runtime - Change runtime type - Hardware accelerator - GPU
-#    5. Runtime - Run all
+#    4. Make the xnns package importable: upload the Code/xnns directory to the
+#       notebook's working directory (or clone this repository and %cd into
+#       its Code directory)
+#    5. Runtime - Change runtime type - Hardware accelerator - GPU
+#    6. Runtime - Run all
 #
 # DESIGN
 #
@@ -74,6 +77,10 @@ import numpy             as np
 import matplotlib.pyplot as plt
 %matplotlib inline
 
+# shared xnns functions (see INSTRUCTIONS)
+from xnns.data  import random_flip_crop_batch, benchmark_pipeline
+from xnns.stats import channel_stats_init, channel_stats_merge, channel_stats_batch, channel_stats_finalize
+
 
 ################################################################################
 #
@@ -83,6 +90,7 @@ import matplotlib.pyplot as plt
 
 # data
 DATA_NUM_CLASSES = 10
+DATA_STATS_BATCH = 1000
 
 # model
 MODEL_LEVEL_0_BLOCKS = 4
@@ -104,6 +112,12 @@ TRAINING_LR_STAIRCASE      = True
 TRAINING_MAX_CHECKPOINTS   = 5
 TRAINING_CHECKPOINT_FILE   = './logs/model_{}.ckpt' # currently not used
 
+# input pipeline
+PIPELINE_BATCH_AUGMENT     = True                   # flip and crop whole batches with 1 gather
+PIPELINE_BENCHMARK_AUGMENT = False                  # compare per example vs batch augmentation images / sec
+PIPELINE_BENCHMARK_SIZES   = [32, 64, 128, 256, 512]
+PIPELINE_BENCHMARK_BATCHES = 200
+
 
 ################################################################################
 #
@@ -163,6 +177,24 @@ def pre_processing_test(image, label):
     return image, label
 
 
+################################################################################
+#
+# PRE PROCESSING - BATCH
+#
+################################################################################
+
+# pre processing - training - augmentation and normalization of a batch
+def pre_processing_train_batch(images, labels):
+
+    # random horizontal flip and crop
+    images = random_flip_crop_batch(images, TRAINING_CROP_SIZE)
+
+    # normalization
+    images = tf.math.divide(tf.math.subtract(tf.cast(images, tf.float32), data_mean), data_std)
+
+    return images, labels
+
+
 ################################################################################
 #
 # DATASET
@@ -176,8 +208,13 @@ cifar10 = keras.datasets.cifar10
 (data_train, labels_train), (data_test, labels_test) = cifar10.load_data()
 
 # normalization values
-data_mean = np.mean(data_train, axis=tuple(range(data_train.ndim - 1)), dtype=np.float32).reshape((1, 1, 3))
-data_std  = np.std(data_train,  axis=tuple(range(data_train.ndim - 1)), dtype=np.float32).reshape((1, 1, 3))
+# accumulated 1 chunk at a time to avoid a float copy of the full training set
+stats = channel_stats_init(3)
+for i in range(0, len(data_train), DATA_STATS_BATCH):
+    stats = channel_stats_merge(stats, channel_stats_batch(data_train[i:i + DATA_STATS_BATCH]))
+data_mean, data_std = channel_stats_finalize(stats)
+data_mean           = data_mean.astype(np.float32).reshape((1, 1, 3))
+data_std            = data_std.astype(np.float32).reshape((1, 1, 3))
 
 # label typecast
 labels_train = labels_train.astype(np.int32)
@@ -190,8 +227,11 @@ dataset_train = tf.data.Dataset.from_tensor_slices((data_train, labels_train))
 dataset_test  = tf.data.Dataset.from_tensor_slices((data_test,  labels_test))
 
 # transformation
-dataset_train = dataset_train.shuffle(TRAINING_SHUFFLE_BUFFER).repeat().map(pre_processing_train).batch(TRAINING_BATCH_SIZE)
-dataset_test  = dataset_test.repeat().map(pre_processing_test).batch(TRAINING_BATCH_SIZE)
+if PIPELINE_BATCH_AUGMENT == True:
+    dataset_train = dataset_train.shuffle(TRAINING_SHUFFLE_BUFFER).repeat().batch(TRAINING_BATCH_SIZE).map(pre_processing_train_batch)
+else:
+    dataset_train = dataset_train.shuffle(TRAINING_SHUFFLE_BUFFER).repeat().map(pre_processing_train).batch(TRAINING_BATCH_SIZE)
+dataset_test  = dataset_test.map(pre_processing_test).batch(TRAINING_BATCH_SIZE)
 
 # display
 # print(data_train.shape)
@@ -200,6 +240,30 @@ dataset_test  = dataset_test.repeat().map(pre_processing_test).batch(TRAINING_BA
 # print(labels_test.shape)
 
 
+################################################################################
+#
+# PIPELINE THROUGHPUT
+#
+################################################################################
+
+# compare per example and per batch augmentation images / sec
+def benchmark_augmentation(data, labels, batch_sizes, num_batches):
+
+    # dataset
+    dataset = tf.data.Dataset.from_tensor_slices((data, labels)).repeat()
+
+    # cycle through the batch sizes
+    for batch_size in batch_sizes:
+        per_example = benchmark_pipeline(dataset.map(pre_processing_train).batch(batch_size), num_batches)
+        per_batch   = benchmark_pipeline(dataset.batch(batch_size).map(pre_processing_train_batch), num_batches)
+        print('Batch size {0:3d}: per example {1:9.1f} images / sec, per batch {2:9.1f} images / sec, speed up {3:5.2f}x'.format(batch_size, per_example, per_batch, per_batch/per_example))
+
+# display
+# a 1024 image subset keeps the constant embedded in each benchmark graph small
+if PIPELINE_BENCHMARK_AUGMENT == True:
+    benchmark_augmentation(data_train[0:1024], labels_train[0:1024], PIPELINE_BENCHMARK_SIZES, PIPELINE_BENCHMARK_BATCHES)
+
+
 ################################################################################
 #
 # ITERATOR
@@ -479,7 +543,7 @@ train_state = tf.placeholder(tf.bool, name='train_state')
 num_train         = len(data_train)
 num_test          = len(data_test)
 num_batches_train = int(num_train/TRAINING_BATCH_SIZE)
-num_batches_test  = int(num_test/TRAINING_BATCH_SIZE)
+num_batches_test  = int(np.ceil(num_test/TRAINING_BATCH_SIZE))
 
 # display
 # print(num_train)
@@ -542,7 +606,7 @@ for epoch_index in range(TRAINING_NUM_EPOCHS):
         predictions_test[row_start:row_end, :]  = predictions_batch
 
     # display
-    print('Epoch {0:3d}: top 1 accuracy on the test set is {1:5.2f} %'.format(epoch_index, (100.0*num_correct)/(TRAINING_BATCH_SIZE*num_batches_test)))
+    print('Epoch {0:3d}: top 1 accuracy on the test set is {1:5.2f} %'.format(epoch_index, (100.0*num_correct)/num_test))
 
     # save
     # saver.save(session, TRAINING_CHECKPOINT_FILE.format(epoch_index))
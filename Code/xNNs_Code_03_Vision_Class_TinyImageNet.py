@@ -11,8 +11,11 @@
 #    1. Go to Google Colaboratory: https://colab.research.google.com/notebooks/welcome.ipynb
 #    2. File - New Python 3 notebook
 #    3. Cut and paste this file into the cell (feel free to divide into multiple cells)
-#    4. Runtime - Change runtime type - Hardware accelerator - GPU
-#    5. Runtime - Run all
+#    4. Make the xnns package importable: upload the Code/xnns directory to the
+#       notebook's working directory (or clone this repository and %cd into
+#       its Code directory)
+#    5. Runtime - Change runtime type - Hardware accelerator - GPU
+#    6. Runtime - Run all
 #
 ################################################################################
 
@@ -29,10 +32,14 @@ from   tensorflow         import contrib
 from   tensorflow.contrib import autograph
 
 # additional libraries
+import os
 import numpy             as np
 import matplotlib.pyplot as plt
 %matplotlib inline
 
+# shared xnns functions (see INSTRUCTIONS)
+from xnns.data import random_flip_crop_batch, benchmark_pipeline
+
 
 ################################################################################
 #
@@ -46,6 +53,8 @@ DATA_TFRECORDS_TRAIN   = '/content/gdrive/My Drive/data/tiny-imagenet-200/tiny_i
 DATA_TFRECORDS_VAL     = '/content/gdrive/My Drive/data/tiny-imagenet-200/tiny_imagenet_val_{}.tfrecords'
 DATA_NUM_SHARDS_TRAIN  = 20
 DATA_NUM_SHARDS_VAL    = 2
+DATA_DECODED_TRAIN     = '/content/gdrive/My Drive/data/tiny-imagenet-200/tiny_imagenet_train_{}.npy'
+DATA_DECODED_VAL       = '/content/gdrive/My Drive/data/tiny-imagenet-200/tiny_imagenet_val_{}.npy'
 DATA_NUM_CLASSES       = 200
 DATA_NUM_TRAIN         = 500*DATA_NUM_CLASSES
 DATA_NUM_VAL           = 50*DATA_NUM_CLASSES
@@ -77,6 +86,19 @@ TRAINING_LR_STAIRCASE      = True
 TRAINING_MAX_CHECKPOINTS   = 5
 TRAINING_CHECKPOINT_FILE   = './logs/model_{}.ckpt' # currently not used
 
+# input pipeline
+PIPELINE_FAST              = True                   # parallel interleave, map and batch fusion and prefetch
+PIPELINE_DECODED           = False                  # memory map pre decoded images (xNNs_Data_03) instead of tfrecords
+PIPELINE_BATCH_AUGMENT     = True                   # flip and crop whole batches with 1 gather after decoding
+PIPELINE_NORMALIZE_MODEL   = False                  # ship uint8 batches and normalize inside the model graph
+PIPELINE_NUM_READERS       = 8                      # shards read at the same time
+PIPELINE_NUM_CALLS         = os.cpu_count() or 1    # images decoded and augmented at the same time
+PIPELINE_PREFETCH          = 2                      # batches prepared ahead of the model
+PIPELINE_BENCHMARK         = False                  # measure the input pipeline images / sec
+PIPELINE_BENCHMARK_BATCHES = 200
+PIPELINE_BENCHMARK_AUGMENT = False                  # compare per example vs batch augmentation images / sec
+PIPELINE_BENCHMARK_SIZES   = [32, 64, 128, 256, 512]
+
 
 ################################################################################
 #
@@ -116,14 +138,8 @@ def pre_processing_val(record):
     image = tf.image.decode_image(sample['image'], channels=3)
 
     # center crop
+    # normalization is done per batch (normalize_batch)
     image = center_crop(image, TRAINING_CROP_SIZE, TRAINING_CROP_SIZE)
-    
-    # normaliztion
-    data_mean = tf.constant([DATA_MEAN_CHANNEL_0, DATA_MEAN_CHANNEL_1, DATA_MEAN_CHANNEL_2], dtype=tf.float32)
-    data_mean = tf.reshape(data_mean, [1, 1, 3])
-    data_std  = tf.constant([DATA_STD_DEV_CHANNEL_0, DATA_STD_DEV_CHANNEL_1, DATA_STD_DEV_CHANNEL_2], dtype=tf.float32)
-    data_std  = tf.reshape(data_std, [1, 1, 3])
-    image     = tf.math.divide(tf.math.subtract(tf.cast(image, tf.float32)/255.0, data_mean), data_std)
 
     # label conversion
     label = tf.cast(sample['label'], tf.int32)
@@ -131,8 +147,8 @@ def pre_processing_val(record):
     # return
     return image, label
 
-# pre processing - training
-def pre_processing_train(record):
+# pre processing - training - parse and decode
+def pre_processing_train_decode(record):
     
     # feature definition
     features = \
@@ -144,23 +160,140 @@ def pre_processing_train(record):
 
     # image decode
     image = tf.image.decode_image(sample['image'], channels=3)
+    image.set_shape([TRAINING_IMAGE_SIZE, TRAINING_IMAGE_SIZE, 3])
+
+    # label conversion
+    label = tf.cast(sample['label'], tf.int32)
+
+    # return
+    return image, label
+
+# pre processing - training - augmentation of 1 example
+def pre_processing_train_example(image, label):
 
     # random flip and crop
+    # normalization is done per batch (normalize_batch)
     image = tf.image.random_flip_left_right(image)
     image = tf.image.random_crop(image, size=[TRAINING_CROP_SIZE, TRAINING_CROP_SIZE, 3])
 
-    # normaliztion
-    data_mean = tf.constant([DATA_MEAN_CHANNEL_0, DATA_MEAN_CHANNEL_1, DATA_MEAN_CHANNEL_2], dtype=tf.float32)
-    data_mean = tf.reshape(data_mean, [1, 1, 3])
-    data_std  = tf.constant([DATA_STD_DEV_CHANNEL_0, DATA_STD_DEV_CHANNEL_1, DATA_STD_DEV_CHANNEL_2], dtype=tf.float32)
-    data_std  = tf.reshape(data_std, [1, 1, 3])
-    image     = tf.math.divide(tf.math.subtract(tf.cast(image, tf.float32)/255.0, data_mean), data_std)
+    # return
+    return image, label
+
+# pre processing - training
+def pre_processing_train(record):
+    image, label = pre_processing_train_decode(record)
+    return pre_processing_train_example(image, label)
 
-    # label conversion
-    label = tf.cast(sample['label'], tf.int32)
+
+################################################################################
+#
+# PRE PROCESSING - BATCH
+#
+################################################################################
+
+# pre processing - training - augmentation of a batch
+def pre_processing_train_batch(images, labels):
+    return random_flip_crop_batch(images, TRAINING_CROP_SIZE), labels
+
+
+################################################################################
+#
+# NORMALIZATION
+#
+################################################################################
+
+# (image/255 - mean)/std folded into 1 scale and shift per channel that is
+# computed once here instead of in every traced pre processing call
+data_mean  = np.array([DATA_MEAN_CHANNEL_0, DATA_MEAN_CHANNEL_1, DATA_MEAN_CHANNEL_2], dtype=np.float64)
+data_std   = np.array([DATA_STD_DEV_CHANNEL_0, DATA_STD_DEV_CHANNEL_1, DATA_STD_DEV_CHANNEL_2], dtype=np.float64)
+data_scale = (1.0/(255.0*data_std)).astype(np.float32).reshape((1, 1, 1, 3))
+data_shift = (-data_mean/data_std).astype(np.float32).reshape((1, 1, 1, 3))
+
+# normalization of a batch of 8 bit images
+def normalize(images):
+    return tf.cast(images, tf.float32)*data_scale + data_shift
+
+# normalization of a batch in the input pipeline
+# with PIPELINE_NORMALIZE_MODEL the 8 bit batch (4x smaller than float) is
+# passed through and normalized after the iterator on the model device
+def normalize_batch(images, labels):
+
+    # shape (lost by py_func)
+    images.set_shape([None, TRAINING_CROP_SIZE, TRAINING_CROP_SIZE, 3])
+    labels.set_shape([None])
+
+    # normalization
+    if PIPELINE_NORMALIZE_MODEL == False:
+        images = normalize(images)
 
     # return
-    return image, label
+    return images, labels
+
+
+################################################################################
+#
+# PRE PROCESSING - DECODED
+#
+################################################################################
+
+# note: these functions operate on batches of memory mapped 8 bit images that
+# were decoded once by xNNs_Data_03 so there is no parsing or decoding per epoch
+
+# gather a batch of images and labels with a random horizontal flip and crop
+def decoded_batch_train(indices):
+
+    # gather
+    # sorted indices read the memory map in file order
+    indices = np.sort(indices)
+    images  = decoded_images_train[indices]
+    labels  = decoded_labels_train[indices]
+    num     = len(indices)
+
+    # random crop top left point and flip
+    top  = np.random.randint(0, TRAINING_IMAGE_SIZE - TRAINING_CROP_SIZE + 1, size=num)
+    left = np.random.randint(0, TRAINING_IMAGE_SIZE - TRAINING_CROP_SIZE + 1, size=num)
+    flip = np.random.rand(num) < 0.5
+
+    # crop and flip with 1 gather
+    rows   = top[:, None]  + np.arange(TRAINING_CROP_SIZE)
+    cols   = left[:, None] + np.arange(TRAINING_CROP_SIZE)
+    cols   = np.where(flip[:, None], cols[:, ::-1], cols)
+    images = images[np.arange(num)[:, None, None], rows[:, :, None], cols[:, None, :]]
+
+    # return
+    return images, labels
+
+# gather a batch of images and labels with a center crop
+def decoded_batch_val(indices):
+
+    # center crop top left point
+    crop_top  = (TRAINING_IMAGE_SIZE - TRAINING_CROP_SIZE) // 2
+    crop_left = (TRAINING_IMAGE_SIZE - TRAINING_CROP_SIZE) // 2
+
+    # gather and crop
+    images = decoded_images_val[indices, crop_top:crop_top + TRAINING_CROP_SIZE, crop_left:crop_left + TRAINING_CROP_SIZE, :]
+    labels = decoded_labels_val[indices]
+
+    # return
+    return images, labels
+
+# dataset of decoded batches
+def decoded_dataset(num_images, batch_fn, shuffle):
+
+    # batches of indices
+    dataset = tf.data.Dataset.range(num_images)
+    if shuffle == True:
+        dataset = dataset.shuffle(num_images).repeat()
+    dataset = dataset.batch(TRAINING_BATCH_SIZE)
+
+    # gather
+    dataset = dataset.map(lambda indices: tuple(tf.py_func(batch_fn, [indices], [tf.uint8, tf.int32], stateful=shuffle)), num_parallel_calls=PIPELINE_NUM_CALLS)
+
+    # normalization
+    dataset = dataset.map(normalize_batch, num_parallel_calls=PIPELINE_NUM_CALLS)
+
+    # return
+    return dataset.prefetch(PIPELINE_PREFETCH)
 
 
 ################################################################################
@@ -190,9 +323,72 @@ dataset_train = tf.data.TFRecordDataset(tfrecords_train)
 dataset_val   = tf.data.TFRecordDataset(tfrecords_val)
 
 # transformation
-dataset_train = dataset_train.shuffle(buffer_size=TRAINING_SHUFFLE_BUFFER).repeat().map(pre_processing_train).batch(TRAINING_BATCH_SIZE)
-# dataset_val   = dataset_val.shuffle(buffer_size=TRAINING_SHUFFLE_BUFFER).repeat().map(pre_processing_val).batch(TRAINING_BATCH_SIZE)
-dataset_val   = dataset_val.repeat().map(pre_processing_val).batch(TRAINING_BATCH_SIZE)
+if PIPELINE_DECODED == True:
+
+    # memory map the decoded images
+    # the operating system page cache is shared by all training processes
+    decoded_images_train = np.load(DATA_DECODED_TRAIN.format('images'), mmap_mode='r')
+    decoded_labels_train = np.load(DATA_DECODED_TRAIN.format('labels'))
+    decoded_images_val   = np.load(DATA_DECODED_VAL.format('images'), mmap_mode='r')
+    decoded_labels_val   = np.load(DATA_DECODED_VAL.format('labels'))
+
+    # training and validation
+    dataset_train = decoded_dataset(len(decoded_labels_train), decoded_batch_train, True)
+    dataset_val   = decoded_dataset(len(decoded_labels_val),   decoded_batch_val,   False)
+
+elif PIPELINE_FAST == True:
+
+    # training
+    # read PIPELINE_NUM_READERS shuffled shards at the same time
+    # decode, augment and batch with PIPELINE_NUM_CALLS parallel calls
+    # prepare PIPELINE_PREFETCH batches ahead of the model
+    dataset_train = tf.data.Dataset.from_tensor_slices(tfrecords_train).shuffle(len(tfrecords_train)).repeat()
+    dataset_train = dataset_train.apply(tf.data.experimental.parallel_interleave(tf.data.TFRecordDataset, cycle_length=PIPELINE_NUM_READERS, sloppy=True))
+    dataset_train = dataset_train.shuffle(buffer_size=TRAINING_SHUFFLE_BUFFER)
+    if PIPELINE_BATCH_AUGMENT == True:
+        dataset_train = dataset_train.apply(tf.data.experimental.map_and_batch(pre_processing_train_decode, TRAINING_BATCH_SIZE, num_parallel_calls=PIPELINE_NUM_CALLS))
+        dataset_train = dataset_train.map(pre_processing_train_batch)
+    else:
+        dataset_train = dataset_train.apply(tf.data.experimental.map_and_batch(pre_processing_train, TRAINING_BATCH_SIZE, num_parallel_calls=PIPELINE_NUM_CALLS))
+    dataset_train = dataset_train.map(normalize_batch).prefetch(PIPELINE_PREFETCH)
+
+    # validation
+    # order is kept so the saved predictions line up with the display batch
+    dataset_val   = dataset_val.apply(tf.data.experimental.map_and_batch(pre_processing_val, TRAINING_BATCH_SIZE, num_parallel_calls=PIPELINE_NUM_CALLS))
+    dataset_val   = dataset_val.map(normalize_batch).prefetch(PIPELINE_PREFETCH)
+
+else:
+    dataset_train = dataset_train.shuffle(buffer_size=TRAINING_SHUFFLE_BUFFER).repeat().map(pre_processing_train).batch(TRAINING_BATCH_SIZE).map(normalize_batch)
+    # dataset_val   = dataset_val.shuffle(buffer_size=TRAINING_SHUFFLE_BUFFER).repeat().map(pre_processing_val).batch(TRAINING_BATCH_SIZE).map(normalize_batch)
+    dataset_val   = dataset_val.map(pre_processing_val).batch(TRAINING_BATCH_SIZE).map(normalize_batch)
+
+
+################################################################################
+#
+# PIPELINE THROUGHPUT
+#
+################################################################################
+
+# compare per example and per batch augmentation images / sec
+# synthetic 8 bit images keep decoding and disk reads out of the measurement
+def benchmark_augmentation(batch_sizes, num_batches):
+
+    # synthetic data
+    images  = np.random.randint(0, 256, size=(1024, TRAINING_IMAGE_SIZE, TRAINING_IMAGE_SIZE, 3), dtype=np.uint8)
+    labels  = np.zeros((1024,), dtype=np.int32)
+    dataset = tf.data.Dataset.from_tensor_slices((images, labels)).repeat()
+
+    # cycle through the batch sizes
+    for batch_size in batch_sizes:
+        per_example = benchmark_pipeline(dataset.map(pre_processing_train_example).batch(batch_size).map(normalize_batch), num_batches)
+        per_batch   = benchmark_pipeline(dataset.batch(batch_size).map(pre_processing_train_batch).map(normalize_batch), num_batches)
+        print('Batch size {0:3d}: per example {1:9.1f} images / sec, per batch {2:9.1f} images / sec, speed up {3:5.2f}x'.format(batch_size, per_example, per_batch, per_batch/per_example))
+
+# display
+if PIPELINE_BENCHMARK == True:
+    print('Input pipeline: {0:8.1f} images / sec'.format(benchmark_pipeline(dataset_train, PIPELINE_BENCHMARK_BATCHES)))
+if PIPELINE_BENCHMARK_AUGMENT == True:
+    benchmark_augmentation(PIPELINE_BENCHMARK_SIZES, PIPELINE_BENCHMARK_BATCHES)
 
 
 ################################################################################
@@ -209,6 +405,10 @@ iterator_init_test  = iterator.make_initializer(dataset_val)
 # example
 data, labels = iterator.get_next()
 
+# normalization on the model device
+if PIPELINE_NORMALIZE_MODEL == True:
+    data = normalize(data)
+
 
 ################################################################################
 #
@@ -532,7 +732,7 @@ train_state = tf.placeholder(tf.bool, name='train_state')
 num_train         = DATA_NUM_TRAIN
 num_test          = DATA_NUM_VAL
 num_batches_train = int(num_train/TRAINING_BATCH_SIZE)
-num_batches_test  = int(num_test/TRAINING_BATCH_SIZE)
+num_batches_test  = int(np.ceil(num_test/TRAINING_BATCH_SIZE))
 
 # display
 # print(num_train)
@@ -595,7 +795,7 @@ for epoch_index in range(TRAINING_NUM_EPOCHS):
         predictions_test[row_start:row_end, :]  = predictions_batch
 
     # display
-    print('Epoch {0:3d}: top 1 accuracy on the test set is {1:5.2f} %'.format(epoch_index, (100.0*num_correct)/(TRAINING_BATCH_SIZE*num_batches_test)))
+    print('Epoch {0:3d}: top 1 accuracy on the test set is {1:5.2f} %'.format(epoch_index, (100.0*num_correct)/num_test))
 
     # save
     # saver.save(session, TRAINING_CHECKPOINT_FILE.format(epoch_index))
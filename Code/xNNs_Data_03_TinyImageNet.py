@@ -12,7 +12,10 @@
 #       https://colab.research.google.com/notebooks/welcome.ipynb
 #    2. File - New Python 3 notebook
 #    3. Cut and paste this file into the cell (ok to divide into multiple cells)
-#    4. Runtime - Run all
+#    4. Make the xnns package importable: upload the Code/xnns directory to the
+#       notebook's working directory (or clone this repository and %cd into
+#       its Code directory)
+#    5. Runtime - Run all
 #
 # RESULTS
 #
@@ -37,12 +40,18 @@ import numpy as np
 import os
 import re
 import sys
+import json
+import hashlib
 import random
+import multiprocessing
 import urllib.request
 import zipfile
 import matplotlib.pyplot as plt
 %matplotlib inline
 
+# shared xnns functions (see INSTRUCTIONS)
+from xnns.stats import channel_stats_init, channel_stats_merge, channel_stats_finalize
+
 
 ################################################################################
 #
@@ -62,6 +71,12 @@ DATA_NUM_SHARDS_TRAIN = 20
 DATA_NUM_SHARDS_VAL   = 2
 DATA_IMAGE_HEIGHT     = 64
 DATA_IMAGE_WIDTH      = 64
+DATA_NUM_WORKERS      = os.cpu_count() or 1 # tfrecord conversion processes, 1 = serial
+DATA_VERIFY_SHARDS    = True           # checksum existing shards before skipping them
+DATA_EXPORT_DECODED   = True           # export decoded uint8 images for memory mapping
+DATA_DECODED_TRAIN    = '/content/gdrive/My Drive/data/tiny-imagenet-200/tiny_imagenet_train_{}.npy'
+DATA_DECODED_VAL      = '/content/gdrive/My Drive/data/tiny-imagenet-200/tiny_imagenet_val_{}.npy'
+DATA_EXPORT_BATCH     = 1000
 
 # training
 TRAINING_SHOW_SAMPLE         = True
@@ -153,6 +168,29 @@ def print_conversion_progress(count, total):
     sys.stdout.write(msg)
     sys.stdout.flush()
 
+# serialize an image file and its label as a tf.train.Example
+def serialize_example(path, label):
+
+    # read the image file
+    with tf.gfile.GFile(path, 'rb') as fid:
+        image_data = fid.read()
+
+    # create a dictionary with the data to be save in the TFRecords file
+    data = \
+        {
+            'image': wrap_bytes(image_data),
+            'label': wrap_int64(label)
+        }
+
+    # wrap the data as TensorFlow features
+    feature = tf.train.Features(feature=data)
+
+    # wrap again as a TensorFlow example
+    example = tf.train.Example(features=feature)
+
+    # serialize the data
+    return example.SerializeToString()
+
 # convert data to tfrecords
 def convert(image_paths, labels, out_path):
     
@@ -162,8 +200,10 @@ def convert(image_paths, labels, out_path):
     # number of images (used for tracking progress)
     num_images = len(image_paths)
     
-    # open a TFRecordWriter for the output file
-    with tf.python_io.TFRecordWriter(out_path) as writer:
+    # open a TFRecordWriter for the temporary output file
+    # the offset and length of each record are kept for the sidecar index
+    records = []
+    with tf.python_io.TFRecordWriter(out_path + '.tmp') as writer:
         
         # iterate over all the image paths and class labels
         for i, (path, label) in enumerate(zip(image_paths, labels)):
@@ -171,33 +211,198 @@ def convert(image_paths, labels, out_path):
             # display the progress
             print_conversion_progress(count=i, total=num_images-1)
 
-            # read the image file
-            with tf.gfile.GFile(path, 'rb') as fid:
-                image_data = fid.read()
+            # write the serialized data to the TFRecords file
+            record = serialize_example(path, label)
+            writer.write(record)
+            records.append(len(record))
+
+    # move the shard and its index into place and record its manifest
+    finish_shard(image_paths, labels, out_path, records)
 
-            # create a dictionary with the data to be save in the TFRecords file
-            data = \
-                {
-                    'image': wrap_bytes(image_data),
-                    'label': wrap_int64(label)
-                }
+    # display
+    print()
 
-            # wrap the data as TensorFlow features
-            feature = tf.train.Features(feature=data)
+# number of images converted by all workers (set in each worker by the pool initializer)
+conversion_count = None
 
-            # wrap again as a TensorFlow example
-            example = tf.train.Example(features=feature)
+# pool initializer - share the progress counter with the worker
+def init_conversion_worker(count):
+    global conversion_count
+    conversion_count = count
+
+# convert a single shard to tfrecords (runs in a worker process)
+# a shard is a tuple of (image_paths, labels, out_path) and its contents only
+# depend on that tuple so the output is identical for any number of workers
+def convert_shard(shard):
+
+    # shard
+    image_paths, labels, out_path = shard
+
+    # open a TFRecordWriter for the temporary output file
+    # the offset and length of each record are kept for the sidecar index
+    records = []
+    with tf.python_io.TFRecordWriter(out_path + '.tmp') as writer:
+
+        # iterate over all the image paths and class labels
+        for path, label in zip(image_paths, labels):
 
-            # serialize the data
-            serialized = example.SerializeToString()
-            
             # write the serialized data to the TFRecords file
-            writer.write(serialized)
+            record = serialize_example(path, label)
+            writer.write(record)
+            records.append(len(record))
+
+            # update the aggregate progress
+            with conversion_count.get_lock():
+                conversion_count.value += 1
+
+    # move the shard and its index into place and record its manifest
+    finish_shard(image_paths, labels, out_path, records)
+
+    # return
+    return out_path
+
+# convert shards to tfrecords with 1 worker process per shard at a time
+def convert_parallel(shards, num_workers):
+
+    # display
+    print("Converting {} shards with {} workers".format(len(shards), num_workers))
+
+    # number of images (used for tracking progress)
+    num_images = sum(len(image_paths) for image_paths, _, _ in shards)
+
+    # worker pool
+    # note: the pool is created before any tf.Session so forking is safe
+    count  = multiprocessing.Value('l', 0)
+    pool   = multiprocessing.Pool(processes=num_workers, initializer=init_conversion_worker, initargs=(count,))
+    result = pool.map_async(convert_shard, shards, chunksize=1)
+    pool.close()
+
+    # display the aggregate progress until all shards are written
+    while not result.ready():
+        result.wait(0.5)
+        print_conversion_progress(count=count.value, total=num_images)
+
+    # wait for the workers and re raise any worker error
+    pool.join()
+    result.get()
 
     # display
     print()
 
 
+################################################################################
+#
+# SHARD MANIFEST FUNCTIONS
+#
+################################################################################
+
+# a shard is complete when its manifest exists
+# the manifest is written after the shard and its index are moved into place so
+# a shard that was interrupted part way through never has one and is re packed
+#
+# manifest contents
+#    sources:  [path, label, size, mtime] of each image in the shard
+#    records:  number of records in the shard
+#    bytes:    size of the shard file
+#    sha256:   checksum of the shard file
+
+# manifest file for a shard
+def manifest_path(out_path):
+    return out_path + '.manifest.json'
+
+# sidecar index file for a shard
+# N x 2 int64 (offset, length) of the serialized example of each record; a
+# tfrecord record is an 8 byte length, a 4 byte crc, the example and a 4 byte
+# crc so the example of record i starts at offset + 12
+# xnns/data.py reads records by global index with it (os.pread, no scan)
+def index_path(out_path):
+    return out_path + '.index.npy'
+
+# sidecar index of records with serialized lengths written in order
+def record_index(lengths):
+    lengths = np.asarray(lengths, dtype=np.int64)
+    offsets = np.cumsum(lengths + 16) - (lengths + 16)
+    return np.stack([offsets, lengths], axis=1)
+
+# checksum of a file
+def file_checksum(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as fid:
+        for block in iter(lambda: fid.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+# description of the source images of a shard
+def shard_sources(image_paths, labels):
+    sources = []
+    for path, label in zip(image_paths, labels):
+        stat = os.stat(path)
+        sources.append([str(path), int(label), stat.st_size, stat.st_mtime_ns])
+    return sources
+
+# move a finished shard and its index into place and write its manifest
+def finish_shard(image_paths, labels, out_path, records):
+
+    # move the shard into place
+    os.replace(out_path + '.tmp', out_path)
+
+    # write the index
+    np.save(index_path(out_path) + '.tmp.npy', record_index(records))
+    os.replace(index_path(out_path) + '.tmp.npy', index_path(out_path))
+
+    # manifest
+    manifest = \
+        {
+            'sources': shard_sources(image_paths, labels),
+            'records': len(image_paths),
+            'bytes':   os.path.getsize(out_path),
+            'sha256':  file_checksum(out_path)
+        }
+
+    # write the manifest
+    with open(manifest_path(out_path) + '.tmp', 'w') as fid:
+        json.dump(manifest, fid)
+    os.replace(manifest_path(out_path) + '.tmp', manifest_path(out_path))
+
+# check if a shard is complete and was packed from the same source images
+def shard_is_complete(shard, verify=True):
+
+    # shard
+    image_paths, labels, out_path = shard
+
+    # read the manifest
+    if not os.path.exists(manifest_path(out_path)) or not os.path.exists(out_path):
+        return False
+    try:
+        with open(manifest_path(out_path)) as fid:
+            manifest = json.load(fid)
+    except ValueError:
+        return False
+
+    # source images changed
+    try:
+        if manifest['sources'] != shard_sources(image_paths, labels):
+            return False
+    except OSError:
+        return False
+
+    # shard file changed
+    if manifest['bytes'] != os.path.getsize(out_path):
+        return False
+
+    # index missing or not matching the shard (shards packed before the index)
+    try:
+        if len(np.load(index_path(out_path), mmap_mode='r')) != manifest['records']:
+            return False
+    except (OSError, ValueError):
+        return False
+    if verify and manifest['sha256'] != file_checksum(out_path):
+        return False
+
+    # return
+    return True
+
+
 ################################################################################
 #
 # DOWNLOAD DATA AND CONVERT TO TFRECORD
@@ -269,15 +474,26 @@ nv = int(val_data_size/DATA_NUM_SHARDS_VAL)
 if not os.path.exists(DATA_TFRECORDS_DIR):
     os.makedirs(DATA_TFRECORDS_DIR)
 
-# pack the training images into tfrecords
+# training and validation shards
+shards = []
 for i in range(DATA_NUM_SHARDS_TRAIN):
     tfrecord_path = os.path.join(DATA_TFRECORDS_DIR, 'tiny_imagenet_train_{}.tfrecords'.format(i))
-    convert(train_paths[i*nt:(i+1)*nt], train_labels[i*nt:(i+1)*nt], tfrecord_path)
-
-# pack the validation images into tfrecords
+    shards.append((train_paths[i*nt:(i+1)*nt], train_labels[i*nt:(i+1)*nt], tfrecord_path))
 for i in range(DATA_NUM_SHARDS_VAL):
     tfrecord_path = os.path.join(DATA_TFRECORDS_DIR, 'tiny_imagenet_val_{}.tfrecords'.format(i))
-    convert(val_paths[i*nv:(i+1)*nv], val_labels[i*nv:(i+1)*nv], tfrecord_path)
+    shards.append((val_paths[i*nv:(i+1)*nv], val_labels[i*nv:(i+1)*nv], tfrecord_path))
+
+# skip the shards that are already complete
+num_shards = len(shards)
+shards     = [shard for shard in shards if not shard_is_complete(shard, DATA_VERIFY_SHARDS)]
+print("{} of {} shards are up to date".format(num_shards - len(shards), num_shards))
+
+# pack the training and validation images into tfrecords
+if DATA_NUM_WORKERS > 1 and len(shards) > 1:
+    convert_parallel(shards, min(DATA_NUM_WORKERS, len(shards)))
+else:
+    for image_paths, labels, tfrecord_path in shards:
+        convert(image_paths, labels, tfrecord_path)
 
 
 ################################################################################
@@ -319,17 +535,12 @@ for i in range(DATA_NUM_SHARDS_VAL):
     tfrecords_val.append(DATA_TFRECORDS_VAL.format(i))
 
 # display the number of training images
-train_num = 0
-for fn in tfrecords_train:
-    for record in tf.python_io.tf_record_iterator(fn):
-        train_num += 1
+# counted from the sidecar indexes (no scan of the records)
+train_num = sum(len(np.load(index_path(fn), mmap_mode='r')) for fn in tfrecords_train)
 print("Number of training images:   {}".format(train_num))
 
 # display the number of validation images
-val_num = 0
-for fn in tfrecords_val:
-    for record in tf.python_io.tf_record_iterator(fn):
-        val_num += 1
+val_num = sum(len(np.load(index_path(fn), mmap_mode='r')) for fn in tfrecords_val)
 print("Number of validation images: {}".format(val_num))
 
 
@@ -339,9 +550,6 @@ print("Number of validation images: {}".format(val_num))
 #
 ################################################################################
 
-# number of batches
-num_batch = train_num/TRAINING_BATCH_SIZE
-
 # dataset
 dataset_train = tf.data.TFRecordDataset(tfrecords_train)
 
@@ -355,71 +563,32 @@ iterator_init_train = iterator.make_initializer(dataset_train)
 # example
 images, labels = iterator.get_next()
 
-# create a session
-session = tf.Session()
-
-# initialize global variables
-session.run(tf.global_variables_initializer())
-
-# channel average
-channel_avg = tf.reduce_mean(images, axis=[1,2])
-
-# initialize the total sum
-tot_sum = np.array([0.0,0.0,0.0])
-
-# initialize the iterator to the training dataset
-session.run(iterator_init_train)
-
-# accumulate the total sum
-try:
-    while True:
-        batch_channel_avg  = session.run([channel_avg])
-        batch_avg          = np.mean(batch_channel_avg, axis=1)
-        tot_sum           += batch_avg[0]
-
-except tf.errors.OutOfRangeError:
-    pass
-
-# display the mean
-tot_mean = tot_sum/num_batch
-print("Mean:    {}".format(tot_mean))
-
-# close the session
-session.close()
-
-# reshape the mean to a (1, 1, 3) tensor
-mean_channel = tf.constant(tot_mean, dtype=tf.float32)
-mean_channel = tf.reshape(mean_channel, [1,1,3])
+# batch statistics
+# the reduction is done on the device so only 3 values per statistic are fetched
+batch_count           = tf.reduce_prod(tf.shape(images)[0:3])
+batch_mean, batch_var = tf.nn.moments(images, axes=[0, 1, 2])
 
 # create a session
 session = tf.Session()
 
-# initialize global variables
-session.run(tf.global_variables_initializer())
-
-# compute the variance
-image_sub_mean_sq = tf.reduce_sum(tf.math.square(tf.math.subtract(images, mean_channel)), axis=[1,2])
-
-# initialize the total sum
-tot_sum = np.array([0.0, 0.0, 0.0])
-
 # initialize the iterator to the training dataset
 session.run(iterator_init_train)
 
-# accumulate the total sum
+# accumulate the statistics in a single pass
+stats = channel_stats_init(3)
 try:
     while True:
-        batch_image_sub_mean_sq  = session.run([image_sub_mean_sq])
-        batch_channel_sum        = np.sum(batch_image_sub_mean_sq, axis=1)
-        tot_sum                 += batch_channel_sum[0]
+        count, mean, var = session.run([batch_count, batch_mean, batch_var])
+        stats            = channel_stats_merge(stats, (int(count), mean.astype(np.float64), count*var.astype(np.float64)))
 except tf.errors.OutOfRangeError:
     pass
 
 # close the session
 session.close()
 
-# display the standard deviation
-std = np.sqrt(tot_sum/(DATA_IMAGE_WIDTH*DATA_IMAGE_HEIGHT*train_num))
+# display the mean and standard deviation
+tot_mean, std = channel_stats_finalize(stats)
+print("Mean:    {}".format(tot_mean))
 print("Std dev: {}".format(std))
 
 
@@ -522,3 +691,106 @@ if TRAINING_SHOW_SAMPLE == True:
         for name, label in classes_name_label.items():
             if label == labels_sample_val[i]:
                 print(name, classes_name_words[name])
+
+
+################################################################################
+#
+# EXPORT DECODED IMAGES
+#
+################################################################################
+
+# an export is current when its manifest lists the checksums of the shard
+# manifests it was decoded from
+# the export manifest is removed before and written after the arrays are moved
+# into place so an export from re packed shards or an interrupted export is
+# redone
+
+# checksums of shards from their manifests (None for a shard without one)
+def shard_checksums(tfrecords):
+    checksums = []
+    for out_path in tfrecords:
+        try:
+            with open(manifest_path(out_path)) as fid:
+                checksums.append(json.load(fid)['sha256'])
+        except (OSError, ValueError, KeyError):
+            checksums.append(None)
+    return checksums
+
+# check if the decoded images were exported from the current shards
+def export_is_current(tfrecords, images_path, labels_path):
+    if not os.path.exists(images_path) or not os.path.exists(labels_path) or not os.path.exists(manifest_path(images_path)):
+        return False
+    try:
+        with open(manifest_path(images_path)) as fid:
+            manifest = json.load(fid)
+    except ValueError:
+        return False
+    checksums = shard_checksums(tfrecords)
+    return None not in checksums and manifest.get('shards') == checksums
+
+# export decoded images to a uint8 images (N x rows x cols x 3) .npy file and
+# an int32 labels (N) .npy file that training can memory map instead of
+# parsing and decoding the tfrecords every epoch
+def export_decoded(tfrecords, num_images, images_path, labels_path):
+
+    # already exported from the current shards
+    if export_is_current(tfrecords, images_path, labels_path):
+        print("Decoded images have already been exported: " + images_path)
+        return
+
+    # display
+    print("Exporting: " + images_path)
+    if os.path.exists(manifest_path(images_path)):
+        os.remove(manifest_path(images_path))
+
+    # dataset
+    dataset = tf.data.TFRecordDataset(tfrecords)
+    dataset = dataset.map(parser_visual, num_parallel_calls=DATA_NUM_WORKERS).batch(DATA_EXPORT_BATCH).prefetch(1)
+
+    # example
+    images, labels = dataset.make_one_shot_iterator().get_next()
+
+    # output arrays
+    # the images are written through a memory map so they never all live in memory
+    images_out = np.lib.format.open_memmap(images_path + '.tmp', mode='w+', dtype=np.uint8, shape=(num_images, DATA_IMAGE_HEIGHT, DATA_IMAGE_WIDTH, 3))
+    labels_out = np.zeros((num_images,), dtype=np.int32)
+
+    # create a session
+    session = tf.Session()
+
+    # decode all images in tfrecord order
+    row = 0
+    try:
+        while True:
+            images_batch, labels_batch = session.run([images, labels])
+            row_end                    = row + len(labels_batch)
+            images_out[row:row_end]    = images_batch
+            labels_out[row:row_end]    = labels_batch
+            row                        = row_end
+            print_conversion_progress(count=row, total=num_images)
+    except tf.errors.OutOfRangeError:
+        pass
+
+    # close the session
+    session.close()
+
+    # move the arrays into place
+    images_out.flush()
+    del images_out
+    with open(labels_path + '.tmp', 'wb') as fid:
+        np.save(fid, labels_out)
+    os.replace(images_path + '.tmp', images_path)
+    os.replace(labels_path + '.tmp', labels_path)
+
+    # write the manifest
+    with open(manifest_path(images_path) + '.tmp', 'w') as fid:
+        json.dump({'shards': shard_checksums(tfrecords)}, fid)
+    os.replace(manifest_path(images_path) + '.tmp', manifest_path(images_path))
+
+    # display
+    print()
+
+# export
+if DATA_EXPORT_DECODED == True:
+    export_decoded(tfrecords_train, train_num, DATA_DECODED_TRAIN.format('images'), DATA_DECODED_TRAIN.format('labels'))
+    export_decoded(tfrecords_val,   val_num,   DATA_DECODED_VAL.format('images'),   DATA_DECODED_VAL.format('labels'))
@@ -0,0 +1,73 @@
+################################################################################
+#
+# xnns
+#
+# DESCRIPTION
+#
+#    Shared data, model, training and evaluation code for the xNNs vision
+#    classification examples (MNIST, CIFAR and Tiny ImageNet)
+#
+# USAGE
+#
+#    From the Code directory
+#
+#       python -m xnns.mnist
+#       python -m xnns.cifar
+#       python -m xnns.tiny_imagenet --tfrecords-dir ./data/tiny-imagenet-200/
+#
+#    Add --help to any of the above for the available options
+#
+# MODULES
+#
+#    data:          data sources, pre processing and tf.data pipelines
+#    stats:         streaming channel statistics and normalization (numpy
+#                   only, re-exported by data)
+#    recordio:      tfrecord offset indexes and random access reads (numpy
+#                   only, re-exported by data)
+#    models:        model_nn, model_sequential, model_sequential_bn and
+#                   model_resnet
+#    training:      training graph, epoch loop and command line arguments
+#    evaluation:    streaming metrics, validation loop and display
+#    profiler:      static parameter / MAC / activation memory profile of
+#                   model_resnet_levels
+#    precision:     mixed precision (float16 / bfloat16) model and optimizer
+#                   and its step time / peak memory benchmark
+#    multistep:     in graph multi step training loop and its host overhead
+#                   benchmark
+#    checkpoint:    asynchronous checkpointing with bounded retention and
+#                   resume
+#    distributed:   data parallel Tiny ImageNet training across local worker
+#                   processes and its scaling benchmark
+#    inference:     batched offline inference from a checkpoint
+#    serving:       HTTP inference server with dynamic request batching and
+#                   its load generator benchmark
+#    weights:       trained variable values by layer and channel pruning of
+#                   them (numpy only)
+#    folding:       batch norm folding into an inference only graph and its
+#                   output / latency check
+#    quantization:  post training int8 quantization (tflite) and its size /
+#                   latency / accuracy comparison with float32
+#    pruning:       structured channel pruning and fine tuning of the resnet
+#                   bottlenecks and its FLOPs / latency / accuracy report
+#    tracing:       input pipeline vs compute profiler of the training loop
+#                   (per step timeline trace and per stage throughput)
+#    benchmark:     reproducible pipeline / forward / forward + backward
+#                   throughput benchmark on synthetic data (json results)
+#    sources:       offline dataset sources (local archives or synthetic)
+#                   with a memory mapped binary cache
+#    records:       random access to the Tiny ImageNet tfrecords by global
+#                   record index (sidecar offset indexes)
+#    mnist:         MNIST command line entry point
+#    cifar:         CIFAR command line entry point
+#    tiny_imagenet: Tiny ImageNet command line entry point
+#
+# NOTES
+#
+#    1. Importing the package or any module has no side effects: nothing is
+#       downloaded, mounted, displayed or trained until a function is called
+#    2. The xNNs_Code_0x / xNNs_Data_0x scripts remain Google Colaboratory
+#       examples; the functions they share with the package (stats, batch
+#       augmentation, pipeline throughput) are imported from it instead of
+#       copied
+#
+################################################################################
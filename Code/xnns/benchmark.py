@@ -0,0 +1,272 @@
+################################################################################
+#
+# xnns/benchmark.py
+#
+# DESCRIPTION
+#
+#    Reproducible throughput benchmark of the input pipeline and models
+#
+#    Synthetic in memory datasets with the shapes of MNIST (28 x 28),
+#    CIFAR (32 x 32 x 3, 28 crop) and Tiny ImageNet (64 x 64 x 3, 56 crop)
+#    need no download. For every dataset, batch size and thread count the
+#    images / sec of
+#       pipeline:         data.dataset_arrays training pipeline alone
+#       forward:          model in inference mode on a fixed batch
+#       forward_backward: training step (loss, gradients, adam update) on a
+#                         fixed batch
+#    are measured for model_nn (MNIST) and model_sequential,
+#    model_sequential_bn and model_resnet (CIFAR and Tiny ImageNet)
+#
+# USAGE
+#
+#    python -m xnns.benchmark --output results.json
+#    python -m xnns.benchmark --datasets cifar --models resnet --output new.json --compare results.json
+#
+#    --compare prints the images / sec ratio to a previous results file and
+#    flags the cases slower by more than --tolerance
+#
+# OUTPUT
+#
+#    JSON with
+#       meta:    versions, cpu count, git commit and benchmark parameters
+#       results: 1 entry per case with dataset, model (null for pipeline),
+#                mode, batch_size, threads, ms_per_batch and images_per_sec
+#
+# NOTES
+#
+#    1. Data and model initialization are seeded with --seed
+#    2. Each case is timed --repeats times after a warm up and the median is
+#       reported
+#    3. threads sets both the intra and inter op thread pools of the session
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+
+import numpy      as np
+import tensorflow as tf
+
+from xnns import cifar
+from xnns import data
+from xnns import mnist
+from xnns import multistep
+from xnns import precision as mixed
+from xnns import tiny_imagenet
+
+
+################################################################################
+#
+# PARAMETERS
+#
+################################################################################
+
+# datasets
+# image size, crop size (None for no crop), channels, classes, models
+BENCHMARK_DATASETS = {
+    'mnist':         (mnist.DATA_IMAGE_SIZE,             None,                             1, mnist.DATA_NUM_CLASSES,         ['nn']),
+    'cifar':         (cifar.DATA_IMAGE_SIZE,             cifar.TRAINING_CROP_SIZE,         3, cifar.DATA_NUM_CLASSES,         ['sequential', 'sequential_bn', 'resnet']),
+    'tiny_imagenet': (tiny_imagenet.TRAINING_IMAGE_SIZE, tiny_imagenet.TRAINING_CROP_SIZE, 3, tiny_imagenet.DATA_NUM_CLASSES, ['sequential', 'sequential_bn', 'resnet'])}
+
+# defaults
+BENCHMARK_BATCH_SIZES    = [32, 128]
+BENCHMARK_THREADS        = [1, os.cpu_count() or 1]
+BENCHMARK_MODES          = ['pipeline', 'forward', 'forward_backward']
+BENCHMARK_NUM_IMAGES     = 2048
+BENCHMARK_SHUFFLE_BUFFER = 1000
+BENCHMARK_WARMUP         = 5
+BENCHMARK_RUNS           = 20
+BENCHMARK_REPEATS        = 3
+BENCHMARK_SEED           = 1
+BENCHMARK_TOLERANCE      = 0.05
+BENCHMARK_LR             = 0.001
+
+
+################################################################################
+#
+# DATA AND MODELS
+#
+################################################################################
+
+# synthetic uint8 images and int32 labels with the shape of a dataset
+def synthetic_data(dataset, num_images, seed):
+    image_size, crop_size, channels, num_classes, models = BENCHMARK_DATASETS[dataset]
+    state = np.random.RandomState(seed)
+    shape = (num_images, image_size, image_size) if channels == 1 else (num_images, image_size, image_size, channels)
+    return state.randint(0, 256, size=shape, dtype=np.uint8), state.randint(0, num_classes, size=(num_images,), dtype=np.int32)
+
+# model function of a dataset
+def model_function(dataset, model):
+    if dataset == 'mnist':
+        return mnist.model_function()
+    if dataset == 'cifar':
+        return cifar.model_function(model)
+    return tiny_imagenet.model_function(model)
+
+# center crop of in memory images (the model input shape)
+def center_crop(images, crop_size):
+    if crop_size is None:
+        return images
+    offset = (images.shape[1] - crop_size)//2
+    return images[:, offset:offset + crop_size, offset:offset + crop_size]
+
+# session configuration with a number of threads
+def session_config(threads):
+    return tf.ConfigProto(intra_op_parallelism_threads=threads, inter_op_parallelism_threads=threads)
+
+
+################################################################################
+#
+# BENCHMARK
+#
+################################################################################
+
+# median seconds per run of an op
+def time_op(session, op, feed_dict, num_warmup, num_runs, num_repeats):
+    for run in range(num_warmup):
+        session.run(op, feed_dict=feed_dict)
+    seconds = []
+    for repeat in range(num_repeats):
+        time_start = time.time()
+        for run in range(num_runs):
+            session.run(op, feed_dict=feed_dict)
+        seconds.append((time.time() - time_start)/num_runs)
+    return float(np.median(seconds))
+
+# seconds per batch of a case
+def benchmark_case(dataset, model, mode, batch_size, threads, num_warmup, num_runs, num_repeats, seed):
+
+    # data
+    image_size, crop_size, channels, num_classes, models = BENCHMARK_DATASETS[dataset]
+    images, labels = synthetic_data(dataset, max(BENCHMARK_NUM_IMAGES, batch_size), seed)
+
+    # graph
+    with tf.Graph().as_default():
+        tf.set_random_seed(seed)
+
+        # pipeline
+        if mode == 'pipeline':
+            op        = data.dataset_arrays(images, labels, batch_size, True, crop_size, BENCHMARK_SHUFFLE_BUFFER).make_one_shot_iterator().get_next()
+            feed_dict = None
+
+        # model on a fixed batch
+        else:
+            scale, shift = data.normalization([0.5]*channels, [0.25]*channels)
+            batch        = tf.constant(center_crop(images[0:batch_size], crop_size))
+            train_state  = tf.placeholder(tf.bool, name='train_state')
+            with tf.variable_scope(multistep.MODEL_SCOPE):
+                predictions = model_function(dataset, model)(data.normalize(batch, scale, shift), train_state)
+            if mode == 'forward':
+                op        = predictions
+                feed_dict = {train_state: False}
+            else:
+                loss        = tf.losses.sparse_softmax_cross_entropy(labels=tf.constant(labels[0:batch_size]), logits=predictions)
+                global_step = tf.train.get_or_create_global_step()
+                with tf.control_dependencies(tf.get_collection(tf.GraphKeys.UPDATE_OPS)):
+                    op = mixed.adam_minimize(loss, BENCHMARK_LR, global_step)
+                feed_dict = {train_state: True}
+
+        # create a session
+        with tf.Session(config=session_config(threads)) as session:
+            session.run(tf.global_variables_initializer())
+            return time_op(session, op, feed_dict, num_warmup, num_runs, num_repeats)
+
+# all cases of the selected datasets, models, modes, batch sizes and threads
+def cases(datasets, models, modes, batch_sizes, threads):
+    for dataset in datasets:
+        for mode in modes:
+            for model in ([None] if mode == 'pipeline' else [model for model in BENCHMARK_DATASETS[dataset][4] if model in models]):
+                for batch_size in batch_sizes:
+                    for num_threads in threads:
+                        yield dataset, model, mode, batch_size, num_threads
+
+
+################################################################################
+#
+# RESULTS
+#
+################################################################################
+
+# benchmark environment and parameters
+def meta_data(args):
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'tensorflow': tf.__version__, 'numpy': np.__version__, 'python': platform.python_version(), 'platform': platform.platform(), 'processor': platform.processor(),
+            'cpu_count': os.cpu_count(), 'commit': commit, 'seed': args.seed, 'warmup': args.warmup, 'runs': args.runs, 'repeats': args.repeats}
+
+# key of a result for comparison
+def result_key(result):
+    return (result['dataset'], result['model'], result['mode'], result['batch_size'], result['threads'])
+
+# display the images / sec ratio of results to a baseline
+def print_compare(results, baseline, tolerance):
+    baseline = {result_key(result): result for result in baseline['results']}
+    print('{0:14s} {1:14s} {2:17s} {3:>6s} {4:>8s} {5:>12s} {6:>12s} {7:>7s}'.format('Dataset', 'Model', 'Mode', 'Batch', 'Threads', 'Baseline', 'Images / sec', 'Ratio'))
+    for result in results:
+        if result_key(result) not in baseline:
+            continue
+        ratio = result['images_per_sec']/baseline[result_key(result)]['images_per_sec']
+        flag  = '  slower' if ratio < 1.0 - tolerance else ''
+        print('{0:14s} {1:14s} {2:17s} {3:6d} {4:8d} {5:12.1f} {6:12.1f} {7:7.2f}{8}'.format(result['dataset'], str(result['model']), result['mode'], result['batch_size'], result['threads'],
+                                                                                            baseline[result_key(result)]['images_per_sec'], result['images_per_sec'], ratio, flag))
+
+
+################################################################################
+#
+# MAIN
+#
+################################################################################
+
+def main(argv=None):
+
+    # arguments
+    parser = argparse.ArgumentParser(description='Reproducible input pipeline and model throughput benchmark')
+    parser.add_argument('--datasets',    nargs='+', choices=sorted(BENCHMARK_DATASETS.keys()), default=['mnist', 'cifar', 'tiny_imagenet'], help='synthetic dataset shapes')
+    parser.add_argument('--models',      nargs='+', choices=['nn', 'sequential', 'sequential_bn', 'resnet'], default=['nn', 'sequential', 'sequential_bn', 'resnet'], help='models')
+    parser.add_argument('--modes',       nargs='+', choices=BENCHMARK_MODES, default=BENCHMARK_MODES, help='what is timed')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=BENCHMARK_BATCH_SIZES, help='batch sizes')
+    parser.add_argument('--threads',     nargs='+', type=int, default=BENCHMARK_THREADS, help='session thread counts')
+    parser.add_argument('--warmup',      type=int, default=BENCHMARK_WARMUP, help='untimed runs per case')
+    parser.add_argument('--runs',        type=int, default=BENCHMARK_RUNS, help='timed runs per repeat')
+    parser.add_argument('--repeats',     type=int, default=BENCHMARK_REPEATS, help='repeats per case (the median is reported)')
+    parser.add_argument('--seed',        type=int, default=BENCHMARK_SEED, help='data and initialization seed')
+    parser.add_argument('--output',      default='benchmark.json', help='results json file')
+    parser.add_argument('--compare',     default=None, help='previous results json file to compare with')
+    parser.add_argument('--tolerance',   type=float, default=BENCHMARK_TOLERANCE, help='relative slow down flagged by --compare')
+    args   = parser.parse_args(argv)
+
+    # cycle through the cases
+    results = []
+    print('{0:14s} {1:14s} {2:17s} {3:>6s} {4:>8s} {5:>12s} {6:>12s}'.format('Dataset', 'Model', 'Mode', 'Batch', 'Threads', 'ms / batch', 'Images / sec'))
+    for dataset, model, mode, batch_size, threads in cases(args.datasets, args.models, args.modes, args.batch_sizes, args.threads):
+        seconds = benchmark_case(dataset, model, mode, batch_size, threads, args.warmup, args.runs, args.repeats, args.seed)
+        results.append({'dataset': dataset, 'model': model, 'mode': mode, 'batch_size': batch_size, 'threads': threads, 'ms_per_batch': 1000.0*seconds, 'images_per_sec': batch_size/seconds})
+        print('{0:14s} {1:14s} {2:17s} {3:6d} {4:8d} {5:12.3f} {6:12.1f}'.format(dataset, str(model), mode, batch_size, threads, 1000.0*seconds, batch_size/seconds))
+
+    # write
+    with open(args.output, 'w') as file:
+        json.dump({'meta': meta_data(args), 'results': results}, file, indent=1)
+    print('Results: {0}'.format(args.output))
+
+    # compare
+    if args.compare is not None:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        print('')
+        print_compare(results, baseline, args.tolerance)
+
+if __name__ == '__main__':
+    main()
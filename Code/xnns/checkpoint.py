@@ -0,0 +1,127 @@
+################################################################################
+#
+# xnns/checkpoint.py
+#
+# DESCRIPTION
+#
+#    Asynchronous checkpointing with bounded retention and automatic resume
+#
+# DESIGN
+#
+#    1. Snapshot: 1 session.run copies every global variable (model, batch
+#                 norm statistics, optimizer slots and global_step) into a
+#                 shadow variable on the same device
+#    2. Write:    a background thread saves the shadow variables under the
+#                 original variable names with a tf.train.Saver that keeps the
+#                 last max_to_keep checkpoints, while training continues
+#    3. Resume:   the latest checkpoint in the directory is restored into the
+#                 original variables with a standard tf.train.Saver
+#
+# NOTES
+#
+#    1. Checkpoints are standard tensorflow checkpoints of the original
+#       variable names and can be restored without this module
+#    2. At most 1 write is in flight: a snapshot waits for the previous write
+#       so the shadow variables are never overwritten while being saved
+#    3. The shadow variables double the variable memory
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import collections
+import os
+import threading
+
+import tensorflow as tf
+
+
+################################################################################
+#
+# PARAMETERS
+#
+################################################################################
+
+# checkpoint file name prefix (the step is appended)
+CHECKPOINT_PREFIX = 'model.ckpt'
+
+
+################################################################################
+#
+# CHECKPOINT
+#
+################################################################################
+
+# checkpoint state
+# threads holds the in flight write (at most 1)
+Checkpoint = collections.namedtuple('Checkpoint', ['directory', 'snapshot', 'global_step', 'saver', 'restorer', 'threads'])
+
+# build the snapshot, save and restore ops for the current global variables
+# step (default global_step) numbers the checkpoint files
+def build_checkpoint(directory, max_to_keep, step=None):
+
+    # variables
+    variables = tf.global_variables()
+
+    # shadow variables
+    # not in any collection so they are not initialized, saved or restored by
+    # anything else (the snapshot assign initializes them)
+    shadows = []
+    with tf.name_scope('checkpoint'):
+        for variable in variables:
+            with tf.device(variable.device):
+                shadows.append(tf.Variable(tf.zeros(variable.shape, variable.dtype.base_dtype), trainable=False, collections=[], name=variable.op.name))
+
+    # snapshot
+    snapshot = tf.group(*[tf.assign(shadow, variable) for shadow, variable in zip(shadows, variables)])
+
+    # save the shadow variables under the original names and restore the
+    # original variables
+    saver    = tf.train.Saver({variable.op.name: shadow for variable, shadow in zip(variables, shadows)}, max_to_keep=max_to_keep)
+    restorer = tf.train.Saver(variables)
+
+    # return
+    return Checkpoint(directory, snapshot, tf.train.get_or_create_global_step() if step is None else step, saver, restorer, [])
+
+# wait for the in flight write (if any) to finish
+def wait(checkpoint):
+    for thread in checkpoint.threads:
+        thread.join()
+    del checkpoint.threads[:]
+
+# snapshot the variables and write them on a background thread
+# the training loop is only stalled for the snapshot (and for a previous write
+# that is still in flight)
+def save_async(session, checkpoint):
+
+    # snapshot
+    wait(checkpoint)
+    _, global_step = session.run([checkpoint.snapshot, checkpoint.global_step])
+
+    # write
+    path   = os.path.join(checkpoint.directory, CHECKPOINT_PREFIX)
+    thread = threading.Thread(target=checkpoint.saver.save, args=(session, path), kwargs={'global_step': int(global_step), 'write_meta_graph': False})
+    thread.start()
+    checkpoint.threads.append(thread)
+
+# restore the latest checkpoint in the directory (if any)
+# creates the directory if needed and returns the restored path or None
+def restore_latest(session, checkpoint):
+
+    # latest
+    if os.path.isdir(checkpoint.directory) == False:
+        os.makedirs(checkpoint.directory)
+    path = tf.train.latest_checkpoint(checkpoint.directory)
+
+    # restore
+    if path is not None:
+        checkpoint.restorer.restore(session, path)
+        checkpoint.saver.recover_last_checkpoints(tf.train.get_checkpoint_state(checkpoint.directory).all_model_checkpoint_paths)
+
+    # return
+    return path
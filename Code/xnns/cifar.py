@@ -0,0 +1,120 @@
+################################################################################
+#
+# xnns/cifar.py
+#
+# DESCRIPTION
+#
+#    CIFAR-10 classification command line entry point
+#
+# USAGE
+#
+#    python -m xnns.cifar [--model resnet|sequential|sequential_bn]
+#                         [--source keras|local|synthetic] [--help]
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+from xnns import data
+from xnns import models
+from xnns import profiler
+from xnns import sources
+from xnns import training
+
+
+################################################################################
+#
+# PARAMETERS
+#
+################################################################################
+
+# data
+# the mean and std dev are data.channel_stats of the training images / 255
+# (training recomputes them, inference uses these)
+DATA_NUM_CLASSES = 10
+DATA_NUM_TEST    = 10000
+DATA_IMAGE_SIZE  = 32
+DATA_MEAN        = [0.49139968, 0.48215841, 0.44653091]
+DATA_STD_DEV     = [0.24703223, 0.24348513, 0.26158784]
+
+# model
+MODEL_LEVEL_BLOCKS   = [4, 6, 3]
+MODEL_LEVEL_CHANNELS = [32, 64, 128]
+
+# training
+TRAINING_CROP_SIZE      = 28
+TRAINING_SHUFFLE_BUFFER = 5000
+TRAINING_BATCH_SIZE     = 32
+TRAINING_NUM_EPOCHS     = 112
+TRAINING_LR_INITIAL     = 0.001
+TRAINING_LR_SCALE       = 0.1
+TRAINING_LR_EPOCHS      = 48
+TRAINING_LR_STAIRCASE   = True
+
+
+################################################################################
+#
+# MODEL
+#
+################################################################################
+
+# model function for a --model name and optional --levels specs
+def model_function(model='resnet', levels=None):
+    def model_fn(data_norm, train_state):
+        if model == 'sequential':
+            return models.model_sequential(data_norm, train_state, DATA_NUM_CLASSES, MODEL_LEVEL_CHANNELS)
+        if model == 'sequential_bn':
+            return models.model_sequential_bn(data_norm, train_state, DATA_NUM_CLASSES, MODEL_LEVEL_CHANNELS)
+        if levels is not None:
+            return models.model_resnet_levels(data_norm, train_state, profiler.parse_level_specs(levels), DATA_NUM_CLASSES)
+        return models.model_resnet(data_norm, train_state, MODEL_LEVEL_BLOCKS, DATA_NUM_CLASSES)
+    return model_fn
+
+
+################################################################################
+#
+# MAIN
+#
+################################################################################
+
+# command line arguments
+def argument_parser():
+    parser = training.argument_parser('CIFAR-10 classification', TRAINING_BATCH_SIZE, TRAINING_NUM_EPOCHS, TRAINING_LR_INITIAL, TRAINING_LR_SCALE, TRAINING_LR_EPOCHS)
+    parser.add_argument('--model', choices=['resnet', 'sequential', 'sequential_bn'], default='resnet', help='model')
+    parser.add_argument('--levels', nargs='+', default=None, help='resnet width,blocks,strides per level (see xnns.profiler)')
+    sources.add_arguments(parser, sources.SOURCES, 'keras')
+    return parser
+
+def main(argv=None):
+
+    # arguments
+    parser = argument_parser()
+    args   = parser.parse_args(argv)
+    eval_batch_size = args.batch_size if args.eval_batch_size is None else args.eval_batch_size
+
+    # training and testing split (keras downloads on the first call)
+    (data_train, labels_train), (data_test, labels_test) = sources.load('cifar10', args.source, args.source_path, args.cache_dir, args.source_seed)
+
+    # normalization values
+    mean, std    = data.channel_stats(data_train)
+    scale, shift = data.normalization(mean/255.0, std/255.0)
+
+    # dataset
+    dataset_train = data.dataset_arrays(data_train, labels_train, args.batch_size, True,  TRAINING_CROP_SIZE, TRAINING_SHUFFLE_BUFFER, args.shuffle_seed)
+    dataset_test  = data.dataset_arrays(data_test,  labels_test,  eval_batch_size, False, TRAINING_CROP_SIZE)
+
+    # model
+    model_fn = model_function(args.model, args.levels)
+
+    # train
+    training.run(dataset_train, dataset_test, model_fn, scale, shift, len(data_train), len(data_test), DATA_NUM_CLASSES,
+                 args.batch_size, args.epochs, args.lr_initial, args.lr_scale, args.lr_epochs, TRAINING_LR_STAIRCASE, args.display, args.precision, args.steps_per_run,
+                 args.checkpoint_dir, args.max_checkpoints, checkpoint_batches=args.checkpoint_batches)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,399 @@
+################################################################################
+#
+# xnns/data.py
+#
+# DESCRIPTION
+#
+#    Data sources, pre processing and tf.data pipelines for MNIST, CIFAR and
+#    Tiny ImageNet
+#
+# NOTES
+#
+#    1. Nothing is downloaded or read until a load or dataset function is called
+#    2. Pipelines deliver 8 bit batches; normalization is a per channel scale
+#       and shift applied in the model graph (see normalize)
+#    3. Tiny ImageNet tfrecords and decoded .npy files are created by
+#       xNNs_Data_03_TinyImageNet.py
+#    4. Training pipelines with a shuffle_seed read through a per epoch
+#       permutation of all the records (see GLOBAL SHUFFLE)
+#    5. tfrecords are read by global record index through the sidecar offset
+#       indexes written with them (see xnns.recordio)
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import time
+
+import numpy      as np
+import tensorflow as tf
+
+# the numpy parts (see xnns.stats and xnns.recordio) are part of this module's
+# interface
+from xnns.stats    import channel_stats_init, channel_stats_merge, channel_stats_batch, channel_stats_finalize, channel_stats, normalization
+from xnns.recordio import tfrecord_files, TFRECORD_INDEX_SUFFIX, tfrecord_index_is_current, tfrecord_scan, tfrecord_locations, tfrecord_count, tfrecord_reader
+
+
+################################################################################
+#
+# NORMALIZATION
+#
+################################################################################
+
+# normalization of a batch of 8 bit images
+def normalize(images, scale, shift):
+    return tf.cast(images, tf.float32)*scale + shift
+
+
+################################################################################
+#
+# PRE PROCESSING
+#
+################################################################################
+
+# note: these functions operate on a whole batch of 8 bit images after .batch()
+# so the augmentation is a few ops per batch instead of per example
+
+# center crop of a batch of images
+def center_crop_batch(images, image_size, crop_size):
+    crop_top  = (image_size - crop_size) // 2
+    crop_left = (image_size - crop_size) // 2
+    return images[:, crop_top:crop_top + crop_size, crop_left:crop_left + crop_size, :]
+
+# random horizontal flip and crop of a batch of images with 1 gather
+def random_flip_crop_batch(images, crop_size):
+
+    # batch shape
+    shape  = tf.shape(images)
+    num    = shape[0]
+    height = shape[1]
+    width  = shape[2]
+
+    # random crop top left point and flip per image
+    top  = tf.random_uniform([num], 0, height - crop_size + 1, dtype=tf.int32)
+    left = tf.random_uniform([num], 0, width - crop_size + 1, dtype=tf.int32)
+    flip = tf.equal(tf.random_uniform([num], 0, 2, dtype=tf.int32), 1)
+
+    # source rows and cols of each cropped image (a flip reverses the cols)
+    steps = tf.range(crop_size)
+    rows  = tf.expand_dims(top, 1) + tf.expand_dims(steps, 0)
+    cols  = tf.expand_dims(left, 1) + tf.expand_dims(steps, 0)
+    cols  = tf.where(flip, tf.reverse(cols, axis=[1]), cols)
+
+    # num x crop_size x crop_size x 3 gather indices
+    index_batch = tf.tile(tf.reshape(tf.range(num), [-1, 1, 1]), [1, crop_size, crop_size])
+    index_rows  = tf.tile(tf.expand_dims(rows, 2), [1, 1, crop_size])
+    index_cols  = tf.tile(tf.expand_dims(cols, 1), [1, crop_size, 1])
+    indices     = tf.stack([index_batch, index_rows, index_cols], axis=3)
+
+    # crop and flip
+    return tf.gather_nd(images, indices)
+
+
+################################################################################
+#
+# GLOBAL SHUFFLE
+#
+################################################################################
+
+# training pipelines with a shuffle_seed read their records through a per epoch
+# permutation of all the record indices instead of a shuffle buffer
+#    the permutation of epoch e is a stateless function of (seed, e) so the
+#    order is the same after a restart and only the indices are kept in memory
+#    the pipeline starts at an (epoch, batch) position that is fed when the
+#    training iterator is initialized (see training.train_epoch) so a resumed
+#    epoch continues with the batches it had not trained on
+
+# graph collection of the start position
+SHUFFLE_POSITION = 'shuffle_position'
+
+# (epoch, batch) start position of the training pipelines of the graph
+def shuffle_position():
+    positions = tf.get_collection(SHUFFLE_POSITION)
+    if len(positions) > 0:
+        return positions[0]
+    position = tf.placeholder_with_default(tf.constant([0, 0], dtype=tf.int64), [2], name='shuffle_position')
+    tf.add_to_collection(SHUFFLE_POSITION, position)
+    return position
+
+# feed dict of the start position (empty without a global shuffle)
+def shuffle_feed(epoch, batch):
+    return {position: [epoch, batch] for position in tf.get_collection(SHUFFLE_POSITION)}
+
+# permutation of num_records indices for an epoch
+def epoch_permutation(num_records, seed, epoch):
+    keys = tf.random.stateless_uniform([num_records], seed=tf.stack([tf.constant(seed, dtype=tf.int64), epoch]))
+    return tf.argsort(keys)
+
+# dataset of record indices: the permutations of the epochs from the start
+# position on without the indices of the batches before it
+# with num_shards > 1 only every num_shards th index of each permutation from
+# shard_index on is kept, so shards with the same seed are disjoint and differ
+# in size by at most 1 record per epoch
+def dataset_permutation(num_records, batch_size, seed, num_shards=1, shard_index=0):
+    position = shuffle_position()
+    dataset  = tf.data.Dataset.range(position[0], np.iinfo(np.int64).max)
+    dataset  = dataset.flat_map(lambda epoch: tf.data.Dataset.from_tensor_slices(epoch_permutation(num_records, seed, epoch)[shard_index::num_shards]))
+    return dataset.skip(position[1]*batch_size)
+
+
+################################################################################
+#
+# IN MEMORY DATA (MNIST AND CIFAR)
+#
+################################################################################
+
+# download (first call only) and load a keras dataset ('mnist' or 'cifar10')
+def load_keras(name):
+
+    # download
+    (data_train, labels_train), (data_test, labels_test) = getattr(tf.keras.datasets, name).load_data()
+
+    # label typecast
+    labels_train = np.squeeze(labels_train.astype(np.int32))
+    labels_test  = np.squeeze(labels_test.astype(np.int32))
+
+    # return
+    return (data_train, labels_train), (data_test, labels_test)
+
+# batches of in memory arrays before pre processing (the first stage of
+# dataset_arrays)
+# batches are gathered from the arrays by index in a py_func so the arrays are
+# not copied into the graph
+# train: shuffled indices (a shuffle buffer or, with a shuffle_seed, a global
+#        shuffle) repeated
+# test:  1 pass in order with a final partial batch
+def dataset_arrays_batches(data, labels, batch_size, train, shuffle_buffer=None, shuffle_seed=None):
+
+    # gather a batch of data and labels
+    def gather(indices):
+        return data[indices], labels[indices]
+
+    # shape (lost by py_func)
+    def set_shape(data_batch, labels_batch):
+        data_batch.set_shape([None] + list(data.shape[1:]))
+        labels_batch.set_shape([None])
+        return data_batch, labels_batch
+
+    # batches of indices
+    if train == True and shuffle_seed is not None:
+        dataset = dataset_permutation(len(labels), batch_size, shuffle_seed)
+    else:
+        dataset = tf.data.Dataset.range(len(labels))
+        if train == True and shuffle_buffer is not None:
+            dataset = dataset.shuffle(shuffle_buffer)
+        if train == True:
+            dataset = dataset.repeat()
+    dataset = dataset.batch(batch_size)
+
+    # gather
+    dataset = dataset.map(lambda indices: tuple(tf.py_func(gather, [indices], [tf.as_dtype(data.dtype), tf.as_dtype(labels.dtype)], stateful=False)))
+
+    # return
+    return dataset.map(set_shape)
+
+# dataset of in memory arrays
+# train: shuffle, repeat and (if crop_size) random flip and crop
+# test:  1 pass in order with a final partial batch and (if crop_size) center
+#        crop
+# a shuffle_seed replaces the shuffle buffer with a global shuffle (see
+# dataset_arrays_batches)
+def dataset_arrays(data, labels, batch_size, train, crop_size=None, shuffle_buffer=None, shuffle_seed=None):
+
+    # batches
+    dataset = dataset_arrays_batches(data, labels, batch_size, train, shuffle_buffer, shuffle_seed)
+    if crop_size is not None and train == True:
+        dataset = dataset.map(lambda images_batch, labels_batch: (random_flip_crop_batch(images_batch, crop_size), labels_batch))
+    elif crop_size is not None:
+        dataset = dataset.map(lambda images_batch, labels_batch: (center_crop_batch(images_batch, data.shape[1], crop_size), labels_batch))
+
+    # return
+    return dataset.prefetch(1)
+
+
+################################################################################
+#
+# TFRECORD DATA (TINY IMAGENET)
+#
+################################################################################
+
+
+# parse and decode a record
+def parse_record(record, image_size):
+
+    # feature definition
+    features = \
+    {'image': tf.FixedLenFeature([], tf.string),
+     'label': tf.FixedLenFeature([], tf.int64)}
+
+    # extract a single example
+    sample = tf.parse_single_example(record, features)
+
+    # image decode
+    image = tf.image.decode_image(sample['image'], channels=3)
+    image.set_shape([image_size, image_size, 3])
+
+    # label conversion
+    label = tf.cast(sample['label'], tf.int32)
+
+    # return
+    return image, label
+
+# records of tfrecord files in training order (the first stage of
+# dataset_tfrecords_train)
+# read num_readers shuffled shards at the same time through a shuffle buffer or,
+# with a shuffle_seed, read the records of a global shuffle by permuted index
+# with num_readers parallel reads; num_shards / shard_index select a disjoint
+# record shard of the global shuffle (see dataset_permutation)
+def dataset_tfrecords_records(tfrecords, batch_size, shuffle_buffer, num_readers=8, shuffle_seed=None, num_shards=1, shard_index=0):
+
+    # read globally shuffled records
+    if shuffle_seed is not None:
+        locations = tfrecord_locations(tfrecords)
+        read      = tfrecord_reader(tfrecords, locations)
+        dataset   = dataset_permutation(len(locations), batch_size, shuffle_seed, num_shards, shard_index).batch(batch_size)
+        dataset   = dataset.map(lambda indices: tf.reshape(tf.py_func(read, [indices], tf.string, stateful=True), [-1]), num_parallel_calls=num_readers)
+        dataset   = dataset.apply(tf.data.experimental.unbatch())
+
+    # read
+    else:
+        dataset = tf.data.Dataset.from_tensor_slices(tfrecords).shuffle(len(tfrecords)).repeat()
+        dataset = dataset.apply(tf.data.experimental.parallel_interleave(tf.data.TFRecordDataset, cycle_length=num_readers, sloppy=True))
+        dataset = dataset.shuffle(buffer_size=shuffle_buffer)
+
+    # return
+    return dataset
+
+# training dataset of tfrecords
+# read (see dataset_tfrecords_records), decode and batch with num_calls
+# parallel calls, augment per batch and prefetch
+def dataset_tfrecords_train(tfrecords, image_size, crop_size, batch_size, shuffle_buffer, num_readers=8, num_calls=8, prefetch=2, shuffle_seed=None, num_shards=1, shard_index=0):
+
+    # read
+    dataset = dataset_tfrecords_records(tfrecords, batch_size, shuffle_buffer, num_readers, shuffle_seed, num_shards, shard_index)
+
+    # decode, batch and augment
+    dataset = dataset.apply(tf.data.experimental.map_and_batch(lambda record: parse_record(record, image_size), batch_size, num_parallel_calls=num_calls))
+    dataset = dataset.map(lambda images, labels: (random_flip_crop_batch(images, crop_size), labels))
+
+    # return
+    return dataset.prefetch(prefetch)
+
+# validation dataset of tfrecords
+# 1 pass with a final partial batch and order is kept so saved predictions line
+# up with the data
+def dataset_tfrecords_val(tfrecords, image_size, crop_size, batch_size, num_calls=8, prefetch=2):
+
+    # decode, batch and crop
+    dataset = tf.data.TFRecordDataset(tfrecords)
+    dataset = dataset.apply(tf.data.experimental.map_and_batch(lambda record: parse_record(record, image_size), batch_size, num_parallel_calls=num_calls))
+    dataset = dataset.map(lambda images, labels: (center_crop_batch(images, image_size, crop_size), labels))
+
+    # return
+    return dataset.prefetch(prefetch)
+
+
+################################################################################
+#
+# DECODED DATA (TINY IMAGENET)
+#
+################################################################################
+
+# dataset of memory mapped pre decoded images
+# the images .npy (N x rows x cols x 3 uint8) is memory mapped so the operating
+# system page cache is shared by all training processes and there is no
+# parsing or decoding per epoch
+# train: shuffled and repeated, test: 1 pass with a final partial batch
+# a shuffle_seed makes the training shuffle a global shuffle
+def dataset_decoded(images_path, labels_path, crop_size, batch_size, train, num_calls=8, prefetch=2, shuffle_seed=None):
+
+    # memory map
+    images_all = np.load(images_path, mmap_mode='r')
+    labels_all = np.load(labels_path)
+    num_images = len(labels_all)
+    image_size = images_all.shape[1]
+
+    # gather a batch of images and labels with a random horizontal flip and crop
+    def gather_train(indices):
+
+        # gather
+        # sorted indices read the memory map in file order
+        indices = np.sort(indices)
+        images  = images_all[indices]
+        labels  = labels_all[indices]
+        num     = len(indices)
+
+        # random crop top left point and flip
+        top  = np.random.randint(0, image_size - crop_size + 1, size=num)
+        left = np.random.randint(0, image_size - crop_size + 1, size=num)
+        flip = np.random.rand(num) < 0.5
+
+        # crop and flip with 1 gather
+        rows = top[:, None]  + np.arange(crop_size)
+        cols = left[:, None] + np.arange(crop_size)
+        cols = np.where(flip[:, None], cols[:, ::-1], cols)
+
+        # return
+        return images[np.arange(num)[:, None, None], rows[:, :, None], cols[:, None, :]], labels
+
+    # gather a batch of images and labels with a center crop
+    def gather_val(indices):
+        crop_top  = (image_size - crop_size) // 2
+        crop_left = (image_size - crop_size) // 2
+        return images_all[indices, crop_top:crop_top + crop_size, crop_left:crop_left + crop_size, :], labels_all[indices]
+
+    # shape (lost by py_func)
+    def set_shape(images, labels):
+        images.set_shape([None, crop_size, crop_size, 3])
+        labels.set_shape([None])
+        return images, labels
+
+    # batches of indices
+    if train == True and shuffle_seed is not None:
+        dataset = dataset_permutation(num_images, batch_size, shuffle_seed)
+    else:
+        dataset = tf.data.Dataset.range(num_images)
+        if train == True:
+            dataset = dataset.shuffle(num_images).repeat()
+    dataset = dataset.batch(batch_size)
+
+    # gather
+    gather  = gather_train if train == True else gather_val
+    dataset = dataset.map(lambda indices: tuple(tf.py_func(gather, [indices], [tf.uint8, tf.int32], stateful=train)), num_parallel_calls=num_calls)
+    dataset = dataset.map(set_shape)
+
+    # return
+    return dataset.prefetch(prefetch)
+
+
+################################################################################
+#
+# PIPELINE THROUGHPUT
+#
+################################################################################
+
+# measure the images / sec a dataset delivers without the model
+def benchmark_pipeline(dataset, num_batches, num_warmup=10):
+
+    # iterator
+    images, _  = dataset.make_one_shot_iterator().get_next()
+    num_images = tf.shape(images)[0]
+
+    # time num_batches batches after a warm up (fill the shuffle and prefetch
+    # buffers)
+    with tf.Session() as session:
+        for batch_index in range(num_warmup):
+            session.run(num_images)
+        total      = 0
+        time_start = time.time()
+        for batch_index in range(num_batches):
+            total += session.run(num_images)
+        time_total = time.time() - time_start
+
+    # return
+    return total/time_total
@@ -0,0 +1,302 @@
+################################################################################
+#
+# xnns/distributed.py
+#
+# DESCRIPTION
+#
+#    Data parallel Tiny ImageNet training across local CPU worker processes
+#    with a gradient all reduce before each Adam update
+#
+# DESIGN
+#
+#    1. Cluster:  num_workers tf.train.Server processes on localhost, 1 per
+#                 worker, each with an equal share of the CPU threads
+#    2. Data:     all workers permute all the training records with the same
+#                 --shuffle-seed and worker i reads every num_workers th record
+#                 of the permutation from i on, so the workers get disjoint
+#                 record shards of equal size (+-1) every epoch; with
+#                 --no-global-shuffle worker i reads the tfrecord shards
+#                 shards[i::num_workers] instead, which are unequal in size
+#                 when the number of shards is not a multiple of --workers
+#    3. Model:    every worker builds the same graph with the same random seed
+#                 so the initial variables are identical; the augmentation
+#                 (and shuffle buffer) is seeded per worker so the workers do
+#                 not flip and crop their shards identically
+#    4. Gradients: all gradients are packed into 1 vector and averaged across
+#                 the workers with 1 collective all reduce per step so the
+#                 variables stay identical
+#    5. Learning rate: the effective batch is num_workers*batch_size; the
+#                 initial learning rate is scaled by num_workers (linear) or
+#                 sqrt(num_workers) (sqrt) and ramped up from the unscaled
+#                 value over the first warm up epochs
+#    6. Testing:  worker 0 validates and displays after each epoch
+#
+# USAGE
+#
+#    python -m xnns.distributed --workers 4 --tfrecords-dir ./data/tiny-imagenet-200/
+#    python -m xnns.distributed --benchmark 1 2 4 8
+#
+#    --benchmark measures the training throughput of model_resnet on synthetic
+#    data for each number of workers instead of training
+#
+# NOTES
+#
+#    1. Batch norm moving statistics are per worker (worker 0 is used for
+#       testing)
+#    2. Uses the tensorflow 1.x collective ops
+#    3. --steps-per-run and --checkpoint-dir are not supported (1 step per
+#       session.run, no checkpoints) and rejected
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import multiprocessing
+import os
+import time
+
+import numpy      as np
+import tensorflow as tf
+
+from tensorflow.python.ops import collective_ops
+
+from xnns import data
+from xnns import evaluation
+from xnns import models
+from xnns import tiny_imagenet
+from xnns import training
+
+
+################################################################################
+#
+# PARAMETERS
+#
+################################################################################
+
+# cluster
+DISTRIBUTED_NUM_WORKERS = 4
+DISTRIBUTED_PORT        = 2222
+DISTRIBUTED_SEED        = 1
+DISTRIBUTED_GROUP_KEY   = 1
+
+# learning rate scaling
+DISTRIBUTED_LR_RULE          = 'linear'
+DISTRIBUTED_LR_WARMUP_EPOCHS = 5
+
+# benchmark
+DISTRIBUTED_BENCHMARK_STEPS = 50
+
+
+################################################################################
+#
+# CLUSTER
+#
+################################################################################
+
+# cluster of num_workers workers on localhost
+def cluster_spec(num_workers, port):
+    return tf.train.ClusterSpec({'worker': ['localhost:{0:d}'.format(port + task_index) for task_index in range(num_workers)]})
+
+# session config of a worker
+# the CPU threads are split between the workers and worker 0 leads the
+# collective group
+def worker_config(task_index, num_workers):
+    num_threads = max(1, (os.cpu_count() or 1) // num_workers)
+    config      = tf.ConfigProto(intra_op_parallelism_threads=num_threads, inter_op_parallelism_threads=2)
+    config.experimental.collective_group_leader = '/job:worker/replica:0/task:0'
+    config.device_filters.append('/job:worker/task:{0:d}'.format(task_index))
+    return config
+
+# learning rate scale for num_workers workers
+def lr_rule_scale(rule, num_workers):
+    if rule == 'linear':
+        return float(num_workers)
+    if rule == 'sqrt':
+        return float(np.sqrt(num_workers))
+    return 1.0
+
+
+################################################################################
+#
+# ALL REDUCE
+#
+################################################################################
+
+# average the gradients across the workers
+# the gradients are packed into 1 vector so each step is 1 all reduce (the
+# instance key is fixed as the graph has 1 all reduce)
+def all_reduce_mean(grads_and_vars, num_workers):
+
+    # pack
+    grads_and_vars = [(grad, var) for grad, var in grads_and_vars if grad is not None]
+    shapes         = [grad.shape for grad, var in grads_and_vars]
+    sizes          = [shape.num_elements() for shape in shapes]
+    packed         = tf.concat([tf.reshape(grad, [-1]) for grad, var in grads_and_vars], axis=0)
+
+    # all reduce
+    packed = collective_ops.all_reduce(packed, num_workers, DISTRIBUTED_GROUP_KEY, 1, 'Add', 'Div')
+
+    # unpack
+    grads = [tf.reshape(grad, shape) for grad, shape in zip(tf.split(packed, sizes), shapes)]
+
+    # return
+    return [(grad, var) for grad, (_, var) in zip(grads, grads_and_vars)]
+
+
+################################################################################
+#
+# WORKER
+#
+################################################################################
+
+# worker process
+# task = (task_index, num_workers, parameters) with parameters a dict of the
+# command line arguments
+# returns the training images per second of the worker
+def worker(task):
+
+    # task
+    task_index, num_workers, parameters = task
+
+    # server
+    config = worker_config(task_index, num_workers)
+    server = tf.train.Server(cluster_spec(num_workers, parameters['port']), job_name='worker', task_index=task_index, config=config)
+
+    # graph
+    with tf.Graph().as_default(), tf.device('/job:worker/replica:0/task:{0:d}'.format(task_index)):
+
+        # different augmentation (and shuffle buffer) on every worker
+        tf.set_random_seed(DISTRIBUTED_SEED + task_index)
+
+        # dataset
+        # worker task_index reads every num_workers th record of the global
+        # permutation (or every num_workers th shard without one)
+        batch_size = parameters['batch_size']
+        if parameters['benchmark'] == True:
+            images        = np.random.randint(0, 256, size=(batch_size, tiny_imagenet.TRAINING_CROP_SIZE, tiny_imagenet.TRAINING_CROP_SIZE, 3), dtype=np.uint8)
+            labels        = np.random.randint(0, tiny_imagenet.DATA_NUM_CLASSES, size=(batch_size,), dtype=np.int32)
+            dataset_train = tf.data.Dataset.from_tensors((images, labels)).repeat()
+            dataset_val   = dataset_train.take(1)
+        else:
+            tfrecords_train = data.tfrecord_files(os.path.join(parameters['tfrecords_dir'], tiny_imagenet.DATA_TFRECORDS_TRAIN), tiny_imagenet.DATA_NUM_SHARDS_TRAIN)
+            tfrecords_val   = data.tfrecord_files(os.path.join(parameters['tfrecords_dir'], tiny_imagenet.DATA_TFRECORDS_VAL),   tiny_imagenet.DATA_NUM_SHARDS_VAL)
+            num_threads     = config.intra_op_parallelism_threads
+            if parameters['shuffle_seed'] is not None:
+                dataset_train = data.dataset_tfrecords_train(tfrecords_train, tiny_imagenet.TRAINING_IMAGE_SIZE, tiny_imagenet.TRAINING_CROP_SIZE, batch_size, tiny_imagenet.TRAINING_SHUFFLE_BUFFER, num_threads, num_threads,
+                                                             shuffle_seed=parameters['shuffle_seed'], num_shards=num_workers, shard_index=task_index)
+            else:
+                tfrecords_train = tfrecords_train[task_index::num_workers]
+                dataset_train   = data.dataset_tfrecords_train(tfrecords_train, tiny_imagenet.TRAINING_IMAGE_SIZE, tiny_imagenet.TRAINING_CROP_SIZE, batch_size, tiny_imagenet.TRAINING_SHUFFLE_BUFFER, len(tfrecords_train), num_threads)
+            eval_batch_size = batch_size if parameters['eval_batch_size'] is None else parameters['eval_batch_size']
+            dataset_val     = data.dataset_tfrecords_val(tfrecords_val, tiny_imagenet.TRAINING_IMAGE_SIZE, tiny_imagenet.TRAINING_CROP_SIZE, eval_batch_size, num_threads)
+
+        # model
+        def model_fn(data_norm, train_state):
+            return models.model_resnet(data_norm, train_state, tiny_imagenet.MODEL_LEVEL_BLOCKS, tiny_imagenet.DATA_NUM_CLASSES)
+
+        # graph
+        # same initial variables on every worker (the datasets above are built
+        # the same on every worker so the op seeds derived from the graph seed
+        # match)
+        # the epoch is num_workers times fewer steps of a num_workers times
+        # larger effective batch
+        num_batches_train = int(tiny_imagenet.DATA_NUM_TRAIN/(batch_size*num_workers))
+        lr_scale_workers  = lr_rule_scale(parameters['lr_rule'], num_workers)
+        scale, shift      = data.normalization(tiny_imagenet.DATA_MEAN, tiny_imagenet.DATA_STD_DEV)
+        gradients_fn      = (lambda grads_and_vars: all_reduce_mean(grads_and_vars, num_workers)) if num_workers > 1 else None
+        tf.set_random_seed(DISTRIBUTED_SEED)
+        graph             = training.build_graph(dataset_train, dataset_val, model_fn, scale, shift, num_batches_train,
+                                                 lr_scale_workers*parameters['lr_initial'], parameters['lr_scale'], parameters['lr_epochs'], tiny_imagenet.TRAINING_LR_STAIRCASE,
+                                                 parameters['precision'], 1, parameters['display'], parameters['lr_warmup_epochs'], 1.0/lr_scale_workers, gradients_fn)
+
+        # create a session
+        with tf.Session(server.target, config=config) as session:
+
+            # initialize global variables
+            session.run(tf.global_variables_initializer())
+
+            # benchmark
+            if parameters['benchmark'] == True:
+                training.train_epoch(session, graph, 5)
+                time_start = time.time()
+                training.train_epoch(session, graph, parameters['benchmark_steps'])
+                return parameters['benchmark_steps']*batch_size/(time.time() - time_start)
+
+            # cycle through the epochs
+            metrics    = None
+            time_start = time.time()
+            for epoch_index in range(parameters['epochs']):
+
+                # train
+                training.train_epoch(session, graph, num_batches_train, epoch=epoch_index)
+
+                # validate and display on worker 0
+                if task_index == 0:
+                    metrics = evaluation.evaluate(session, graph)
+                    print('Epoch {0:3d}: top 1 / top 5 accuracy on the {1:d} test images is {2:5.2f} / {3:5.2f} % and the loss is {4:6.4f}'.format(epoch_index, metrics['count'], 100.0*metrics['top1'], 100.0*metrics['top5'], metrics['loss']))
+
+            # display with the trained variables
+            if task_index == 0 and parameters['display'] > 0 and metrics is not None:
+                evaluation.display(session, graph, metrics['predictions'], parameters['display'])
+
+            # return
+            return parameters['epochs']*num_batches_train*batch_size/(time.time() - time_start)
+
+# run num_workers worker processes and return their images per second
+def launch(num_workers, parameters):
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(num_workers, maxtasksperchild=1) as pool:
+        return pool.map(worker, [(task_index, num_workers, parameters) for task_index in range(num_workers)], chunksize=1)
+
+
+################################################################################
+#
+# MAIN
+#
+################################################################################
+
+def main(argv=None):
+
+    # arguments
+    parser = training.argument_parser('Data parallel Tiny ImageNet classification', tiny_imagenet.TRAINING_BATCH_SIZE, tiny_imagenet.TRAINING_NUM_EPOCHS, tiny_imagenet.TRAINING_LR_INITIAL, tiny_imagenet.TRAINING_LR_SCALE, tiny_imagenet.TRAINING_LR_EPOCHS)
+    parser.add_argument('--workers',          type=int, default=DISTRIBUTED_NUM_WORKERS, help='local worker processes (batch size is per worker)')
+    parser.add_argument('--port',             type=int, default=DISTRIBUTED_PORT, help='port of worker 0 (worker i uses port + i)')
+    parser.add_argument('--lr-rule',          choices=['linear', 'sqrt', 'none'], default=DISTRIBUTED_LR_RULE, help='initial learning rate scaling with the number of workers')
+    parser.add_argument('--lr-warmup-epochs', type=int, default=DISTRIBUTED_LR_WARMUP_EPOCHS, help='epochs to ramp up from the unscaled learning rate')
+    parser.add_argument('--tfrecords-dir',    default=tiny_imagenet.DATA_TFRECORDS_DIR, help='directory with the tfrecords')
+    parser.add_argument('--benchmark',        nargs='+', type=int, default=None, help='benchmark these numbers of workers on synthetic data instead of training')
+    parser.add_argument('--benchmark-steps',  type=int, default=DISTRIBUTED_BENCHMARK_STEPS, help='timed training steps per benchmark')
+    args   = parser.parse_args(argv)
+    if args.steps_per_run != 1 or args.checkpoint_dir is not None:
+        parser.error('--steps-per-run and --checkpoint-dir are not supported with multiple workers')
+
+    # parameters
+    parameters              = vars(args)
+    parameters['benchmark'] = False
+
+    # train
+    if args.benchmark is None:
+        images_per_sec = launch(args.workers, parameters)
+        print('Training throughput with {0:d} workers: {1:8.1f} images / sec'.format(args.workers, sum(images_per_sec)))
+        return
+
+    # benchmark
+    # each number of workers gets its own ports
+    parameters['benchmark'] = True
+    throughput_1            = None
+    print('{0:>7s} {1:>14s} {2:>12s} {3:>10s}'.format('Workers', 'Images / sec', 'Speed up', 'Efficiency'))
+    for run_index, num_workers in enumerate(args.benchmark):
+        parameters['port'] = args.port + 100*run_index
+        throughput         = sum(launch(num_workers, parameters))
+        if throughput_1 is None:
+            throughput_1 = throughput/args.benchmark[0]
+        speed_up = throughput/throughput_1
+        print('{0:7d} {1:14.1f} {2:12.2f} {3:9.1f}%'.format(num_workers, throughput, speed_up, 100.0*speed_up/num_workers))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+################################################################################
+#
+# xnns/evaluation.py
+#
+# DESCRIPTION
+#
+#    Streaming validation metrics (top 1 / top 5 accuracy, loss and confusion
+#    matrix accumulated on the device), validation loop and display of
+#    predictions
+#
+# NOTES
+#
+#    1. The word testing as used here is really validation
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import collections
+
+import numpy      as np
+import tensorflow as tf
+
+
+################################################################################
+#
+# METRICS
+#
+################################################################################
+
+# streaming testing metrics
+# update: accumulates a batch into the (local) metric variables on the device
+# reset:  zeros the metric variables
+# values: dict of count, top1, top5, loss (means over count) and confusion
+#         (labels x predicted labels) fetched once per evaluation
+# reservoir: the first num_reservoir testing predictions (None if 0)
+Metrics = collections.namedtuple('Metrics', ['update', 'reset', 'values', 'reservoir'])
+
+# local (not saved or globally initialized) metric variable
+def metric_variable(shape, dtype, name):
+    return tf.Variable(tf.zeros(shape, dtype=dtype), trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES], name=name)
+
+# build the streaming metrics of predictions (batch x num_classes)
+def build_metrics(predictions, labels, num_classes, num_reservoir=0):
+
+    # variables
+    with tf.variable_scope('metrics'):
+        count      = metric_variable([],                         tf.int64,   'count')
+        top1       = metric_variable([],                         tf.int64,   'top1')
+        top5       = metric_variable([],                         tf.int64,   'top5')
+        loss       = metric_variable([],                         tf.float64, 'loss')
+        confusion  = metric_variable([num_classes, num_classes], tf.int64,   'confusion')
+        variables  = [count, top1, top5, loss, confusion]
+        if num_reservoir > 0:
+            reservoir = metric_variable([num_reservoir, num_classes], tf.float32, 'reservoir')
+            variables.append(reservoir)
+
+    # batch values
+    labels          = tf.cast(labels, tf.int32)
+    batch_count     = tf.shape(labels, out_type=tf.int64)[0]
+    batch_top1      = tf.reduce_sum(tf.cast(tf.nn.in_top_k(predictions, labels, 1), tf.int64))
+    batch_top5      = tf.reduce_sum(tf.cast(tf.nn.in_top_k(predictions, labels, min(5, num_classes)), tf.int64))
+    batch_loss      = tf.reduce_sum(tf.cast(tf.nn.sparse_softmax_cross_entropy_with_logits(labels=labels, logits=predictions), tf.float64))
+    batch_confusion = tf.confusion_matrix(labels, tf.argmax(predictions, 1, output_type=tf.int32), num_classes, dtype=tf.int64)
+
+    # update
+    updates = [tf.assign_add(top1, batch_top1), tf.assign_add(top5, batch_top5), tf.assign_add(loss, batch_loss), tf.assign_add(confusion, batch_confusion)]
+    if num_reservoir > 0:
+        # rows count ... count + batch - 1 that are still inside the reservoir
+        rows = tf.range(batch_count) + count
+        keep = tf.less(rows, num_reservoir)
+        updates.append(tf.scatter_update(reservoir, tf.boolean_mask(rows, keep), tf.boolean_mask(predictions, keep)))
+    with tf.control_dependencies(updates):
+        update = tf.assign_add(count, batch_count)
+
+    # values
+    count_float = tf.maximum(tf.cast(count, tf.float64), 1.0)
+    values      = {'count':     count,
+                   'top1':      tf.cast(top1, tf.float64)/count_float,
+                   'top5':      tf.cast(top5, tf.float64)/count_float,
+                   'loss':      loss/count_float,
+                   'confusion': confusion}
+
+    # return
+    return Metrics(update, tf.variables_initializer(variables), values, reservoir if num_reservoir > 0 else None)
+
+
+################################################################################
+#
+# EVALUATION
+#
+################################################################################
+
+# validate
+# initialize the iterator to the testing dataset and reset the metrics
+# cycle through the testing batches until the (1 pass) dataset is exhausted so
+# every testing example is counted exactly once, including a final partial
+# batch, for any batch size
+# example, encoder, decoder, metric update (nothing is fetched per batch)
+# returns the metric values and, with a reservoir, its predictions
+def evaluate(session, graph):
+
+    # validate
+    session.run([graph.iterator_init_test, graph.metrics.reset])
+    while True:
+        try:
+            session.run(graph.metrics.update, feed_dict={graph.train_state: False})
+        except tf.errors.OutOfRangeError:
+            break
+
+    # fetch once
+    values = session.run(graph.metrics.values)
+    if graph.metrics.reservoir is not None:
+        values['predictions'] = session.run(graph.metrics.reservoir)[0:values['count'], :]
+
+    # return
+    return values
+
+
+################################################################################
+#
+# DISPLAY
+#
+################################################################################
+
+# display the first num_display testing images with their saved predictions
+# (the metrics reservoir)
+# matplotlib is only imported here so the package does not need a display
+def display(session, graph, predictions_test, num_display):
+
+    # display
+    import matplotlib.pyplot as plt
+
+    # generate data and labels
+    session.run(graph.iterator_init_test)
+    images_batch, labels_batch = session.run([graph.images, graph.labels])
+
+    # convert the final saved predictions to labels
+    num_display        = min(num_display, len(labels_batch))
+    predictions_labels = np.argmax(predictions_test[0:num_display, :], axis=1)
+
+    # cycle through the images
+    for image_index in range(num_display):
+
+        # display the predicted label, actual label and image
+        print('Predicted label: {0:1d} and actual label: {1:1d}'.format(predictions_labels[image_index], labels_batch[image_index]))
+        if images_batch.ndim == 3:
+            plt.imshow(images_batch[image_index, :, :], cmap='gray')
+        else:
+            plt.imshow(images_batch[image_index, :, :, :])
+        plt.show()
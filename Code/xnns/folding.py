@@ -0,0 +1,304 @@
+################################################################################
+#
+# xnns/folding.py
+#
+# DESCRIPTION
+#
+#    Batch norm folding and inference graph optimization
+#
+#    From the trained variables an inference only graph of constants is built
+#    with the batch norms removed
+#       conv - bn - relu: the bn scale is folded into the conv kernel and the
+#                         bn shift becomes the conv bias (model_sequential_bn
+#                         and the 2 inner convs of each resnet bottleneck)
+#       bn - relu:        where the bn input is not a conv output (the pre
+#                         activation of each resnet bottleneck and the final
+#                         bn) the bn is a per channel affine fused with the
+#                         relu
+#    No training ops (moving average updates, train_state branches, variables)
+#    are in the graph
+#
+# USAGE
+#
+#    python -m xnns.folding --example cifar --checkpoint ./logs/ --export folded.pb
+#
+#    Reports the node count and size of the reference (frozen inference mode)
+#    and folded graphs, the maximum output difference and top 1 agreement on
+#    random images and the latency of both per batch size
+#
+# NOTES
+#
+#    1. Supported models are sequential_bn and resnet (model_nn and
+#       sequential have no batch norm)
+#    2. Without --checkpoint the variables are randomly initialized and the
+#       batch norm parameters and statistics randomized so the folding is
+#       exercised (for benchmarking only)
+#    3. Layers are matched to variables by the tf.layers creation order
+#       (conv2d, conv2d_1, ...) of models.py
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import argparse
+import time
+
+import numpy      as np
+import tensorflow as tf
+
+from xnns import cifar
+from xnns import data
+from xnns import inference
+from xnns import models
+from xnns import multistep
+from xnns import profiler
+from xnns import tiny_imagenet
+from xnns import weights
+
+
+################################################################################
+#
+# PARAMETERS
+#
+################################################################################
+
+# tf.layers.batch_normalization default epsilon
+FOLDING_BN_EPSILON = 1e-3
+
+# benchmark
+FOLDING_BATCH_SIZES = [1, 32, 256]
+FOLDING_NUM_RUNS    = 20
+
+
+################################################################################
+#
+# VARIABLES
+#
+################################################################################
+
+# next batch norm as a per channel scale and shift
+def read_bn(reader):
+    gamma, beta, mean, variance = weights.read_layer(reader, 'batch_normalization', ['gamma', 'beta', 'moving_mean', 'moving_variance'])
+    scale                       = gamma/np.sqrt(variance + FOLDING_BN_EPSILON)
+    return scale, beta - mean*scale
+
+
+################################################################################
+#
+# FOLDED LAYERS
+#
+################################################################################
+
+# convolution with constant kernel and optional bias and relu
+def conv(fm, kernel, strides=1, bias=None, relu=False):
+    fm = tf.nn.conv2d(fm, tf.constant(kernel, dtype=tf.float32), [1, strides, strides, 1], padding='SAME')
+    if bias is not None:
+        fm = tf.nn.bias_add(fm, tf.constant(bias, dtype=tf.float32))
+    if relu == True:
+        fm = tf.nn.relu(fm)
+    return fm
+
+# conv - bn - relu as 1 conv with the bn folded into the kernel and bias
+def conv_bn_relu(reader, fm, strides=1):
+    kernel,      = weights.read_layer(reader, 'conv2d', ['kernel'])
+    scale, shift = read_bn(reader)
+    return conv(fm, kernel*scale, strides, shift, True)
+
+# bn - relu as a fused affine relu
+def affine_relu(fm, scale, shift):
+    return tf.nn.relu(fm*tf.constant(scale, dtype=tf.float32) + tf.constant(shift, dtype=tf.float32))
+
+# decoder
+def decoder(reader, fm):
+    kernel, bias = weights.read_layer(reader, 'dense', ['kernel', 'bias'])
+    return tf.nn.xw_plus_b(tf.reduce_mean(fm, axis=[1, 2]), tf.constant(kernel), tf.constant(bias))
+
+
+################################################################################
+#
+# FOLDED MODELS
+#
+################################################################################
+
+# folded models.model_sequential_bn
+def folded_sequential_bn(reader, data_norm, level_channels):
+    fm = data_norm
+    for level, channels in enumerate(level_channels):
+        if level > 0:
+            fm = tf.nn.max_pool(fm, [1, 3, 3, 1], [1, 2, 2, 1], padding='SAME')
+        for layer in range(3):
+            fm = conv_bn_relu(reader, fm)
+    return decoder(reader, fm)
+
+# folded models.bottleneck
+# the variables are read in the per kind creation order of models.bottleneck
+def folded_bottleneck(reader, fm_id, strides, projection):
+    scale, shift = read_bn(reader)
+    fm_residual  = affine_relu(fm_id, scale, shift)
+    fm_residual  = conv_bn_relu(reader, fm_residual, strides)
+    fm_residual  = conv_bn_relu(reader, fm_residual)
+    kernel,      = weights.read_layer(reader, 'conv2d', ['kernel'])
+    fm_residual  = conv(fm_residual, kernel)
+    if projection == True:
+        kernel, = weights.read_layer(reader, 'conv2d', ['kernel'])
+        fm_id   = conv(fm_id, kernel, strides)
+    return tf.add(fm_id, fm_residual)
+
+# folded models.model_resnet_levels
+def folded_resnet_levels(reader, data_norm, level_specs):
+
+    # encoder - tail
+    kernel, = weights.read_layer(reader, 'conv2d', ['kernel'])
+    fm_id   = conv(data_norm, kernel)
+
+    # encoder - levels
+    for width, num_blocks, strides in level_specs:
+        fm_id = folded_bottleneck(reader, fm_id, strides, True)
+        for block in range(num_blocks - 1):
+            fm_id = folded_bottleneck(reader, fm_id, 1, False)
+
+    # encoder - special block x1
+    scale, shift = read_bn(reader)
+    fm_id        = affine_relu(fm_id, scale, shift)
+
+    # decoder
+    return decoder(reader, fm_id)
+
+# folded model function (reader, data_norm) -> predictions of an example model
+def folded_function(example, model, levels=None):
+    module = cifar if example == 'cifar' else tiny_imagenet
+    if model == 'sequential_bn':
+        return lambda reader, data_norm: folded_sequential_bn(reader, data_norm, module.MODEL_LEVEL_CHANNELS)
+    if model == 'resnet':
+        level_specs = profiler.parse_level_specs(levels) if levels is not None else models.resnet_level_specs(module.MODEL_LEVEL_BLOCKS)
+        return lambda reader, data_norm: folded_resnet_levels(reader, data_norm, level_specs)
+    raise ValueError('{0} has no batch norm to fold'.format(model))
+
+
+################################################################################
+#
+# GRAPHS
+#
+################################################################################
+
+# reference inference graph and the trained variable values
+# returns the frozen graph (input images, output predictions) and a dict of
+# the model variable values
+def reference_graph(model_fn, crop_size, channels, scale, shift, checkpoint):
+
+    # graph
+    with tf.Graph().as_default() as graph:
+
+        # model in inference mode
+        images = tf.placeholder(tf.uint8, [None, crop_size, crop_size, channels], name='images')
+        with tf.variable_scope(multistep.MODEL_SCOPE):
+            predictions = model_fn(data.normalize(images, scale, shift), False)
+        tf.identity(predictions, name='predictions')
+        variables = tf.global_variables(scope=multistep.MODEL_SCOPE)
+
+        # variables
+        with tf.Session() as session:
+            if checkpoint is None:
+                session.run(tf.global_variables_initializer())
+                randomize_bn(session, variables)
+            else:
+                if tf.gfile.IsDirectory(checkpoint):
+                    checkpoint = tf.train.latest_checkpoint(checkpoint)
+                tf.train.Saver(variables).restore(session, checkpoint)
+            values    = dict(zip([variable.op.name for variable in variables], session.run(variables)))
+            graph_def = tf.graph_util.convert_variables_to_constants(session, graph.as_graph_def(), ['predictions'])
+
+    # return
+    return tf.graph_util.remove_training_nodes(graph_def, protected_nodes=['images', 'predictions']), values
+
+# random batch norm parameters and statistics
+def randomize_bn(session, variables):
+    ranges = {'gamma': (0.5, 1.5), 'beta': (-0.1, 0.1), 'moving_mean': (-0.1, 0.1), 'moving_variance': (0.5, 2.0)}
+    for variable in variables:
+        name = variable.op.name.split('/')[-1]
+        if name in ranges:
+            variable.load(np.random.uniform(ranges[name][0], ranges[name][1], size=variable.shape.as_list()).astype(np.float32), session)
+
+# folded inference graph (input images, output predictions)
+def folded_graph(folded_fn, values, crop_size, channels, scale, shift):
+    with tf.Graph().as_default() as graph:
+        images = tf.placeholder(tf.uint8, [None, crop_size, crop_size, channels], name='images')
+        tf.identity(folded_fn(weights.reader_init(values), data.normalize(images, scale, shift)), name='predictions')
+        return graph.as_graph_def()
+
+# session of a graph def with its images and predictions tensors
+def load_graph(graph_def):
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name='')
+    return tf.Session(graph=graph), graph.get_tensor_by_name('images:0'), graph.get_tensor_by_name('predictions:0')
+
+# seconds per batch
+def latency(session, images, predictions, batch, num_runs):
+    session.run(predictions, feed_dict={images: batch})
+    time_start = time.time()
+    for run in range(num_runs):
+        session.run(predictions, feed_dict={images: batch})
+    return (time.time() - time_start)/num_runs
+
+
+################################################################################
+#
+# MAIN
+#
+################################################################################
+
+def main(argv=None):
+
+    # arguments
+    parser = argparse.ArgumentParser(description='Batch norm folding and inference graph optimization')
+    parser.add_argument('--example',     choices=['cifar', 'tiny_imagenet'], default='cifar', help='example the checkpoint was trained with')
+    parser.add_argument('--model',       choices=['resnet', 'sequential_bn'], default='resnet', help='model')
+    parser.add_argument('--levels',      nargs='+', default=None, help='resnet width,blocks,strides per level (see xnns.profiler)')
+    parser.add_argument('--checkpoint',  default=None, help='checkpoint path or directory (random weights if not given)')
+    parser.add_argument('--export',      default=None, help='write the folded graph to this .pb file')
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=FOLDING_BATCH_SIZES, help='benchmark batch sizes')
+    parser.add_argument('--runs',        type=int, default=FOLDING_NUM_RUNS, help='timed runs per batch size')
+    args   = parser.parse_args(argv)
+
+    # graphs
+    model_fn, image_size, crop_size, channels, scale, shift = inference.example_config(args.example, args.model, args.levels)
+    graph_def_reference, values = reference_graph(model_fn, crop_size, channels, scale, shift, args.checkpoint)
+    graph_def_folded            = folded_graph(folded_function(args.example, args.model, args.levels), values, crop_size, channels, scale, shift)
+    if args.export is not None:
+        with tf.gfile.GFile(args.export, 'wb') as file:
+            file.write(graph_def_folded.SerializeToString())
+
+    # graph size
+    for name, graph_def in [('Reference', graph_def_reference), ('Folded', graph_def_folded)]:
+        print('{0:9s} graph: {1:5d} nodes, {2:8.2f} MB'.format(name, len(graph_def.node), graph_def.ByteSize()/2.0**20))
+
+    # sessions
+    session_reference, images_reference, predictions_reference = load_graph(graph_def_reference)
+    session_folded,    images_folded,    predictions_folded    = load_graph(graph_def_folded)
+
+    # outputs
+    batch            = np.random.randint(0, 256, size=(max(args.batch_sizes), crop_size, crop_size, channels), dtype=np.uint8)
+    output_reference = session_reference.run(predictions_reference, feed_dict={images_reference: batch})
+    output_folded    = session_folded.run(predictions_folded, feed_dict={images_folded: batch})
+    print('Max abs output difference: {0:.3e} (max abs output {1:.3e})'.format(np.max(np.abs(output_reference - output_folded)), np.max(np.abs(output_reference))))
+    print('Top 1 agreement:           {0:6.2f} %'.format(100.0*np.mean(np.argmax(output_reference, 1) == np.argmax(output_folded, 1))))
+
+    # latency
+    print('{0:>10s} {1:>14s} {2:>14s} {3:>8s}'.format('Batch size', 'Reference ms', 'Folded ms', 'Speed up'))
+    for batch_size in args.batch_sizes:
+        latency_reference = latency(session_reference, images_reference, predictions_reference, batch[0:batch_size], args.runs)
+        latency_folded    = latency(session_folded,    images_folded,    predictions_folded,    batch[0:batch_size], args.runs)
+        print('{0:10d} {1:14.3f} {2:14.3f} {3:8.2f}'.format(batch_size, 1000.0*latency_reference, 1000.0*latency_folded, latency_reference/latency_folded))
+
+    # close the sessions
+    session_reference.close()
+    session_folded.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+################################################################################
+#
+# xnns/inference.py
+#
+# DESCRIPTION
+#
+#    Batched offline inference with a trained checkpoint
+#
+#    Streams a directory of images (jpeg / png) or a set of tfrecords through
+#    the model in large batches with parallel decode, writes the top k
+#    predictions to a columnar file and reports the throughput and the p50 /
+#    p99 batch latency
+#
+# USAGE
+#
+#    python -m xnns.inference --example tiny_imagenet --checkpoint ./logs/ --tfrecords './data/tiny-imagenet-200/tiny_imagenet_val_*.tfrecords' --output predictions.npz
+#    python -m xnns.inference --example cifar --checkpoint ./logs/ --images-dir ./images/ --output predictions.parquet
+#
+#    --checkpoint is a checkpoint path or a directory (latest checkpoint), as
+#    written by training with --checkpoint-dir
+#
+# OUTPUT
+#
+#    1 row per image with the columns
+#       name:          image file path or global tfrecord record index (record
+#                      i of the shards in shard order, the --index of
+#                      xnns.records)
+#       label:         tfrecord label (-1 for image files)
+#       top_k_classes: k predicted classes (most probable first)
+#       top_k_probs:   their softmax probabilities
+#
+#    .npz (numpy) or .parquet (requires pyarrow)
+#
+# NOTES
+#
+#    1. The model is built in inference mode (batch norm moving statistics)
+#       and only the model variables are restored
+#    2. Images are resized to the training image size and center cropped like
+#       the testing data
+#    3. Latency is the session.run time of a batch, excluding the first
+#       (warm up) batch
+#    4. tfrecords are read 1 shard after the other in shard number order so
+#       the names are global record indices; decoding is still parallel
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import argparse
+import glob
+import os
+import re
+import time
+
+import numpy      as np
+import tensorflow as tf
+
+from xnns import cifar
+from xnns import data
+from xnns import mnist
+from xnns import multistep
+from xnns import tiny_imagenet
+
+
+################################################################################
+#
+# PARAMETERS
+#
+################################################################################
+
+# defaults
+INFERENCE_BATCH_SIZE = 1024
+INFERENCE_TOP_K      = 5
+INFERENCE_NUM_CALLS  = os.cpu_count() or 1
+INFERENCE_PREFETCH   = 2
+
+# image file extensions
+INFERENCE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+################################################################################
+#
+# EXAMPLES
+#
+################################################################################
+
+# model and pre processing of an example
+# model_fn, image_size, crop_size (None for no crop), channels, scale, shift
+def example_config(name, model='resnet', levels=None):
+    if name == 'mnist':
+        scale, shift = data.normalization(0.0, 1.0)
+        return mnist.model_function(), mnist.DATA_IMAGE_SIZE, None, 1, scale, shift
+    if name == 'cifar':
+        scale, shift = data.normalization(cifar.DATA_MEAN, cifar.DATA_STD_DEV)
+        return cifar.model_function(model, levels), cifar.DATA_IMAGE_SIZE, cifar.TRAINING_CROP_SIZE, 3, scale, shift
+    scale, shift = data.normalization(tiny_imagenet.DATA_MEAN, tiny_imagenet.DATA_STD_DEV)
+    return tiny_imagenet.model_function(model, levels), tiny_imagenet.TRAINING_IMAGE_SIZE, tiny_imagenet.TRAINING_CROP_SIZE, 3, scale, shift
+
+
+################################################################################
+#
+# DATASET
+#
+################################################################################
+
+# read, decode and resize an image file
+def load_image(path, image_size, channels):
+    image = tf.image.decode_image(tf.read_file(path), channels=channels)
+    image.set_shape([None, None, channels])
+    image = tf.image.resize_images(image, (image_size, image_size))
+    return tf.cast(tf.round(image), tf.uint8)
+
+# dataset of (names, images, labels) batches
+# paths are image files (images_dir) or tfrecords
+def dataset_inference(paths, tfrecords, image_size, crop_size, channels, batch_size, num_calls, prefetch):
+
+    # image files
+    if tfrecords == False:
+        dataset = tf.data.Dataset.from_tensor_slices(paths)
+        dataset = dataset.apply(tf.data.experimental.map_and_batch(lambda path: (path, load_image(path, image_size, channels), tf.constant(-1, tf.int32)), batch_size, num_parallel_calls=num_calls))
+
+    # tfrecords
+    # the name is the index of the record in the sequential read order of
+    # paths (the global record index for paths in shard order)
+    else:
+        dataset = tf.data.TFRecordDataset(paths)
+        dataset = dataset.apply(tf.data.experimental.enumerate_dataset())
+        dataset = dataset.apply(tf.data.experimental.map_and_batch(lambda index, record: (tf.as_string(index),) + data.parse_record(record, image_size), batch_size, num_parallel_calls=num_calls))
+
+    # center crop
+    if crop_size is not None:
+        dataset = dataset.map(lambda names, images, labels: (names, data.center_crop_batch(images, image_size, crop_size), labels))
+
+    # return
+    return dataset.prefetch(prefetch)
+
+# tfrecord files in shard number order (name_2 before name_10) like
+# data.tfrecord_files
+def shard_order(paths):
+    return sorted(paths, key=lambda path: [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', path)])
+
+# image files in a directory (sorted)
+def image_files(images_dir):
+    return sorted(os.path.join(images_dir, name) for name in os.listdir(images_dir) if name.lower().endswith(INFERENCE_EXTENSIONS))
+
+
+################################################################################
+#
+# OUTPUT
+#
+################################################################################
+
+# write columns (dict of equal length arrays) to a .npz or .parquet file
+# pyarrow is only imported for .parquet
+def write_columns(path, columns):
+    if path.endswith('.parquet'):
+        import pyarrow
+        import pyarrow.parquet
+        table = pyarrow.Table.from_pydict({name: list(values) if values.ndim > 1 else values for name, values in columns.items()})
+        pyarrow.parquet.write_table(table, path)
+    else:
+        np.savez(path, **columns)
+
+
+################################################################################
+#
+# INFERENCE
+#
+################################################################################
+
+# run the dataset through the model restored from checkpoint (in the graph of
+# the dataset)
+# returns the output columns and the per batch (images, seconds)
+def infer(dataset, model_fn, scale, shift, checkpoint, top_k):
+
+    # example
+    names, images, labels = dataset.make_one_shot_iterator().get_next()
+
+    # model in inference mode with the training variable names
+    with tf.variable_scope(multistep.MODEL_SCOPE):
+        predictions = model_fn(data.normalize(images, scale, shift), False)
+
+    # top k
+    probs, classes = tf.nn.top_k(tf.nn.softmax(predictions), k=top_k)
+
+    # restore
+    if os.path.isdir(checkpoint):
+        checkpoint = tf.train.latest_checkpoint(checkpoint)
+    saver = tf.train.Saver(tf.global_variables(scope=multistep.MODEL_SCOPE))
+
+    # create a session
+    columns = {'name': [], 'label': [], 'top_k_classes': [], 'top_k_probs': []}
+    batches = []
+    with tf.Session() as session:
+
+        # restore the trained variables
+        saver.restore(session, checkpoint)
+
+        # cycle through the batches
+        while True:
+            time_start = time.time()
+            try:
+                values = session.run([names, labels, classes, probs])
+            except tf.errors.OutOfRangeError:
+                break
+            batches.append((len(values[0]), time.time() - time_start))
+            for column, value in zip(['name', 'label', 'top_k_classes', 'top_k_probs'], values):
+                columns[column].append(value)
+
+    # return
+    columns['name'] = [np.char.decode(names_batch.astype(np.bytes_), 'utf-8') for names_batch in columns['name']]
+    return {column: np.concatenate(values) for column, values in columns.items() if len(values) > 0}, batches
+
+# throughput (images / sec) and p50 / p99 batch latency (sec) excluding the
+# first batch
+def latency_stats(batches):
+    batches     = batches[1:] if len(batches) > 1 else batches
+    num_images  = sum(num for num, seconds in batches)
+    latencies   = np.array([seconds for num, seconds in batches])
+    return num_images/latencies.sum(), np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+################################################################################
+#
+# MAIN
+#
+################################################################################
+
+def main(argv=None):
+
+    # arguments
+    parser = argparse.ArgumentParser(description='Batched offline inference')
+    parser.add_argument('--example',    choices=['mnist', 'cifar', 'tiny_imagenet'], default='tiny_imagenet', help='example the checkpoint was trained with')
+    parser.add_argument('--model',      choices=['resnet', 'sequential', 'sequential_bn'], default='resnet', help='model (cifar and tiny_imagenet)')
+    parser.add_argument('--levels',     nargs='+', default=None, help='resnet width,blocks,strides per level (see xnns.profiler)')
+    parser.add_argument('--checkpoint', required=True, help='checkpoint path or directory')
+    parser.add_argument('--images-dir', default=None, help='directory of jpeg / png images')
+    parser.add_argument('--tfrecords',  default=None, help='tfrecords file glob')
+    parser.add_argument('--output',     default='predictions.npz', help='.npz or .parquet output file')
+    parser.add_argument('--batch-size', type=int, default=INFERENCE_BATCH_SIZE, help='inference batch size')
+    parser.add_argument('--top-k',      type=int, default=INFERENCE_TOP_K, help='predictions per image')
+    parser.add_argument('--num-calls',  type=int, default=INFERENCE_NUM_CALLS, help='images decoded at the same time')
+    args   = parser.parse_args(argv)
+
+    # input
+    if (args.images_dir is None) == (args.tfrecords is None):
+        parser.error('exactly 1 of --images-dir and --tfrecords is required')
+    tfrecords = args.tfrecords is not None
+    paths     = shard_order(glob.glob(args.tfrecords)) if tfrecords == True else image_files(args.images_dir)
+    if len(paths) == 0:
+        parser.error('no input files found')
+
+    # dataset and model
+    model_fn, image_size, crop_size, channels, scale, shift = example_config(args.example, args.model, args.levels)
+    dataset = dataset_inference(paths, tfrecords, image_size, crop_size, channels, args.batch_size, args.num_calls, INFERENCE_PREFETCH)
+
+    # inference
+    columns, batches = infer(dataset, model_fn, scale, shift, args.checkpoint, args.top_k)
+    if len(batches) == 0:
+        parser.error('no images read')
+    write_columns(args.output, columns)
+
+    # display
+    images_per_sec, latency_50, latency_99 = latency_stats(batches)
+    print('Images:          {0:d}'.format(len(columns['name'])))
+    print('Throughput:      {0:.1f} images / sec'.format(images_per_sec))
+    print('Batch latency:   p50 {0:.2f} ms, p99 {1:.2f} ms'.format(1000.0*latency_50, 1000.0*latency_99))
+    if tfrecords == True:
+        print('Top 1 accuracy:  {0:5.2f} %'.format(100.0*np.mean(columns['top_k_classes'][:, 0] == columns['label'])))
+    print('Predictions:     {0}'.format(args.output))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+################################################################################
+#
+# xnns/mnist.py
+#
+# DESCRIPTION
+#
+#    MNIST classification command line entry point
+#
+# USAGE
+#
+#    python -m xnns.mnist [--source keras|local|synthetic] [--help]
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+from xnns import data
+from xnns import models
+from xnns import sources
+from xnns import training
+
+
+################################################################################
+#
+# PARAMETERS
+#
+################################################################################
+
+# data
+DATA_NUM_CLASSES = 10
+DATA_IMAGE_SIZE  = 28
+
+# model
+MODEL_LAYER_0 = 1000
+MODEL_LAYER_1 = 100
+
+# training
+TRAINING_BATCH_SIZE   = 32
+TRAINING_NUM_EPOCHS   = 6
+TRAINING_LR_INITIAL   = 0.001
+TRAINING_LR_SCALE     = 0.1
+TRAINING_LR_EPOCHS    = 2
+TRAINING_LR_STAIRCASE = True
+
+
+################################################################################
+#
+# MODEL
+#
+################################################################################
+
+# model function
+def model_function():
+    def model_fn(data_norm, train_state):
+        return models.model_nn(data_norm, train_state, MODEL_LAYER_0, MODEL_LAYER_1, DATA_NUM_CLASSES)
+    return model_fn
+
+
+################################################################################
+#
+# MAIN
+#
+################################################################################
+
+# command line arguments
+def argument_parser():
+    parser = training.argument_parser('MNIST classification', TRAINING_BATCH_SIZE, TRAINING_NUM_EPOCHS, TRAINING_LR_INITIAL, TRAINING_LR_SCALE, TRAINING_LR_EPOCHS)
+    sources.add_arguments(parser, sources.SOURCES, 'keras')
+    return parser
+
+def main(argv=None):
+
+    # arguments
+    parser = argument_parser()
+    args   = parser.parse_args(argv)
+    eval_batch_size = args.batch_size if args.eval_batch_size is None else args.eval_batch_size
+
+    # training and testing split (keras downloads on the first call)
+    (data_train, labels_train), (data_test, labels_test) = sources.load('mnist', args.source, args.source_path, args.cache_dir, args.source_seed)
+
+    # normalization
+    # this constrains values to [0, 1]
+    # the mean is not subtracted as there are many 0 values to start in the greyscale image
+    scale, shift = data.normalization(0.0, 1.0)
+
+    # dataset
+    dataset_train = data.dataset_arrays(data_train, labels_train, args.batch_size, True, shuffle_seed=args.shuffle_seed)
+    dataset_test  = data.dataset_arrays(data_test,  labels_test,  eval_batch_size, False)
+
+    # model
+    model_fn = model_function()
+
+    # train
+    training.run(dataset_train, dataset_test, model_fn, scale, shift, len(data_train), len(data_test), DATA_NUM_CLASSES,
+                 args.batch_size, args.epochs, args.lr_initial, args.lr_scale, args.lr_epochs, TRAINING_LR_STAIRCASE, args.display, args.precision, args.steps_per_run,
+                 args.checkpoint_dir, args.max_checkpoints, checkpoint_batches=args.checkpoint_batches)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+################################################################################
+#
+# xnns/models.py
+#
+# DESCRIPTION
+#
+#    Models shared by the MNIST, CIFAR and Tiny ImageNet examples
+#
+#    model_nn:            fully connected network (MNIST)
+#    model_sequential:    VGG style network with 1 level per entry in
+#                         level_channels
+#    model_sequential_bn: model_sequential with batch norm
+#    model_resnet:        pre activation bottleneck ResNet V2 with 1 level per
+#                         entry in level_blocks
+#    model_resnet_levels: model_resnet with a (width, blocks, strides) spec per
+#                         level (see xnns/profiler.py for its size and cost)
+#
+# NOTES
+#
+#    1. All models take data (batch x rows x cols [x channels]) and a boolean
+#       train_state tensor and return predictions (batch x num_classes)
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import tensorflow as tf
+
+
+################################################################################
+#
+# LAYERS
+#
+################################################################################
+
+# convolution
+def conv2d(fm, filters, kernel_size, strides=1, activation=None, use_bias=False):
+    return tf.layers.conv2d(fm, filters, (kernel_size, kernel_size), strides=(strides, strides), padding='same', data_format='channels_last', dilation_rate=(1, 1), activation=activation, use_bias=use_bias)
+
+# batch norm and relu
+def bn_relu(fm, train_state):
+    fm = tf.layers.batch_normalization(fm, training=train_state)
+    return tf.nn.relu(fm)
+
+# decoder
+# global average pooling and a dense layer
+# predictions.shape = batch x num_classes
+def decoder(features, num_classes):
+    features = tf.reduce_mean(features, axis=[1, 2])
+    return tf.layers.dense(features, num_classes, activation=None, use_bias=True)
+
+
+################################################################################
+#
+# MODEL - NN
+#
+################################################################################
+
+# nn model
+def model_nn(data, train_state, size_layer_0, size_layer_1, num_classes):
+
+    # encoder
+    fm       = tf.layers.flatten(data)                                                 # fm.shape = batch x (rows*cols)
+    fm       = tf.layers.dense(fm, size_layer_0, activation=tf.nn.relu, use_bias=True) # fm.shape = batch x size_layer_0
+    features = tf.layers.dense(fm, size_layer_1, activation=tf.nn.relu, use_bias=True) # fm.shape = batch x size_layer_1
+
+    # decoder
+    # predictions.shape = batch x num_classes
+    predictions = tf.layers.dense(features, num_classes, activation=None, use_bias=True)
+
+    # return
+    return predictions
+
+
+################################################################################
+#
+# MODEL - SEQUENTIAL
+#
+################################################################################
+
+# sequential model
+# cifar:         level_channels = [32, 64, 128]
+# tiny imagenet: level_channels = [32, 64, 128, 256]
+def model_sequential(data, train_state, num_classes, level_channels):
+
+    # encoder
+    # 3x 3x3 conv per level with 3x3 / 2 max pooling down sampling between levels
+    fm = data
+    for level, channels in enumerate(level_channels):
+        if level > 0:
+            fm = tf.layers.max_pooling2d(fm, (3, 3), (2, 2), padding='same', data_format='channels_last')
+        for layer in range(3):
+            fm = conv2d(fm, channels, 3, activation=tf.nn.relu, use_bias=True)
+
+    # decoder
+    return decoder(fm, num_classes)
+
+
+################################################################################
+#
+# MODEL - SEQUENTIAL BATCH NORM
+#
+################################################################################
+
+# sequential batch norm model
+def model_sequential_bn(data, train_state, num_classes, level_channels):
+
+    # encoder
+    # 3x 3x3 conv - bn - relu per level with 3x3 / 2 max pooling down sampling
+    # between levels
+    fm = data
+    for level, channels in enumerate(level_channels):
+        if level > 0:
+            fm = tf.layers.max_pooling2d(fm, (3, 3), (2, 2), padding='same', data_format='channels_last')
+        for layer in range(3):
+            fm = conv2d(fm, channels, 3)
+            fm = bn_relu(fm, train_state)
+
+    # decoder
+    return decoder(fm, num_classes)
+
+
+################################################################################
+#
+# MODEL - RESNET V2
+#
+################################################################################
+
+# pre activation bottleneck
+# residual: bn - relu - 1x1 / strides - bn - relu - 3x3 - bn - relu - 1x1 (4x width)
+# main:     1x1 / strides projection (first block of a level) or identity
+# inner_widths overrides the 1x1 / strides and 3x3 widths (pruned networks)
+def bottleneck(fm_id, train_state, width, strides, projection, inner_widths=None):
+    width_1, width_2 = (width, width) if inner_widths is None else inner_widths
+    fm_residual = bn_relu(fm_id, train_state)
+    fm_residual = conv2d(fm_residual, width_1, 1, strides)
+    fm_residual = bn_relu(fm_residual, train_state)
+    fm_residual = conv2d(fm_residual, width_2, 3)
+    fm_residual = bn_relu(fm_residual, train_state)
+    fm_residual = conv2d(fm_residual, 4*width, 1)
+    if projection == True:
+        fm_id = conv2d(fm_id, 4*width, 1, strides)
+    return tf.add(fm_id, fm_residual)
+
+# resnet model from level specs
+# level_specs = [(width, blocks, strides), ...] with 1 entry per level
+# each level has a special bottleneck (projection, down sampling by strides) x1
+# then a standard bottleneck x(blocks - 1), all with a bottleneck width of width
+# and 4*width output channels
+# block_widths = [(width_1, width_2), ...] with 1 entry per bottleneck optionally
+# overrides the inner widths (see xnns/pruning.py)
+def model_resnet_levels(data, train_state, level_specs, num_classes, tail_channels=32, block_widths=None):
+
+    # inner widths per bottleneck
+    block_widths = iter([None]*sum(num_blocks for width, num_blocks, strides in level_specs) if block_widths is None else block_widths)
+
+    # encoder - tail
+    fm_id = conv2d(data, tail_channels, 3)
+
+    # encoder - levels
+    for width, num_blocks, strides in level_specs:
+        fm_id = bottleneck(fm_id, train_state, width, strides, True, next(block_widths))
+        for block in range(num_blocks - 1):
+            fm_id = bottleneck(fm_id, train_state, width, 1, False, next(block_widths))
+
+    # encoder - special block x1
+    fm_id = bn_relu(fm_id, train_state)
+
+    # decoder
+    return decoder(fm_id, num_classes)
+
+# level specs of the standard resnet
+# level i has a bottleneck width of 16*2^i and is down sampled by 2 for i > 0
+def resnet_level_specs(level_blocks):
+    return [(16*(2**level), num_blocks, 1 if level == 0 else 2) for level, num_blocks in enumerate(level_blocks)]
+
+# resnet model
+# cifar:         level_blocks = [4, 6, 3]    (91.42 % top 1 accuracy)
+# tiny imagenet: level_blocks = [3, 4, 6, 3]
+def model_resnet(data, train_state, level_blocks, num_classes):
+    return model_resnet_levels(data, train_state, resnet_level_specs(level_blocks), num_classes)
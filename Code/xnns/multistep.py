@@ -0,0 +1,182 @@
+################################################################################
+#
+# xnns/multistep.py
+#
+# DESCRIPTION
+#
+#    Multi step in graph training loop
+#
+#    A tf.while_loop runs num_steps training steps (example, model, loss,
+#    gradient computation and update) per session.run so the per batch
+#    python -> runtime round trip and feed_dict copy is paid once per num_steps
+#    batches instead of once per batch
+#
+# USAGE
+#
+#    python -m xnns.multistep [--steps-per-run 1 10 100] [--help]
+#
+#    Benchmarks the per step time of model_nn (MNIST) and model_resnet (CIFAR)
+#    for each steps per run on synthetic data and reports the host overhead
+#    removed relative to 1 step per run
+#
+# NOTES
+#
+#    1. The loop body builds a second copy of the model that reuses the
+#       variables of the testing copy (both are built in the 'model' variable
+#       scope)
+#    2. Only the batch norm updates created in the loop body are run by it
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import argparse
+import time
+
+import numpy      as np
+import tensorflow as tf
+
+from xnns import data
+from xnns import precision as mixed
+from xnns import weights
+
+
+################################################################################
+#
+# PARAMETERS
+#
+################################################################################
+
+# model variable scope (shared by the testing model and the loop body)
+MODEL_SCOPE = weights.MODEL_SCOPE
+
+# benchmark defaults
+BENCHMARK_STEPS_PER_RUN = [1, 10, 100]
+BENCHMARK_BATCH_SIZE    = 32
+BENCHMARK_NUM_STEPS     = 200
+
+
+################################################################################
+#
+# TRAINING LOOP
+#
+################################################################################
+
+# num_steps training steps in 1 op
+# each step reads a batch from the iterator and updates the model variables
+# learning_rate_fn(step) returns the learning rate of the step, a function of
+# batches_trained (incremented by every step) if given else of global_step
+def train_steps(iterator, model_fn, scale, shift, global_step, learning_rate_fn, num_steps, precision='float32', gradients_fn=None, batches_trained=None):
+
+    # 1 training step
+    def body(step):
+
+        # example
+        images, labels = iterator.get_next()
+
+        # model (reusing the variables of the testing model)
+        num_update_ops = len(tf.get_collection(tf.GraphKeys.UPDATE_OPS))
+        with tf.variable_scope(MODEL_SCOPE, reuse=True):
+            predictions = mixed.model_precision(model_fn, data.normalize(images, scale, shift), True, precision)
+
+        # loss
+        loss = tf.losses.sparse_softmax_cross_entropy(labels=labels, logits=predictions, loss_collection=None)
+
+        # optimizer
+        update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)[num_update_ops:]
+        with tf.control_dependencies(update_ops):
+            optimizer = mixed.adam_minimize(loss, learning_rate_fn(global_step if batches_trained is None else batches_trained), global_step, precision, gradients_fn)
+
+        # count the batch
+        if batches_trained is not None:
+            with tf.control_dependencies([optimizer]):
+                optimizer = tf.assign_add(batches_trained, 1)
+
+        # next step after the update
+        with tf.control_dependencies([optimizer]):
+            return step + 1
+
+    # loop
+    return tf.while_loop(lambda step: step < num_steps, body, [tf.constant(0)], parallel_iterations=1, back_prop=False)
+
+
+################################################################################
+#
+# BENCHMARK
+#
+################################################################################
+
+# seconds per training step with steps_per_run steps per session.run
+# a constant batch is repeated so the input pipeline cost is negligible
+def benchmark(model_fn, image_shape, num_classes, batch_size, steps_per_run, num_steps):
+
+    # import here as training imports this module
+    from xnns import training
+
+    # graph
+    with tf.Graph().as_default():
+
+        # synthetic data
+        images  = np.random.randint(0, 256, size=[batch_size] + image_shape, dtype=np.uint8)
+        labels  = np.random.randint(0, num_classes, size=(batch_size,), dtype=np.int32)
+        dataset = tf.data.Dataset.from_tensors((images, labels)).repeat()
+
+        # graph
+        scale, shift = data.normalization(0.5, 0.25)
+        graph        = training.build_graph(dataset, dataset, model_fn, scale, shift, num_steps, 0.001, 0.1, 1, steps_per_run=steps_per_run)
+
+        # create a session
+        with tf.Session() as session:
+
+            # initialize global variables
+            session.run(tf.global_variables_initializer())
+
+            # warm up
+            training.train_epoch(session, graph, 2*steps_per_run, steps_per_run)
+
+            # time num_steps steps
+            time_start = time.time()
+            training.train_epoch(session, graph, num_steps, steps_per_run)
+            return (time.time() - time_start)/num_steps
+
+
+################################################################################
+#
+# MAIN
+#
+################################################################################
+
+def main(argv=None):
+
+    # models
+    from xnns import models
+    benchmarks = [
+        ('model_nn (MNIST)',      [28, 28],    10, lambda data_norm, train_state: models.model_nn(data_norm, train_state, 1000, 100, 10)),
+        ('model_resnet (CIFAR)',  [28, 28, 3], 10, lambda data_norm, train_state: models.model_resnet(data_norm, train_state, [4, 6, 3], 10))]
+
+    # arguments
+    parser = argparse.ArgumentParser(description='Multi step training loop host overhead benchmark')
+    parser.add_argument('--steps-per-run', nargs='+', type=int, default=BENCHMARK_STEPS_PER_RUN, help='training steps per session.run to compare')
+    parser.add_argument('--batch-size',    type=int,  default=BENCHMARK_BATCH_SIZE,              help='training batch size')
+    parser.add_argument('--steps',         type=int,  default=BENCHMARK_NUM_STEPS,               help='timed training steps per configuration')
+    args   = parser.parse_args(argv)
+
+    # cycle through the models and steps per run
+    # savings are relative to the first steps per run (1 by default)
+    print('{0:22s} {1:>13s} {2:>12s} {3:>13s} {4:>8s}'.format('Model', 'Steps per run', 'Step time ms', 'Saved ms/step', 'Saved %'))
+    for name, image_shape, num_classes, model_fn in benchmarks:
+        step_time_1 = None
+        for steps_per_run in args.steps_per_run:
+            step_time = benchmark(model_fn, image_shape, num_classes, args.batch_size, steps_per_run, args.steps)
+            if step_time_1 is None:
+                step_time_1 = step_time
+            saved = step_time_1 - step_time
+            print('{0:22s} {1:13d} {2:12.3f} {3:13.3f} {4:8.1f}'.format(name, steps_per_run, 1000.0*step_time, 1000.0*saved, 100.0*saved/step_time_1))
+
+if __name__ == '__main__':
+    main()
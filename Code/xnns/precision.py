@@ -0,0 +1,229 @@
+################################################################################
+#
+# xnns/precision.py
+#
+# DESCRIPTION
+#
+#    Mixed precision (float16 / bfloat16) training with float32 master weights
+#
+#    float32:  the default, everything in float32
+#    float16:  model compute in float16 with float32 master weights (cast to
+#              float16 on read) and dynamic loss scaling around the Adam update
+#    bfloat16: model compute in bfloat16 with float32 master weights; no loss
+#              scaling is needed as bfloat16 has the float32 exponent range
+#              (CPU support requires a tensorflow build with MKL / oneDNN)
+#
+# USAGE
+#
+#    python -m xnns.precision [--precisions float32 float16 bfloat16] [--help]
+#
+#    Benchmarks the training step time and peak memory of model_resnet for each
+#    precision on synthetic data
+#
+# NOTES
+#
+#    1. Batch norm parameters and statistics stay in float32
+#    2. Predictions are cast back to float32 before the loss
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import argparse
+import multiprocessing
+import resource
+import time
+
+import numpy      as np
+import tensorflow as tf
+
+
+################################################################################
+#
+# PARAMETERS
+#
+################################################################################
+
+# precisions
+PRECISION_DTYPES = {'float32': tf.float32, 'float16': tf.float16, 'bfloat16': tf.bfloat16}
+
+# dynamic loss scaling (float16)
+# start high, halve after 2 consecutive non finite gradient steps (which are
+# skipped) and double after 2000 finite steps
+PRECISION_LOSS_SCALE_INITIAL = 2**15
+PRECISION_LOSS_SCALE_STEPS   = 2000
+
+# benchmark defaults (tiny imagenet resnet)
+BENCHMARK_LEVEL_BLOCKS = [3, 4, 6, 3]
+BENCHMARK_IMAGE_SIZE   = 56
+BENCHMARK_NUM_CLASSES  = 200
+BENCHMARK_BATCH_SIZE   = 32
+BENCHMARK_NUM_STEPS    = 50
+
+
+################################################################################
+#
+# MIXED PRECISION
+#
+################################################################################
+
+# variable getter that stores float16 / bfloat16 variables as float32 master
+# weights and casts them to the compute type when they are read
+def master_weights_getter(getter, name, shape=None, dtype=None, *args, **kwargs):
+    if dtype in [tf.float16, tf.bfloat16]:
+        variable = getter(name, shape, tf.float32, *args, **kwargs)
+        return tf.cast(variable, dtype)
+    return getter(name, shape, dtype, *args, **kwargs)
+
+# model in the given precision
+# model_fn(data, train_state) returns predictions; data and the returned
+# predictions are float32
+def model_precision(model_fn, data, train_state, precision='float32'):
+
+    # float32
+    if precision == 'float32':
+        return model_fn(data, train_state)
+
+    # mixed precision
+    # the variable scope keeps the variable names of the float32 model
+    with tf.variable_scope(tf.get_variable_scope(), custom_getter=master_weights_getter):
+        predictions = model_fn(tf.cast(data, PRECISION_DTYPES[precision]), train_state)
+
+    # return
+    return tf.cast(predictions, tf.float32)
+
+# adam update of the float32 master weights
+# with float16 the loss is scaled before the gradient computation, the
+# gradients are unscaled before the update and steps with non finite gradients
+# are skipped (global_step is not incremented)
+# gradients_fn(grads_and_vars) optionally transforms the gradients between
+# their computation and the update; with float16 they are already unscaled
+# (LossScaleOptimizer.compute_gradients) so an all reduce is independent of the
+# loss scale
+def adam_minimize(loss, learning_rate, global_step, precision='float32', gradients_fn=None):
+    optimizer = tf.train.AdamOptimizer(learning_rate)
+    if precision == 'float16':
+        loss_scale_manager = tf.contrib.mixed_precision.ExponentialUpdateLossScaleManager(PRECISION_LOSS_SCALE_INITIAL, PRECISION_LOSS_SCALE_STEPS)
+        optimizer          = tf.contrib.mixed_precision.LossScaleOptimizer(optimizer, loss_scale_manager)
+    if gradients_fn is None:
+        return optimizer.minimize(loss, global_step=global_step)
+    grads_and_vars = gradients_fn(optimizer.compute_gradients(loss))
+    return optimizer.apply_gradients(grads_and_vars, global_step=global_step)
+
+
+################################################################################
+#
+# BENCHMARK
+#
+################################################################################
+
+# training step time (sec) and peak memory (bytes) of model_resnet
+# peak memory is the device allocator peak on a GPU and the process peak
+# resident set size on a CPU (so each precision runs in its own process)
+def benchmark(precision, level_blocks, image_size, num_classes, batch_size, num_steps):
+
+    # import here so the module does not depend on models at import time
+    from xnns import data
+    from xnns import models
+
+    # graph
+    with tf.Graph().as_default():
+
+        # synthetic data
+        images      = tf.constant(np.random.randint(0, 256, size=(batch_size, image_size, image_size, 3), dtype=np.uint8))
+        labels      = tf.constant(np.random.randint(0, num_classes, size=(batch_size,), dtype=np.int32))
+        train_state = tf.placeholder_with_default(True, [])
+        scale, shift = data.normalization([0.5, 0.5, 0.5], [0.25, 0.25, 0.25])
+
+        # model
+        model_fn    = lambda data_norm, state: models.model_resnet(data_norm, state, level_blocks, num_classes)
+        predictions = model_precision(model_fn, data.normalize(images, scale, shift), train_state, precision)
+
+        # loss and optimizer
+        loss        = tf.losses.sparse_softmax_cross_entropy(labels=labels, logits=predictions)
+        global_step = tf.train.get_or_create_global_step()
+        with tf.control_dependencies(tf.get_collection(tf.GraphKeys.UPDATE_OPS)):
+            optimizer = adam_minimize(loss, 0.001, global_step, precision)
+
+        # peak memory
+        use_gpu = tf.test.is_gpu_available()
+        if use_gpu == True:
+            peak_bytes = tf.contrib.memory_stats.MaxBytesInUse()
+
+        # create a session
+        with tf.Session() as session:
+
+            # initialize global variables
+            session.run(tf.global_variables_initializer())
+
+            # warm up
+            for step in range(5):
+                session.run(optimizer)
+
+            # time num_steps steps
+            time_start = time.time()
+            for step in range(num_steps):
+                session.run(optimizer)
+            step_time = (time.time() - time_start)/num_steps
+
+            # peak memory
+            if use_gpu == True:
+                peak = session.run(peak_bytes)
+            else:
+                peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+    # return
+    return step_time, peak
+
+# benchmark in a fresh process (returns None if the precision is unsupported)
+def benchmark_process(arguments):
+    try:
+        return benchmark(*arguments)
+    except (tf.errors.OpError, ValueError, TypeError) as error:
+        print('{0}: not supported ({1})'.format(arguments[0], str(error).split('\n')[0]))
+        return None
+
+
+################################################################################
+#
+# MAIN
+#
+################################################################################
+
+def main(argv=None):
+
+    # arguments
+    parser = argparse.ArgumentParser(description='Mixed precision model_resnet training step benchmark')
+    parser.add_argument('--precisions',   nargs='+', default=['float32', 'float16', 'bfloat16'], choices=sorted(PRECISION_DTYPES.keys()), help='precisions to compare')
+    parser.add_argument('--level-blocks', nargs='+', type=int, default=BENCHMARK_LEVEL_BLOCKS, help='resnet blocks per level')
+    parser.add_argument('--image-size',   type=int,  default=BENCHMARK_IMAGE_SIZE,  help='input rows and cols')
+    parser.add_argument('--classes',      type=int,  default=BENCHMARK_NUM_CLASSES, help='number of classes')
+    parser.add_argument('--batch-size',   type=int,  default=BENCHMARK_BATCH_SIZE,  help='training batch size')
+    parser.add_argument('--steps',        type=int,  default=BENCHMARK_NUM_STEPS,   help='timed training steps per precision')
+    args   = parser.parse_args(argv)
+
+    # cycle through the precisions
+    # spawned processes so each peak memory measurement starts from scratch
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for precision in args.precisions:
+        with context.Pool(1) as pool:
+            results[precision] = pool.apply(benchmark_process, [(precision, args.level_blocks, args.image_size, args.classes, args.batch_size, args.steps)])
+
+    # display
+    baseline = results.get('float32')
+    print('{0:10s} {1:>14s} {2:>10s} {3:>14s}'.format('Precision', 'Step time ms', 'Speed up', 'Peak memory MB'))
+    for precision in args.precisions:
+        if results[precision] is None:
+            continue
+        step_time, peak = results[precision]
+        speed_up        = baseline[0]/step_time if baseline is not None else float('nan')
+        print('{0:10s} {1:14.2f} {2:10.2f} {3:14.1f}'.format(precision, 1000.0*step_time, speed_up, peak/2.0**20))
+
+if __name__ == '__main__':
+    main()
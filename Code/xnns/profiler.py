@@ -0,0 +1,220 @@
+################################################################################
+#
+# xnns/profiler.py
+#
+# DESCRIPTION
+#
+#    Static size and cost profile of model_resnet_levels
+#
+#    For a given input size the profile reports per level
+#       params:      trainable parameters (conv kernels, bn gamma and beta,
+#                    dense kernel and bias)
+#       macs:        multiply accumulates per image
+#       activations: memory of every layer output per batch (the tensors kept
+#                    for the backward pass during training)
+#
+# USAGE
+#
+#    python -m xnns.profiler --levels 16,3,1 32,4,2 64,6,2 128,3,2 --image-size 56 --classes 200
+#
+#    --levels is 1 width,blocks,strides spec per level (see model_resnet_levels)
+#    --check also builds the tensorflow graph and compares the parameter count
+#
+# NOTES
+#
+#    1. The profile is computed without tensorflow so it is instant
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import argparse
+
+
+################################################################################
+#
+# PARAMETERS
+#
+################################################################################
+
+# defaults (tiny imagenet)
+PROFILE_LEVELS      = ['16,3,1', '32,4,2', '64,6,2', '128,3,2']
+PROFILE_IMAGE_SIZE  = 56
+PROFILE_CHANNELS    = 3
+PROFILE_CLASSES     = 200
+PROFILE_TAIL        = 32
+PROFILE_BATCH_SIZE  = 32
+PROFILE_BYTES       = 4
+
+
+################################################################################
+#
+# LEVEL SPECS
+#
+################################################################################
+
+# level specs from strings of the form 'width,blocks,strides'
+def parse_level_specs(specs):
+    return [tuple(int(value) for value in spec.split(',')) for spec in specs]
+
+
+################################################################################
+#
+# LAYER STATISTICS
+#
+################################################################################
+
+# running statistics of a part of the network
+def stats_init(name):
+    return {'name': name, 'shape': None, 'params': 0, 'macs': 0, 'activations': 0}
+
+# 'same' padded convolution without bias
+def stats_conv(stats, shape, out_channels, kernel_size, strides):
+    channels, height, width = shape
+    height                  = -(-height // strides)
+    width                   = -(-width // strides)
+    params                  = kernel_size*kernel_size*channels*out_channels
+    stats['params']        += params
+    stats['macs']          += height*width*params
+    stats['activations']   += out_channels*height*width
+    return (out_channels, height, width)
+
+# batch norm (gamma and beta) and relu
+def stats_bn_relu(stats, shape):
+    channels, height, width = shape
+    stats['params']        += 2*channels
+    stats['activations']   += 2*channels*height*width
+    return shape
+
+# pre activation bottleneck (see models.bottleneck)
+def stats_bottleneck(stats, shape, width, strides, projection, inner_widths=None):
+    width_1, width_2      = (width, width) if inner_widths is None else inner_widths
+    fm_residual           = stats_bn_relu(stats, shape)
+    fm_residual           = stats_conv(stats, fm_residual, width_1, 1, strides)
+    fm_residual           = stats_bn_relu(stats, fm_residual)
+    fm_residual           = stats_conv(stats, fm_residual, width_2, 3, 1)
+    fm_residual           = stats_bn_relu(stats, fm_residual)
+    fm_residual           = stats_conv(stats, fm_residual, 4*width, 1, 1)
+    if projection == True:
+        stats_conv(stats, shape, 4*width, 1, strides)
+    stats['activations'] += fm_residual[0]*fm_residual[1]*fm_residual[2]
+    return fm_residual
+
+################################################################################
+#
+# PROFILE
+#
+################################################################################
+
+# profile of model_resnet_levels
+# returns 1 row per part of the network (tail, levels, decoder) and a total row
+# block_widths optionally overrides the bottleneck inner widths (see
+# models.model_resnet_levels)
+def profile_resnet(level_specs, image_size, in_channels, num_classes, tail_channels=32, block_widths=None):
+
+    # rows
+    rows         = []
+    shape        = (in_channels, image_size, image_size)
+    block_widths = iter([None]*sum(num_blocks for width, num_blocks, strides in level_specs) if block_widths is None else block_widths)
+
+    # encoder - tail
+    stats          = stats_init('tail')
+    shape          = stats_conv(stats, shape, tail_channels, 3, 1)
+    stats['shape'] = shape
+    rows.append(stats)
+
+    # encoder - levels
+    for level, (width, num_blocks, strides) in enumerate(level_specs):
+        stats = stats_init('level {}'.format(level))
+        shape = stats_bottleneck(stats, shape, width, strides, True, next(block_widths))
+        for block in range(num_blocks - 1):
+            shape = stats_bottleneck(stats, shape, width, 1, False, next(block_widths))
+        stats['shape'] = shape
+        rows.append(stats)
+
+    # encoder - special block x1 and decoder
+    stats                 = stats_init('decoder')
+    shape                 = stats_bn_relu(stats, shape)
+    stats['params']      += shape[0]*num_classes + num_classes
+    stats['macs']        += shape[0]*num_classes
+    stats['activations'] += shape[0] + num_classes
+    stats['shape']        = (num_classes, 1, 1)
+    rows.append(stats)
+
+    # total
+    total = stats_init('total')
+    for stats in rows:
+        for key in ['params', 'macs', 'activations']:
+            total[key] += stats[key]
+    total['shape'] = rows[-1]['shape']
+    rows.append(total)
+
+    # return
+    return rows
+
+# display a profile
+def print_profile(rows, batch_size, bytes_per_element=4):
+    print('{0:10s} {1:>16s} {2:>12s} {3:>12s} {4:>16s}'.format('Part', 'Output (CxHxW)', 'Params', 'MMACs', 'Activations MB'))
+    for stats in rows:
+        shape = '{0} x {1} x {2}'.format(*stats['shape'])
+        print('{0:10s} {1:>16s} {2:12d} {3:12.2f} {4:16.2f}'.format(stats['name'], shape, stats['params'], stats['macs']/1e6, stats['activations']*batch_size*bytes_per_element/2.0**20))
+
+
+################################################################################
+#
+# CHECK
+#
+################################################################################
+
+# number of trainable parameters of the tensorflow model
+def count_graph_params(level_specs, image_size, in_channels, num_classes, tail_channels=32):
+
+    # tensorflow is only needed for the check
+    import numpy      as np
+    import tensorflow as tf
+    from   xnns       import models
+
+    # build the model in its own graph
+    with tf.Graph().as_default():
+        data        = tf.placeholder(tf.float32, [None, image_size, image_size, in_channels])
+        train_state = tf.placeholder(tf.bool)
+        models.model_resnet_levels(data, train_state, level_specs, num_classes, tail_channels)
+        return int(sum(np.prod(variable.shape.as_list()) for variable in tf.trainable_variables()))
+
+
+################################################################################
+#
+# MAIN
+#
+################################################################################
+
+def main(argv=None):
+
+    # arguments
+    parser = argparse.ArgumentParser(description='Static model_resnet_levels profile')
+    parser.add_argument('--levels',     nargs='+', default=PROFILE_LEVELS,     help='width,blocks,strides per level')
+    parser.add_argument('--image-size', type=int,  default=PROFILE_IMAGE_SIZE, help='input rows and cols')
+    parser.add_argument('--channels',   type=int,  default=PROFILE_CHANNELS,   help='input channels')
+    parser.add_argument('--classes',    type=int,  default=PROFILE_CLASSES,    help='number of classes')
+    parser.add_argument('--tail',       type=int,  default=PROFILE_TAIL,       help='tail conv channels')
+    parser.add_argument('--batch-size', type=int,  default=PROFILE_BATCH_SIZE, help='batch size for the activation memory')
+    parser.add_argument('--bytes',      type=int,  default=PROFILE_BYTES,      help='bytes per activation element')
+    parser.add_argument('--check',      action='store_true',                   help='compare with the tensorflow parameter count')
+    args   = parser.parse_args(argv)
+
+    # profile
+    level_specs = parse_level_specs(args.levels)
+    rows        = profile_resnet(level_specs, args.image_size, args.channels, args.classes, args.tail)
+    print_profile(rows, args.batch_size, args.bytes)
+
+    # check
+    if args.check == True:
+        print('Tensorflow params: {0:d}'.format(count_graph_params(level_specs, args.image_size, args.channels, args.classes, args.tail)))
+
+if __name__ == '__main__':
+    main()
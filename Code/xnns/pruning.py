@@ -0,0 +1,204 @@
+################################################################################
+#
+# xnns/pruning.py
+#
+# DESCRIPTION
+#
+#    Structured channel pruning of the resnet bottlenecks
+#
+#    In each bottleneck (bn - relu - 1x1 - bn - relu - 3x3 - bn - relu - 1x1)
+#    the inner channels (outputs of the 1x1 / strides and 3x3 convs) with the
+#    lowest importance are removed
+#       bn_gamma:  |gamma| of the bn that follows the conv
+#       magnitude: L1 norm of the conv kernel output channel
+#    and --keep of each is kept. The kept slices of the conv kernels (output
+#    channels and the matching input channels of the next conv) and bn
+#    parameters form a physically smaller model_resnet_levels (block_widths)
+#    that is fine tuned for --epochs from these weights
+#
+#    The 4x width bottleneck outputs (the residual path) are not pruned
+#
+# USAGE
+#
+#    python -m xnns.pruning --example cifar --checkpoint ./logs/ --keep 0.5 --criterion bn_gamma --epochs 2
+#
+#    Reports the params, MFLOPs (2 x MACs, see xnns.profiler), batch norm
+#    folded CPU latency and top 1 accuracy of the original, pruned and fine
+#    tuned models
+#
+# NOTES
+#
+#    1. Without --checkpoint the weights are random (as xnns.folding) and only
+#       the size, FLOPs and latency are meaningful
+#    2. The pruned bottleneck widths are printed; a --checkpoint-dir of the
+#       fine tuned model is rebuilt with model_resnet_levels(...,
+#       block_widths=...)
+#    3. Latency is measured on the batch norm folded graphs (xnns.folding) so
+#       it is the deployed inference cost
+#    4. CIFAR comes from --source (see xnns.sources)
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import argparse
+import os
+
+import numpy as np
+
+from xnns import cifar
+from xnns import data
+from xnns import folding
+from xnns import inference
+from xnns import models
+from xnns import profiler
+from xnns import quantization
+from xnns import sources
+from xnns import tiny_imagenet
+from xnns import training
+from xnns import weights
+
+
+################################################################################
+#
+# PARAMETERS
+#
+################################################################################
+
+# defaults
+PRUNING_KEEP       = 0.5
+PRUNING_CRITERION  = 'bn_gamma'
+PRUNING_EPOCHS     = 2
+PRUNING_BATCH_SIZE = 32
+PRUNING_LR_INITIAL = 0.0001
+
+# benchmark
+PRUNING_BATCH_SIZES = [1, 32]
+PRUNING_NUM_RUNS    = 20
+
+
+################################################################################
+#
+# EXAMPLES
+#
+################################################################################
+
+# resnet level specs and number of classes of an example
+def example_specs(example, levels=None):
+    module = cifar if example == 'cifar' else tiny_imagenet
+    if levels is not None:
+        return profiler.parse_level_specs(levels), module.DATA_NUM_CLASSES
+    return models.resnet_level_specs(module.MODEL_LEVEL_BLOCKS), module.DATA_NUM_CLASSES
+
+# model function of a pruned resnet
+def pruned_model_function(level_specs, block_widths, num_classes):
+    def model_fn(data_norm, train_state):
+        return models.model_resnet_levels(data_norm, train_state, level_specs, num_classes, block_widths=block_widths)
+    return model_fn
+
+# training and testing datasets and sizes of an example
+# source is the sources.Source of cifar
+def datasets(example, tfrecords_dir, batch_size, source=sources.SOURCES_KERAS):
+    if example == 'cifar':
+        (data_train, labels_train), (data_test, labels_test) = sources.load('cifar10', *source)
+        dataset_train = data.dataset_arrays(data_train, labels_train, batch_size, True,  cifar.TRAINING_CROP_SIZE, cifar.TRAINING_SHUFFLE_BUFFER)
+        dataset_test  = data.dataset_arrays(data_test,  labels_test,  batch_size, False, cifar.TRAINING_CROP_SIZE)
+        return dataset_train, dataset_test, len(data_train), len(data_test)
+    tfrecords_train = data.tfrecord_files(os.path.join(tfrecords_dir, tiny_imagenet.DATA_TFRECORDS_TRAIN), tiny_imagenet.DATA_NUM_SHARDS_TRAIN)
+    tfrecords_val   = data.tfrecord_files(os.path.join(tfrecords_dir, tiny_imagenet.DATA_TFRECORDS_VAL),   tiny_imagenet.DATA_NUM_SHARDS_VAL)
+    dataset_train   = data.dataset_tfrecords_train(tfrecords_train, tiny_imagenet.TRAINING_IMAGE_SIZE, tiny_imagenet.TRAINING_CROP_SIZE, batch_size, tiny_imagenet.TRAINING_SHUFFLE_BUFFER, tiny_imagenet.PIPELINE_NUM_READERS, tiny_imagenet.PIPELINE_NUM_CALLS, tiny_imagenet.PIPELINE_PREFETCH)
+    dataset_val     = data.dataset_tfrecords_val(tfrecords_val, tiny_imagenet.TRAINING_IMAGE_SIZE, tiny_imagenet.TRAINING_CROP_SIZE, batch_size, tiny_imagenet.PIPELINE_NUM_CALLS, tiny_imagenet.PIPELINE_PREFETCH)
+    return dataset_train, dataset_val, tiny_imagenet.DATA_NUM_TRAIN, tiny_imagenet.DATA_NUM_VAL
+
+
+################################################################################
+#
+# EVALUATION
+#
+################################################################################
+
+# top 1 accuracy of a graph (see folding.load_graph) on in memory images
+def accuracy(session, images, predictions, images_test, labels_test, batch_size):
+    correct = 0
+    for index in range(0, len(images_test), batch_size):
+        output   = session.run(predictions, feed_dict={images: images_test[index:index + batch_size]})
+        correct += np.sum(np.argmax(output, 1) == labels_test[index:index + batch_size])
+    return correct/len(images_test)
+
+
+################################################################################
+#
+# MAIN
+#
+################################################################################
+
+# command line arguments
+def argument_parser():
+    parser = argparse.ArgumentParser(description='Structured channel pruning of the resnet bottlenecks')
+    parser.add_argument('--example',        choices=['cifar', 'tiny_imagenet'], default='cifar', help='example the checkpoint was trained with')
+    parser.add_argument('--levels',         nargs='+', default=None, help='resnet width,blocks,strides per level (see xnns.profiler)')
+    parser.add_argument('--checkpoint',     default=None, help='checkpoint path or directory (random weights if not given)')
+    parser.add_argument('--tfrecords-dir',  default=tiny_imagenet.DATA_TFRECORDS_DIR, help='directory with the Tiny ImageNet tfrecords')
+    parser.add_argument('--keep',           type=float, default=PRUNING_KEEP, help='fraction of the inner channels kept per bottleneck conv')
+    parser.add_argument('--criterion',      choices=['bn_gamma', 'magnitude'], default=PRUNING_CRITERION, help='channel importance')
+    parser.add_argument('--epochs',         type=int, default=PRUNING_EPOCHS, help='fine tuning epochs (0 for none)')
+    parser.add_argument('--batch-size',     type=int, default=PRUNING_BATCH_SIZE, help='fine tuning batch size')
+    parser.add_argument('--lr-initial',     type=float, default=PRUNING_LR_INITIAL, help='fine tuning learning rate')
+    parser.add_argument('--checkpoint-dir', default=None, help='checkpoint the fine tuned model to this directory')
+    parser.add_argument('--batch-sizes',    nargs='+', type=int, default=PRUNING_BATCH_SIZES, help='latency batch sizes')
+    parser.add_argument('--runs',           type=int, default=PRUNING_NUM_RUNS, help='timed runs per batch size')
+    sources.add_arguments(parser, sources.SOURCES, 'keras')
+    return parser
+
+def main(argv=None):
+
+    # arguments
+    parser = argument_parser()
+    args   = parser.parse_args(argv)
+    if args.example == 'tiny_imagenet' and args.source != 'keras':
+        parser.error('--source selects the cifar data (tiny_imagenet reads --tfrecords-dir)')
+    source = sources.source_arguments(args)
+
+    # original and pruned models
+    model_fn, image_size, crop_size, channels, scale, shift = inference.example_config(args.example, 'resnet', args.levels)
+    level_specs, num_classes    = example_specs(args.example, args.levels)
+    graph_def_reference, values = folding.reference_graph(model_fn, crop_size, channels, scale, shift, args.checkpoint)
+    values_pruned, block_widths = weights.prune(values, level_specs, args.keep, args.criterion)
+    print('Pruned bottleneck widths: {0}'.format(' '.join('{0:d},{1:d}'.format(*widths) for widths in block_widths)))
+
+    # size and cost
+    folded_fn = folding.folded_function(args.example, 'resnet', args.levels)
+    rows      = []
+    for name, values_model, widths in [('Original', values, None), ('Pruned', values_pruned, block_widths)]:
+        total = profiler.profile_resnet(level_specs, crop_size, channels, num_classes, block_widths=widths)[-1]
+        rows.append([name, total['params'], 2.0*total['macs']/1e6, folding.folded_graph(folded_fn, values_model, crop_size, channels, scale, shift)])
+
+    # latency and accuracy before fine tuning
+    images_test, labels_test = quantization.validation_images(args.example, args.tfrecords_dir, cifar.DATA_NUM_TEST if args.example == 'cifar' else tiny_imagenet.DATA_NUM_VAL, args.batch_size, source)
+    for row in rows:
+        session, images, predictions = folding.load_graph(row[3])
+        row[3]                       = [1000.0*folding.latency(session, images, predictions, images_test[0:batch_size], args.runs) for batch_size in args.batch_sizes]
+        row.append(accuracy(session, images, predictions, images_test, labels_test, max(args.batch_sizes)))
+        session.close()
+
+    # fine tune
+    if args.epochs > 0:
+        dataset_train, dataset_test, num_train, num_test = datasets(args.example, args.tfrecords_dir, args.batch_size, source)
+        metrics = training.run(dataset_train, dataset_test, pruned_model_function(level_specs, block_widths, num_classes), scale, shift, num_train, num_test, num_classes,
+                               args.batch_size, args.epochs, args.lr_initial, 1.0, args.epochs, checkpoint_dir=args.checkpoint_dir, initial_values=values_pruned)
+        rows.append(['Fine tuned'] + rows[1][1:4] + [metrics['top1']])
+
+    # display
+    latency_header = ' '.join('{0:>12s}'.format('ms @ {0:d}'.format(batch_size)) for batch_size in args.batch_sizes)
+    print('{0:10s} {1:>10s} {2:>10s} {3} {4:>8s}'.format('Model', 'Params', 'MFLOPs', latency_header, 'Top 1 %'))
+    for name, params, mflops, latencies, top1 in rows:
+        print('{0:10s} {1:10d} {2:10.2f} {3} {4:8.2f}'.format(name, params, mflops, ' '.join('{0:12.3f}'.format(value) for value in latencies), 100.0*top1))
+    print('Top 1 change: {0:+.2f} %'.format(100.0*(rows[-1][4] - rows[0][4])))
+
+if __name__ == '__main__':
+    main()
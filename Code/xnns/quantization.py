@@ -0,0 +1,231 @@
+################################################################################
+#
+# xnns/quantization.py
+#
+# DESCRIPTION
+#
+#    Post training int8 quantization for CPU inference
+#
+#    The batch norm folded inference graph (see xnns.folding) is converted to a
+#    float32 and an int8 tflite model
+#       weights:     int8, per output channel scale (convs) / per tensor scale
+#                    (dense)
+#       activations: int8, per tensor range calibrated on validation images
+#    Calibration images are the first --calibration-images of the validation
+#    pipeline (data.dataset_arrays test split for CIFAR,
+#    data.dataset_tfrecords_val for Tiny ImageNet) and accuracy is measured on
+#    the next --eval-images; CIFAR comes from --source (see xnns.sources)
+#
+# USAGE
+#
+#    python -m xnns.quantization --example cifar --checkpoint ./logs/ --export model_int8.tflite
+#    python -m xnns.quantization --example tiny_imagenet --checkpoint ./logs/ --tfrecords-dir ./data/tiny-imagenet-200/
+#
+#    Reports the model size, per image latency and top 1 accuracy of the
+#    float32 and int8 models and the top 1 drop
+#
+# NOTES
+#
+#    1. Supported models are sequential_bn and resnet (the folded graphs)
+#    2. Normalization is done on the host so the model input is the float32
+#       normalized image; the int8 model quantizes it in its first op and
+#       dequantizes the predictions in its last op
+#    3. Both models run in the tflite interpreter (batch 1) so the latency
+#       difference is the int8 kernels and not the runtime
+#    4. Without --checkpoint the weights are random (as xnns.folding) and only
+#       the size and latency are meaningful
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import argparse
+import os
+import time
+
+import numpy      as np
+import tensorflow as tf
+
+from xnns import cifar
+from xnns import data
+from xnns import folding
+from xnns import inference
+from xnns import sources
+from xnns import tiny_imagenet
+from xnns import weights
+
+
+################################################################################
+#
+# PARAMETERS
+#
+################################################################################
+
+# defaults
+QUANTIZATION_CALIBRATION_IMAGES = 500
+QUANTIZATION_EVAL_IMAGES        = 2000
+QUANTIZATION_BATCH_SIZE         = 250
+
+
+################################################################################
+#
+# DATA
+#
+################################################################################
+
+# first num_images (images, labels) of the validation pipeline of an example
+# source is the sources.Source of cifar
+def validation_images(example, tfrecords_dir, num_images, batch_size, source=sources.SOURCES_KERAS):
+
+    # validation pipeline
+    with tf.Graph().as_default():
+        if example == 'cifar':
+            (data_train, labels_train), (data_test, labels_test) = sources.load('cifar10', *source)
+            dataset = data.dataset_arrays(data_test[0:num_images], labels_test[0:num_images], batch_size, False, cifar.TRAINING_CROP_SIZE)
+        else:
+            tfrecords = data.tfrecord_files(os.path.join(tfrecords_dir, tiny_imagenet.DATA_TFRECORDS_VAL), tiny_imagenet.DATA_NUM_SHARDS_VAL)
+            dataset   = data.dataset_tfrecords_val(tfrecords, tiny_imagenet.TRAINING_IMAGE_SIZE, tiny_imagenet.TRAINING_CROP_SIZE, batch_size)
+        images, labels = dataset.make_one_shot_iterator().get_next()
+
+        # batches until num_images
+        batches = []
+        with tf.Session() as session:
+            while sum(len(batch[1]) for batch in batches) < num_images:
+                try:
+                    batches.append(session.run([images, labels]))
+                except tf.errors.OutOfRangeError:
+                    break
+
+    # return
+    return np.concatenate([batch[0] for batch in batches])[0:num_images], np.concatenate([batch[1] for batch in batches])[0:num_images]
+
+# host side data.normalize
+def normalize(images, scale, shift):
+    return images.astype(np.float32)*scale + shift
+
+
+################################################################################
+#
+# MODELS
+#
+################################################################################
+
+# folded inference graph with a normalized batch 1 input
+# input data_norm, output predictions
+def float_graph(folded_fn, values, crop_size, channels):
+    with tf.Graph().as_default() as graph:
+        data_norm = tf.placeholder(tf.float32, [1, crop_size, crop_size, channels], name='data_norm')
+        tf.identity(folded_fn(weights.reader_init(values), data_norm), name='predictions')
+        return graph.as_graph_def()
+
+# tflite model of a float graph
+# float32 if calibration is None else int8 with activation ranges calibrated on
+# the (normalized) calibration images
+def convert(graph_def, calibration=None):
+    with tf.Graph().as_default() as graph:
+        tf.import_graph_def(graph_def, name='')
+        with tf.Session() as session:
+            converter = tf.lite.TFLiteConverter.from_session(session, [graph.get_tensor_by_name('data_norm:0')], [graph.get_tensor_by_name('predictions:0')])
+            if calibration is not None:
+                converter.optimizations             = [tf.lite.Optimize.DEFAULT]
+                converter.representative_dataset    = tf.lite.RepresentativeDataset(lambda: ([calibration[index:index + 1]] for index in range(len(calibration))))
+                converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+            return converter.convert()
+
+
+################################################################################
+#
+# EVALUATION
+#
+################################################################################
+
+# top 1 accuracy and seconds per image of a tflite model
+# 1 image per invoke after 1 warm up invoke
+def evaluate(model, data_norm, labels):
+
+    # interpreter
+    interpreter = tf.lite.Interpreter(model_content=model)
+    interpreter.allocate_tensors()
+    input_index  = interpreter.get_input_details()[0]['index']
+    output_index = interpreter.get_output_details()[0]['index']
+
+    # warm up
+    interpreter.set_tensor(input_index, data_norm[0:1])
+    interpreter.invoke()
+
+    # cycle through the images
+    predictions = np.zeros(len(data_norm), dtype=np.int32)
+    time_start  = time.time()
+    for index in range(len(data_norm)):
+        interpreter.set_tensor(input_index, data_norm[index:index + 1])
+        interpreter.invoke()
+        predictions[index] = np.argmax(interpreter.get_tensor(output_index))
+    seconds = time.time() - time_start
+
+    # return
+    return np.mean(predictions == labels), seconds/len(data_norm)
+
+
+################################################################################
+#
+# MAIN
+#
+################################################################################
+
+# command line arguments
+def argument_parser():
+    parser = argparse.ArgumentParser(description='Post training int8 quantization for CPU inference')
+    parser.add_argument('--example',            choices=['cifar', 'tiny_imagenet'], default='cifar', help='example the checkpoint was trained with')
+    parser.add_argument('--model',              choices=['resnet', 'sequential_bn'], default='resnet', help='model')
+    parser.add_argument('--levels',             nargs='+', default=None, help='resnet width,blocks,strides per level (see xnns.profiler)')
+    parser.add_argument('--checkpoint',         default=None, help='checkpoint path or directory (random weights if not given)')
+    parser.add_argument('--tfrecords-dir',      default=tiny_imagenet.DATA_TFRECORDS_DIR, help='directory with the Tiny ImageNet tfrecords')
+    parser.add_argument('--calibration-images', type=int, default=QUANTIZATION_CALIBRATION_IMAGES, help='validation images used to calibrate the activation ranges')
+    parser.add_argument('--eval-images',        type=int, default=QUANTIZATION_EVAL_IMAGES, help='validation images (after the calibration images) used to measure accuracy and latency')
+    parser.add_argument('--export',             default=None, help='write the int8 model to this .tflite file')
+    sources.add_arguments(parser, sources.SOURCES, 'keras')
+    return parser
+
+def main(argv=None):
+
+    # arguments
+    parser = argument_parser()
+    args   = parser.parse_args(argv)
+    if args.example == 'tiny_imagenet' and args.source != 'keras':
+        parser.error('--source selects the cifar data (tiny_imagenet reads --tfrecords-dir)')
+
+    # data
+    model_fn, image_size, crop_size, channels, scale, shift = inference.example_config(args.example, args.model, args.levels)
+    images, labels = validation_images(args.example, args.tfrecords_dir, args.calibration_images + args.eval_images, QUANTIZATION_BATCH_SIZE, sources.source_arguments(args))
+    if len(labels) <= args.calibration_images:
+        parser.error('only {0:d} validation images, need more than --calibration-images'.format(len(labels)))
+    data_norm   = normalize(images, scale, shift)
+    calibration = data_norm[0:args.calibration_images]
+    data_eval   = data_norm[args.calibration_images:]
+    labels_eval = labels[args.calibration_images:]
+
+    # models
+    graph_def_reference, values = folding.reference_graph(model_fn, crop_size, channels, scale, shift, args.checkpoint)
+    graph_def                   = float_graph(folding.folded_function(args.example, args.model, args.levels), values, crop_size, channels)
+    model_float                 = convert(graph_def)
+    model_int8                  = convert(graph_def, calibration)
+    if args.export is not None:
+        with open(args.export, 'wb') as file:
+            file.write(model_int8)
+
+    # display
+    print('Calibration images: {0:d}, evaluation images: {1:d}'.format(len(calibration), len(data_eval)))
+    print('{0:>8s} {1:>10s} {2:>12s} {3:>10s}'.format('Model', 'Size MB', 'Latency ms', 'Top 1 %'))
+    accuracy = {}
+    for name, model in [('float32', model_float), ('int8', model_int8)]:
+        accuracy[name], seconds = evaluate(model, data_eval, labels_eval)
+        print('{0:>8s} {1:10.2f} {2:12.3f} {3:10.2f}'.format(name, len(model)/2.0**20, 1000.0*seconds, 100.0*accuracy[name]))
+    print('Top 1 drop: {0:.2f} %'.format(100.0*(accuracy['float32'] - accuracy['int8'])))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+################################################################################
+#
+# xnns/recordio.py
+#
+# DESCRIPTION
+#
+#    tfrecord shard files, their sidecar offset indexes and random access reads
+#    of records by global record index
+#
+# NOTES
+#
+#    1. numpy only (no tensorflow): records are located from the length
+#       headers and read with os.pread; parsing them is left to xnns.data,
+#       which re-exports this module
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import os
+import struct
+import threading
+import weakref
+
+import numpy as np
+
+
+################################################################################
+#
+# TFRECORDS
+#
+################################################################################
+
+# tfrecord file names from a pattern with a {} for the shard index
+def tfrecord_files(pattern, num_shards):
+    return [pattern.format(i) for i in range(num_shards)]
+
+# sidecar index of a tfrecord file written by xNNs_Data_03_TinyImageNet.py
+# N x 2 int64 (offset, length) of each record
+TFRECORD_INDEX_SUFFIX = '.index.npy'
+
+# (offset, length) of every record of a tfrecord file from its length headers
+# (a record is an 8 byte length, a 4 byte crc, the data and a 4 byte crc)
+# without reading the data
+def tfrecord_scan(path):
+    records = []
+    with open(path, 'rb') as file:
+        offset = 0
+        header = file.read(8)
+        while len(header) == 8:
+            length  = struct.unpack('<Q', header)[0]
+            records.append((offset, length))
+            offset += 16 + length
+            file.seek(offset)
+            header  = file.read(8)
+    return np.array(records, dtype=np.int64).reshape(-1, 2)
+
+# check if the sidecar index of a tfrecord file exists and is not older than
+# the file (a re packed shard has new offsets)
+def tfrecord_index_is_current(path):
+    index = path + TFRECORD_INDEX_SUFFIX
+    return os.path.exists(index) == True and os.path.getmtime(index) >= os.path.getmtime(path)
+
+# (shard, offset, length) of every record of tfrecord files in global index
+# order (shard by shard) from the sidecar indexes or, for a shard without a
+# current one, a scan of the headers
+def tfrecord_locations(tfrecords):
+    locations = []
+    for shard, path in enumerate(tfrecords):
+        if tfrecord_index_is_current(path) == True:
+            records = np.load(path + TFRECORD_INDEX_SUFFIX)
+        else:
+            records = tfrecord_scan(path)
+        locations.append(np.concatenate([np.full((len(records), 1), shard, dtype=np.int64), records], axis=1))
+    return np.concatenate(locations) if len(locations) > 0 else np.zeros((0, 3), dtype=np.int64)
+
+# number of records of tfrecord files (instant with sidecar indexes)
+def tfrecord_count(tfrecords):
+    return len(tfrecord_locations(tfrecords))
+
+# function that reads the records of an array of global indices into locations
+# the records are sorted by location and each run of adjacent records of a
+# shard is read with 1 pread
+# each file is opened once (under a lock as parallel py_func calls share the
+# reader) and read.close() closes them, as does releasing the reader
+def tfrecord_reader(tfrecords, locations):
+
+    # open files
+    files = {}
+    lock  = threading.Lock()
+    def open_file(shard):
+        with lock:
+            if shard not in files:
+                files[shard] = os.open(tfrecords[shard], os.O_RDONLY)
+            return files[shard]
+    def close():
+        with lock:
+            for fd in files.values():
+                os.close(fd)
+            files.clear()
+
+    # read
+    def read(indices):
+        records = np.empty(len(indices), dtype=object)
+        order   = np.lexsort((locations[indices, 1], locations[indices, 0]))
+        start   = 0
+        while start < len(order):
+
+            # run of adjacent records
+            end = start + 1
+            while end < len(order) and locations[indices[order[end]], 0] == locations[indices[order[end - 1]], 0] and \
+                  locations[indices[order[end]], 1] == locations[indices[order[end - 1]], 1] + 16 + locations[indices[order[end - 1]], 2]:
+                end += 1
+
+            # read the run and split it into records
+            shard, offset, length = locations[indices[order[start]]]
+            last                  = locations[indices[order[end - 1]]]
+            block                 = os.pread(open_file(shard), int(last[1] + 16 + last[2] - offset), int(offset))
+            for index in order[start:end]:
+                record_offset  = int(locations[indices[index], 1] - offset) + 12
+                records[index] = block[record_offset:record_offset + int(locations[indices[index], 2])]
+            start = end
+
+        # return
+        return records
+
+    # return
+    read.close = weakref.finalize(read, close)
+    return read
@@ -0,0 +1,155 @@
+################################################################################
+#
+# xnns/records.py
+#
+# DESCRIPTION
+#
+#    Random access to the Tiny ImageNet tfrecords by global record index
+#
+#    Global index i is record i of the shards in shard order; the sidecar
+#    offset index of every shard (shard.tfrecords.index.npy, N x 2 int64
+#    offset and length, written by xNNs_Data_03_TinyImageNet.py) locates it
+#    without a scan so
+#       --count:       counts the records of the split (instant)
+#       --index i ...: decodes records i ... to images (and labels) with 1
+#                      pread per run of adjacent records, e.g. to look at the
+#                      misclassified samples of an evaluation
+#       --build-index: writes the sidecar index of shards converted before the
+#                      index existed or modified after it (1 scan of the
+#                      length headers)
+#
+# USAGE
+#
+#    python -m xnns.records --tfrecords-dir ./data/tiny-imagenet-200/ --split val --count
+#    python -m xnns.records --tfrecords-dir ./data/tiny-imagenet-200/ --split val --index 17 4093 --output samples.npz
+#    python -m xnns.records --tfrecords-dir ./data/tiny-imagenet-200/ --build-index
+#
+# NOTES
+#
+#    1. Shards without a sidecar index, or with one older than the shard, are
+#       scanned (data.tfrecord_locations) so every command also works on older
+#       or re packed shards, just not instantly
+#    2. The records are the serialized tf.train.Example protos so parsing
+#       needs tensorflow but not a tf.data pipeline
+#    3. --count and --index fail when a shard of the split is missing, as the
+#       global index of every later record would shift
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import argparse
+import os
+import time
+
+import numpy      as np
+import tensorflow as tf
+
+from xnns import data
+from xnns import tiny_imagenet
+
+
+################################################################################
+#
+# RECORDS
+#
+################################################################################
+
+# tfrecord files of a split
+def split_files(tfrecords_dir, split):
+    if split == 'train':
+        return data.tfrecord_files(os.path.join(tfrecords_dir, tiny_imagenet.DATA_TFRECORDS_TRAIN), tiny_imagenet.DATA_NUM_SHARDS_TRAIN)
+    return data.tfrecord_files(os.path.join(tfrecords_dir, tiny_imagenet.DATA_TFRECORDS_VAL), tiny_imagenet.DATA_NUM_SHARDS_VAL)
+
+# write the sidecar index of shards that do not have one or whose index is
+# older than the shard
+# returns the shards indexed
+def build_indexes(tfrecords):
+    indexed = []
+    for path in tfrecords:
+        if os.path.exists(path) == False or data.tfrecord_index_is_current(path) == True:
+            continue
+        np.save(path + data.TFRECORD_INDEX_SUFFIX + '.tmp.npy', data.tfrecord_scan(path))
+        os.replace(path + data.TFRECORD_INDEX_SUFFIX + '.tmp.npy', path + data.TFRECORD_INDEX_SUFFIX)
+        indexed.append(path)
+    return indexed
+
+# images and labels of records by global index
+def read_samples(tfrecords, indices, image_size):
+
+    # records
+    locations = data.tfrecord_locations(tfrecords)
+    indices   = np.asarray(indices, dtype=np.int64)
+    if np.any(indices < 0) or np.any(indices >= len(locations)):
+        raise ValueError('record index out of range [0, {0:d})'.format(len(locations)))
+    read    = data.tfrecord_reader(tfrecords, locations)
+    records = read(indices)
+    read.close()
+
+    # decode
+    with tf.Graph().as_default():
+        record       = tf.placeholder(tf.string, [])
+        image, label = data.parse_record(record, image_size)
+        with tf.Session() as session:
+            samples = [session.run([image, label], feed_dict={record: value}) for value in records]
+
+    # return
+    return np.stack([sample[0] for sample in samples]), np.array([sample[1] for sample in samples], dtype=np.int32)
+
+
+################################################################################
+#
+# MAIN
+#
+################################################################################
+
+def main(argv=None):
+
+    # arguments
+    parser = argparse.ArgumentParser(description='Random access to the Tiny ImageNet tfrecords by global record index')
+    parser.add_argument('--tfrecords-dir', default=tiny_imagenet.DATA_TFRECORDS_DIR, help='directory with the Tiny ImageNet tfrecords')
+    parser.add_argument('--split',         choices=['train', 'val'], default='val', help='tfrecords split')
+    parser.add_argument('--count',         action='store_true', help='count the records of the split')
+    parser.add_argument('--index',         nargs='+', type=int, default=None, help='global record indices to read')
+    parser.add_argument('--output',        default=None, help='write the images and labels of --index to this .npz file')
+    parser.add_argument('--build-index',   action='store_true', help='write the missing sidecar indexes of both splits')
+    args   = parser.parse_args(argv)
+
+    # sidecar indexes
+    if args.build_index == True:
+        for split in ['train', 'val']:
+            for path in build_indexes(split_files(args.tfrecords_dir, split)):
+                print('Indexed: {0}'.format(path))
+
+    # shards
+    # a missing shard would shift the global index of every later record
+    tfrecords = split_files(args.tfrecords_dir, args.split)
+    missing   = [path for path in tfrecords if os.path.exists(path) == False]
+    if (args.count == True or args.index is not None) and len(missing) > 0:
+        parser.error('{0:d} of the {1:d} {2} shards are missing (first: {3})'.format(len(missing), len(tfrecords), args.split, missing[0]))
+
+    # count
+    if args.count == True:
+        time_start  = time.time()
+        num_records = data.tfrecord_count(tfrecords)
+        print('Records ({0}): {1:d} in {2:d} shards ({3:.3f} s)'.format(args.split, num_records, len(tfrecords), time.time() - time_start))
+
+    # read
+    if args.index is not None:
+        try:
+            images, labels = read_samples(tfrecords, args.index, tiny_imagenet.TRAINING_IMAGE_SIZE)
+        except ValueError as error:
+            parser.error(str(error))
+        for index, image, label in zip(args.index, images, labels):
+            print('Record {0:d}: label {1:d}, image {2}, mean {3:.1f}'.format(index, label, image.shape, image.mean()))
+        if args.output is not None:
+            np.savez(args.output, indices=np.array(args.index, dtype=np.int64), images=images, labels=labels)
+            print('Samples: {0}'.format(args.output))
+
+if __name__ == '__main__':
+    main()
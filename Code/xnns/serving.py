@@ -0,0 +1,412 @@
+################################################################################
+#
+# xnns/serving.py
+#
+# DESCRIPTION
+#
+#    Local HTTP inference server with dynamic request batching
+#
+# DESIGN
+#
+#    1. Graph:    the model is built in inference mode (train_state fixed
+#                 False, batch norm moving statistics), its variables are
+#                 restored from a checkpoint and frozen to constants and the
+#                 training nodes are removed
+#    2. Warm up:  a batch of 1 and a batch of max_batch_size images are run
+#                 before the server accepts requests
+#    3. Requests: POST /predict with a .npy uint8 image (rows x cols [x
+#                 channels], the training image size or the crop size) returns
+#                 JSON {"classes": [...], "probs": [...]} with the top k
+#    4. Batching: a batcher thread collects concurrent requests into a micro
+#                 batch until it has max_batch_size images or max_wait seconds
+#                 have passed since the first one, then runs 1 forward pass
+#    5. Errors:   a failed forward pass (e.g. out of memory) answers each
+#                 request of its micro batch with 500 and keeps serving; a
+#                 request without a result after the timeout gets 503
+#
+# USAGE
+#
+#    python -m xnns.serving --example cifar --checkpoint ./logs/ --port 8080
+#    python -m xnns.serving --example cifar --benchmark
+#
+#    --benchmark runs a closed loop load generator (--clients concurrent
+#    clients in a separate process) against the server for each max batch size
+#    and max wait and reports the throughput / latency curve and the failed
+#    requests (connection and HTTP errors, not counted in the throughput and
+#    latency)
+#    --export writes the frozen graph (.pb)
+#
+# NOTES
+#
+#    1. Without --checkpoint the variables are randomly initialized (for
+#       benchmarking only)
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import argparse
+import http.client
+import http.server
+import io
+import json
+import multiprocessing
+import queue
+import socketserver
+import threading
+import time
+import urllib.request
+
+import numpy      as np
+import tensorflow as tf
+
+from xnns import data
+from xnns import inference
+from xnns import multistep
+
+
+################################################################################
+#
+# PARAMETERS
+#
+################################################################################
+
+# server
+SERVING_HOST           = '127.0.0.1'
+SERVING_PORT           = 8080
+SERVING_MAX_BATCH_SIZE = 32
+SERVING_MAX_WAIT_MS    = 5.0
+SERVING_TOP_K          = 5
+SERVING_TIMEOUT_S      = 30.0
+SERVING_LISTEN_BACKLOG = 128
+
+# benchmark
+SERVING_BENCHMARK_BATCH_SIZES = [1, 8, 32]
+SERVING_BENCHMARK_WAITS_MS    = [0.0, 2.0, 5.0]
+SERVING_BENCHMARK_CLIENTS     = 32
+SERVING_BENCHMARK_REQUESTS    = 2000
+
+
+################################################################################
+#
+# FROZEN GRAPH
+#
+################################################################################
+
+# frozen inference graph
+# input images (uint8, batch x crop_size x crop_size x channels) and outputs
+# top_k_probs and top_k_classes
+def freeze_graph(model_fn, crop_size, channels, scale, shift, checkpoint, top_k):
+
+    # graph
+    with tf.Graph().as_default() as graph:
+
+        # model in inference mode with the training variable names
+        images = tf.placeholder(tf.uint8, [None, crop_size, crop_size, channels], name='images')
+        with tf.variable_scope(multistep.MODEL_SCOPE):
+            predictions = model_fn(data.normalize(images, scale, shift), False)
+
+        # top k
+        probs, classes = tf.nn.top_k(tf.nn.softmax(predictions), k=top_k)
+        tf.identity(probs,   name='top_k_probs')
+        tf.identity(classes, name='top_k_classes')
+
+        # variables to constants
+        with tf.Session() as session:
+            if checkpoint is None:
+                session.run(tf.global_variables_initializer())
+            else:
+                if tf.gfile.IsDirectory(checkpoint):
+                    checkpoint = tf.train.latest_checkpoint(checkpoint)
+                tf.train.Saver(tf.global_variables(scope=multistep.MODEL_SCOPE)).restore(session, checkpoint)
+            graph_def = tf.graph_util.convert_variables_to_constants(session, graph.as_graph_def(), ['top_k_probs', 'top_k_classes'])
+
+    # return without the training nodes
+    return tf.graph_util.remove_training_nodes(graph_def, protected_nodes=['images', 'top_k_probs', 'top_k_classes'])
+
+# session of a frozen graph
+# returns the session and the images, top_k_probs and top_k_classes tensors
+def load_frozen(graph_def):
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name='')
+    session = tf.Session(graph=graph)
+    return session, graph.get_tensor_by_name('images:0'), graph.get_tensor_by_name('top_k_probs:0'), graph.get_tensor_by_name('top_k_classes:0')
+
+# warm up with a batch of 1 and a batch of max_batch_size images
+def warm_up(session, images, outputs, image_shape, max_batch_size):
+    for batch_size in [1, max_batch_size]:
+        session.run(outputs, feed_dict={images: np.zeros([batch_size] + image_shape, dtype=np.uint8)})
+
+
+################################################################################
+#
+# BATCHING
+#
+################################################################################
+
+# batcher thread
+# each request is a dict with an image, a done event and the result
+# the result of a failed forward pass is {'error': message} for every request
+# of the micro batch
+# a None request stops the thread
+def batcher(session, images, outputs, requests, max_batch_size, max_wait):
+
+    # cycle through the micro batches
+    stop = False
+    while stop == False:
+
+        # wait for the first request
+        request = requests.get()
+        if request is None:
+            return
+        batch    = [request]
+        deadline = time.time() + max_wait
+
+        # collect until max_batch_size or the deadline
+        while len(batch) < max_batch_size:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                request = requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request is None:
+                stop = True
+                break
+            batch.append(request)
+
+        # 1 forward pass and results
+        try:
+            probs, classes = session.run(outputs, feed_dict={images: np.stack([request['image'] for request in batch])})
+            results        = [{'classes': classes[index].tolist(), 'probs': probs[index].tolist()} for index in range(len(batch))]
+        except Exception as error:
+            results        = [{'error': '{0}: {1}'.format(type(error).__name__, error)}]*len(batch)
+        for request, result in zip(batch, results):
+            request['result'] = result
+            request['done'].set()
+
+
+################################################################################
+#
+# HTTP
+#
+################################################################################
+
+# request handler
+# the server has requests (the batcher queue), image_size, crop_size,
+# channels and result_timeout attributes
+class PredictHandler(http.server.BaseHTTPRequestHandler):
+
+    # POST /predict
+    def do_POST(self):
+
+        # image
+        if self.path != '/predict':
+            self.send_error(404)
+            return
+        try:
+            image = np.load(io.BytesIO(self.rfile.read(int(self.headers['Content-Length']))))
+            image = pre_process(image, self.server.image_size, self.server.crop_size, self.server.channels)
+        except (ValueError, TypeError, OSError) as error:
+            self.send_error(400, str(error))
+            return
+
+        # queue and wait for the batcher
+        request = {'image': image, 'done': threading.Event(), 'result': None}
+        self.server.requests.put(request)
+        if request['done'].wait(self.server.result_timeout) == False:
+            self.send_error(503, 'no result after {0:.1f} s'.format(self.server.result_timeout))
+            return
+        if 'error' in request['result']:
+            self.send_error(500, request['result']['error'])
+            return
+
+        # response
+        body = json.dumps(request['result']).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # no per request logging
+    def log_message(self, format, *args):
+        pass
+
+# threaded http server (1 thread per connection)
+# the listen backlog should be at least the number of concurrent clients so
+# connections are not reset or stalled in SYN retries
+class ThreadingServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler, listen_backlog=SERVING_LISTEN_BACKLOG):
+        self.request_queue_size = listen_backlog
+        super().__init__(address, handler)
+
+# image to the model input (crop_size x crop_size x channels uint8)
+# images of the training image size are center cropped
+def pre_process(image, image_size, crop_size, channels):
+    if image.ndim == 2:
+        image = image[:, :, None]
+    if image.dtype != np.uint8 or image.shape[2] != channels or image.shape[0] != image.shape[1] or image.shape[0] not in [image_size, crop_size]:
+        raise ValueError('expected a uint8 {0} or {1} square image with {2} channels'.format(image_size, crop_size, channels))
+    if image.shape[0] == image_size and image_size != crop_size:
+        crop_top = (image_size - crop_size) // 2
+        image    = image[crop_top:crop_top + crop_size, crop_top:crop_top + crop_size, :]
+    return image
+
+# start the batcher thread and the server (serving on a background thread)
+# returns the server; stop_server stops both
+def start_server(graph_def, image_size, crop_size, channels, host, port, max_batch_size, max_wait, timeout=SERVING_TIMEOUT_S, listen_backlog=SERVING_LISTEN_BACKLOG):
+
+    # frozen graph session and warm up
+    session, images, probs, classes = load_frozen(graph_def)
+    warm_up(session, images, [probs, classes], [crop_size, crop_size, channels], max_batch_size)
+
+    # batcher
+    requests = queue.Queue()
+    thread   = threading.Thread(target=batcher, args=(session, images, [probs, classes], requests, max_batch_size, max_wait))
+    thread.start()
+
+    # server
+    server                = ThreadingServer((host, port), PredictHandler, listen_backlog)
+    server.requests       = requests
+    server.batcher        = thread
+    server.session        = session
+    server.image_size     = image_size
+    server.crop_size      = crop_size
+    server.channels       = channels
+    server.result_timeout = timeout
+    threading.Thread(target=server.serve_forever).start()
+
+    # return
+    return server
+
+# stop the server and its batcher
+def stop_server(server):
+    server.shutdown()
+    server.server_close()
+    server.requests.put(None)
+    server.batcher.join()
+    server.session.close()
+
+
+################################################################################
+#
+# LOAD GENERATOR
+#
+################################################################################
+
+# closed loop load generator
+# num_clients threads each send num_requests/num_clients requests one after
+# the other
+# a request that fails (connection or HTTP error) is counted and the client
+# goes on with its next request
+# returns the throughput (completed requests / sec), the p50 / p99 latency
+# (sec) of the completed requests and the number of failed requests
+def load_generator(url, image_shape, num_clients, num_requests):
+
+    # request body
+    buffer = io.BytesIO()
+    np.save(buffer, np.random.randint(0, 256, size=image_shape, dtype=np.uint8))
+    body   = buffer.getvalue()
+
+    # client
+    latencies = [[] for client in range(num_clients)]
+    failures  = [0]*num_clients
+    def client(client_index):
+        for request_index in range(num_requests // num_clients):
+            time_start = time.time()
+            try:
+                urllib.request.urlopen(urllib.request.Request(url, data=body, headers={'Content-Type': 'application/octet-stream'})).read()
+            except (OSError, http.client.HTTPException):
+                failures[client_index] += 1
+                continue
+            latencies[client_index].append(time.time() - time_start)
+
+    # run the clients
+    threads    = [threading.Thread(target=client, args=(client_index,)) for client_index in range(num_clients)]
+    time_start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    time_total = time.time() - time_start
+
+    # return
+    latencies = np.concatenate([np.array(client_latencies) for client_latencies in latencies])
+    if len(latencies) == 0:
+        return 0.0, float('nan'), float('nan'), sum(failures)
+    return len(latencies)/time_total, np.percentile(latencies, 50), np.percentile(latencies, 99), sum(failures)
+
+
+################################################################################
+#
+# MAIN
+#
+################################################################################
+
+def main(argv=None):
+
+    # arguments
+    parser = argparse.ArgumentParser(description='HTTP inference server with dynamic request batching')
+    parser.add_argument('--example',        choices=['mnist', 'cifar', 'tiny_imagenet'], default='cifar', help='example the checkpoint was trained with')
+    parser.add_argument('--model',          choices=['resnet', 'sequential', 'sequential_bn'], default='resnet', help='model (cifar and tiny_imagenet)')
+    parser.add_argument('--levels',         nargs='+', default=None, help='resnet width,blocks,strides per level (see xnns.profiler)')
+    parser.add_argument('--checkpoint',     default=None, help='checkpoint path or directory (random weights if not given)')
+    parser.add_argument('--host',           default=SERVING_HOST, help='server address')
+    parser.add_argument('--port',           type=int,   default=SERVING_PORT, help='server port')
+    parser.add_argument('--max-batch-size', type=int,   default=SERVING_MAX_BATCH_SIZE, help='largest micro batch')
+    parser.add_argument('--max-wait-ms',    type=float, default=SERVING_MAX_WAIT_MS, help='longest wait after the first request of a micro batch')
+    parser.add_argument('--top-k',          type=int,   default=SERVING_TOP_K, help='predictions per image')
+    parser.add_argument('--timeout-s',      type=float, default=SERVING_TIMEOUT_S, help='longest wait for the result of a request (503 after it)')
+    parser.add_argument('--export',         default=None, help='also write the frozen graph to this .pb file')
+    parser.add_argument('--benchmark',      action='store_true', help='run the load generator benchmark instead of serving')
+    parser.add_argument('--clients',        type=int,   default=SERVING_BENCHMARK_CLIENTS, help='benchmark concurrent clients')
+    parser.add_argument('--requests',       type=int,   default=SERVING_BENCHMARK_REQUESTS, help='benchmark requests per configuration')
+    parser.add_argument('--batch-sizes',    nargs='+', type=int,   default=SERVING_BENCHMARK_BATCH_SIZES, help='benchmark max batch sizes')
+    parser.add_argument('--waits-ms',       nargs='+', type=float, default=SERVING_BENCHMARK_WAITS_MS, help='benchmark max waits')
+    args   = parser.parse_args(argv)
+
+    # frozen graph
+    model_fn, image_size, crop_size, channels, scale, shift = inference.example_config(args.example, args.model, args.levels)
+    crop_size = image_size if crop_size is None else crop_size
+    graph_def = freeze_graph(model_fn, crop_size, channels, scale, shift, args.checkpoint, args.top_k)
+    if args.export is not None:
+        with tf.gfile.GFile(args.export, 'wb') as file:
+            file.write(graph_def.SerializeToString())
+
+    # serve
+    if args.benchmark == False:
+        server = start_server(graph_def, image_size, crop_size, channels, args.host, args.port, args.max_batch_size, args.max_wait_ms/1000.0, args.timeout_s)
+        print('Serving POST http://{0}:{1:d}/predict (ctrl-c to stop)'.format(args.host, args.port))
+        try:
+            while True:
+                time.sleep(1.0)
+        except KeyboardInterrupt:
+            stop_server(server)
+        return
+
+    # benchmark
+    # the load generator runs in its own process so it does not share the
+    # server's interpreter
+    url     = 'http://{0}:{1:d}/predict'.format(args.host, args.port)
+    context = multiprocessing.get_context('spawn')
+    print('{0:>14s} {1:>11s} {2:>14s} {3:>12s} {4:>12s} {5:>8s}'.format('Max batch size', 'Max wait ms', 'Requests / sec', 'p50 ms', 'p99 ms', 'Failed'))
+    for max_batch_size in args.batch_sizes:
+        for max_wait_ms in args.waits_ms:
+            server = start_server(graph_def, image_size, crop_size, channels, args.host, args.port, max_batch_size, max_wait_ms/1000.0, listen_backlog=max(args.clients, SERVING_LISTEN_BACKLOG))
+            with context.Pool(1) as pool:
+                throughput, latency_50, latency_99, failures = pool.apply(load_generator, (url, [crop_size, crop_size, channels], args.clients, args.requests))
+            stop_server(server)
+            print('{0:14d} {1:11.1f} {2:14.1f} {3:12.2f} {4:12.2f} {5:8d}'.format(max_batch_size, max_wait_ms, throughput, 1000.0*latency_50, 1000.0*latency_99, failures))
+
+if __name__ == '__main__':
+    main()
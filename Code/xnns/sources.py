@@ -0,0 +1,290 @@
+################################################################################
+#
+# xnns/sources.py
+#
+# DESCRIPTION
+#
+#    Offline dataset sources with a binary cache
+#
+#    MNIST, CIFAR-10 and Tiny ImageNet training and testing arrays from
+#       keras:     tf.keras.datasets download (data.load_keras, MNIST and
+#                  CIFAR only)
+#       local:     an archive already on disk
+#                     mnist:         mnist.npz (the keras file) or a directory
+#                                    with the 4 idx .gz files
+#                     cifar10:       cifar-10-python.tar.gz or the extracted
+#                                    cifar-10-batches-py directory
+#                     tiny_imagenet: tiny-imagenet-200.zip or the extracted
+#                                    tiny-imagenet-200 directory
+#       synthetic: seeded random images and labels with the shapes and dtypes
+#                  of the real dataset (no files needed)
+#    local and synthetic arrays are parsed / generated once and cached as .npy
+#    files that are memory mapped on the next load
+#
+# USAGE
+#
+#    (data_train, labels_train), (data_test, labels_test) = sources.load('cifar10', 'local', './download/cifar-10-python.tar.gz', './data/cache/')
+#
+#    python -m xnns.cifar --source local --source-path ./download/cifar-10-python.tar.gz
+#    python -m xnns.tiny_imagenet --source synthetic
+#    python -m xnns.quantization --example cifar --source local --source-path ./download/cifar-10-python.tar.gz
+#
+#    The CIFAR data of xnns.quantization, xnns.pruning and xnns.tracing also
+#    comes from --source
+#
+# NOTES
+#
+#    1. The arrays have the data.load_keras format: uint8 images (N x rows x
+#       cols for MNIST, N x rows x cols x 3 otherwise) and int32 labels (N)
+#    2. The cache directory has 1 sub directory per dataset and source with
+#       {train, test}_{images, labels}.npy and a source.json of the archive
+#       size and modification time (or the synthetic seed); a changed source
+#       is parsed again
+#    3. Tiny ImageNet images are decoded with tensorflow in batches; training
+#       images are in wnids.txt class order and then file name order, testing
+#       images are the val images in file name order
+#    4. tensorflow is imported by the keras source and the jpeg decoding only,
+#       so the cache, the local MNIST / CIFAR parsers and the synthetic source
+#       work without it
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import collections
+import gzip
+import json
+import os
+import pickle
+import re
+import tarfile
+import zipfile
+
+import numpy as np
+
+
+################################################################################
+#
+# PARAMETERS
+#
+################################################################################
+
+# sources
+SOURCES = ['keras', 'local', 'synthetic']
+
+# defaults
+SOURCES_CACHE_DIR   = './data/cache/'
+SOURCES_SEED        = 1
+SOURCES_DECODE_SIZE = 1000
+
+# shapes of the real datasets
+# training images, testing images, classes
+SOURCES_SHAPES = {
+    'mnist':         ((60000,  28, 28),    (10000, 28, 28),    10),
+    'cifar10':       ((50000,  32, 32, 3), (10000, 32, 32, 3), 10),
+    'tiny_imagenet': ((100000, 64, 64, 3), (10000, 64, 64, 3), 200)}
+
+
+################################################################################
+#
+# CACHE
+#
+################################################################################
+
+# cache directory of a dataset and source
+def cache_path(cache_dir, name, source):
+    return os.path.join(cache_dir, '{0}_{1}'.format(name, source))
+
+# cached (images, labels) .npy files of a split ('train' or 'test')
+def cache_files(cache_dir, name, source, split):
+    return tuple(os.path.join(cache_path(cache_dir, name, source), '{0}_{1}.npy'.format(split, kind)) for kind in ['images', 'labels'])
+
+# description of a source (compared with the cached one)
+def source_identity(source, path, seed):
+    if source == 'synthetic':
+        return {'source': source, 'seed': seed}
+    stat = os.stat(path)
+    return {'source': source, 'path': os.path.abspath(path), 'bytes': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+# memory mapped cached arrays or None if the cache is missing or stale
+def load_cache(cache_dir, name, source, identity):
+    try:
+        with open(os.path.join(cache_path(cache_dir, name, source), 'source.json')) as file:
+            if json.load(file) != identity:
+                return None
+        return tuple(tuple(np.load(path, mmap_mode='r') for path in cache_files(cache_dir, name, source, split)) for split in ['train', 'test'])
+    except (OSError, ValueError):
+        return None
+
+# write arrays to the cache
+# source.json is written last so an interrupted write is never loaded
+def save_cache(cache_dir, name, source, identity, arrays):
+    directory = cache_path(cache_dir, name, source)
+    if os.path.isdir(directory) == False:
+        os.makedirs(directory)
+    for split, split_arrays in zip(['train', 'test'], arrays):
+        for path, values in zip(cache_files(cache_dir, name, source, split), split_arrays):
+            np.save(path + '.tmp.npy', values)
+            os.replace(path + '.tmp.npy', path)
+    with open(os.path.join(directory, 'source.json.tmp'), 'w') as file:
+        json.dump(identity, file)
+    os.replace(os.path.join(directory, 'source.json.tmp'), os.path.join(directory, 'source.json'))
+
+
+################################################################################
+#
+# SYNTHETIC
+#
+################################################################################
+
+# random images and labels with the shapes of a dataset
+def load_synthetic(name, seed):
+    shape_train, shape_test, num_classes = SOURCES_SHAPES[name]
+    state = np.random.RandomState(seed)
+    return tuple((state.randint(0, 256, size=shape, dtype=np.uint8), state.randint(0, num_classes, size=shape[0:1], dtype=np.int32)) for shape in [shape_train, shape_test])
+
+
+################################################################################
+#
+# LOCAL ARCHIVES
+#
+################################################################################
+
+# mnist idx file (gzip) as an array
+def read_idx(path):
+    with gzip.open(path, 'rb') as file:
+        content = file.read()
+    num_dims = content[3]
+    shape    = tuple(int.from_bytes(content[4 + 4*dim:8 + 4*dim], 'big') for dim in range(num_dims))
+    return np.frombuffer(content, dtype=np.uint8, offset=4 + 4*num_dims).reshape(shape)
+
+# mnist from mnist.npz or a directory of idx files
+def load_mnist(path):
+    if os.path.isdir(path) == False:
+        with np.load(path) as arrays:
+            return (arrays['x_train'], arrays['y_train'].astype(np.int32)), (arrays['x_test'], arrays['y_test'].astype(np.int32))
+    return tuple((read_idx(os.path.join(path, '{0}-images-idx3-ubyte.gz'.format(prefix))), read_idx(os.path.join(path, '{0}-labels-idx1-ubyte.gz'.format(prefix))).astype(np.int32)) for prefix in ['train', 't10k'])
+
+# cifar-10 from the python version archive or its extracted directory
+def load_cifar10(path):
+
+    # batch files
+    names = ['data_batch_{0:d}'.format(index) for index in range(1, 6)] + ['test_batch']
+    if os.path.isdir(path) == True:
+        batches = {}
+        for name in names:
+            with open(os.path.join(path, name), 'rb') as file:
+                batches[name] = pickle.load(file, encoding='bytes')
+    else:
+        with tarfile.open(path, 'r:gz') as archive:
+            batches = {os.path.basename(member.name): pickle.load(archive.extractfile(member), encoding='bytes') for member in archive.getmembers() if os.path.basename(member.name) in names}
+
+    # channels first rows to channels last images
+    def arrays(batch_names):
+        images = np.concatenate([batches[name][b'data'] for name in batch_names]).reshape(-1, 3, 32, 32).transpose(0, 2, 3, 1)
+        labels = np.concatenate([batches[name][b'labels'] for name in batch_names]).astype(np.int32)
+        return np.ascontiguousarray(images), labels
+
+    # return
+    return arrays(names[0:5]), arrays(names[5:6])
+
+# decode jpeg files (bytes) to an N x 64 x 64 x 3 array in batches
+def decode_jpegs(contents, batch_size=SOURCES_DECODE_SIZE):
+    import tensorflow as tf
+    with tf.Graph().as_default():
+        jpegs  = tf.placeholder(tf.string, [None])
+        images = tf.map_fn(lambda jpeg: tf.image.decode_jpeg(jpeg, channels=3), jpegs, dtype=tf.uint8, parallel_iterations=os.cpu_count() or 1)
+        with tf.Session() as session:
+            return np.concatenate([session.run(images, feed_dict={jpegs: contents[index:index + batch_size]}) for index in range(0, len(contents), batch_size)])
+
+# tiny imagenet from tiny-imagenet-200.zip or its extracted directory
+def load_tiny_imagenet(path):
+
+    # file names relative to tiny-imagenet-200 and a reader
+    if os.path.isdir(path) == True:
+        names = [os.path.relpath(os.path.join(root, name), path) for root, dirs, files in os.walk(path) for name in files]
+        def read(name):
+            with open(os.path.join(path, name), 'rb') as file:
+                return file.read()
+    else:
+        archive = zipfile.ZipFile(path)
+        names   = [name.split('/', 1)[1] for name in archive.namelist() if name.endswith('/') == False]
+        def read(name):
+            return archive.read('tiny-imagenet-200/' + name)
+    names = set(name.replace(os.sep, '/') for name in names)
+
+    # class ids (wnids.txt order) and validation annotations
+    class_ids   = [line.strip() for line in read('wnids.txt').decode('utf-8').splitlines() if line.strip() != '']
+    class_label = {class_id: label for label, class_id in enumerate(class_ids)}
+    val_class   = {fields[0]: fields[1] for fields in (re.split(r'\t+', line.strip()) for line in read('val/val_annotations.txt').decode('utf-8').splitlines() if line.strip() != '')}
+
+    # training and validation images
+    train_names = sorted((name for name in names if name.startswith('train/') and name.endswith('.JPEG')), key=lambda name: (class_label[name.split('/')[1]], name))
+    val_names   = sorted(name for name in names if name.startswith('val/images/') and name.endswith('.JPEG'))
+    arrays      = []
+    for split_names, labels in [(train_names, [class_label[name.split('/')[1]] for name in train_names]), (val_names, [class_label[val_class[name.split('/')[-1]]] for name in val_names])]:
+        arrays.append((decode_jpegs([read(name) for name in split_names]), np.array(labels, dtype=np.int32)))
+
+    # return
+    return tuple(arrays)
+
+
+################################################################################
+#
+# LOAD
+#
+################################################################################
+
+# training and testing (images, labels) of a dataset from a source
+# name is 'mnist', 'cifar10' or 'tiny_imagenet'; path is the local archive;
+# local and synthetic arrays are cached in cache_dir (if not None)
+def load(name, source='keras', path=None, cache_dir=None, seed=SOURCES_SEED):
+
+    # keras (cached by keras)
+    if source == 'keras':
+        if name == 'tiny_imagenet':
+            raise ValueError('tiny_imagenet has no keras source')
+        from xnns import data
+        return data.load_keras(name)
+    if source == 'local' and (path is None or os.path.exists(path) == False):
+        raise ValueError('local source {0} of {1} not found'.format(path, name))
+
+    # cache
+    identity = source_identity(source, path, seed)
+    if cache_dir is not None:
+        arrays = load_cache(cache_dir, name, source, identity)
+        if arrays is not None:
+            return arrays
+
+    # parse or generate
+    if source == 'synthetic':
+        arrays = load_synthetic(name, seed)
+    else:
+        arrays = {'mnist': load_mnist, 'cifar10': load_cifar10, 'tiny_imagenet': load_tiny_imagenet}[name](path)
+    if cache_dir is not None:
+        save_cache(cache_dir, name, source, identity, arrays)
+
+    # return
+    return arrays
+
+# load arguments after the dataset name
+Source = collections.namedtuple('Source', ['source', 'path', 'cache_dir', 'seed'])
+
+# default Source of the tools (keras download)
+SOURCES_KERAS = Source('keras', None, None, SOURCES_SEED)
+
+# Source of parsed source arguments
+def source_arguments(args):
+    return Source(args.source, args.source_path, args.cache_dir, args.source_seed)
+
+# source arguments of an example command line
+def add_arguments(parser, choices, default):
+    parser.add_argument('--source',      choices=choices, default=default, help='dataset source (see xnns.sources)')
+    parser.add_argument('--source-path', default=None, help='local archive or directory (--source local)')
+    parser.add_argument('--cache-dir',   default=SOURCES_CACHE_DIR, help='binary cache of local / synthetic sources')
+    parser.add_argument('--source-seed', type=int, default=SOURCES_SEED, help='synthetic source seed')
@@ -0,0 +1,95 @@
+################################################################################
+#
+# xnns/stats.py
+#
+# DESCRIPTION
+#
+#    Streaming per channel dataset statistics and the normalization scale and
+#    shift derived from them
+#
+# NOTES
+#
+#    1. numpy only (no tensorflow) so the dataset scripts and the tests can use
+#       it without a tensorflow install; xnns.data re-exports it
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import numpy as np
+
+
+################################################################################
+#
+# STREAMING STATISTICS
+#
+################################################################################
+
+# per channel statistics are kept as (count, mean, m2) where m2 is the sum of
+# squared differences from the mean
+# statistics of separate batches are merged with the parallel update of Chan et
+# al so the data is read once and each batch is weighted by its true size
+
+# empty statistics
+def channel_stats_init(num_channels=3):
+    return (0, np.zeros(num_channels, dtype=np.float64), np.zeros(num_channels, dtype=np.float64))
+
+# merge 2 sets of statistics
+def channel_stats_merge(stats_a, stats_b):
+
+    # statistics
+    count_a, mean_a, m2_a = stats_a
+    count_b, mean_b, m2_b = stats_b
+
+    # nothing to merge
+    count = count_a + count_b
+    if count == 0:
+        return stats_a
+
+    # merge
+    delta = mean_b - mean_a
+    mean  = mean_a + delta*(float(count_b)/count)
+    m2    = m2_a + m2_b + delta*delta*(float(count_a)*count_b/count)
+
+    # return
+    return (count, mean, m2)
+
+# statistics of a batch of data (batch x rows x cols x channels)
+def channel_stats_batch(data):
+    data = np.asarray(data, dtype=np.float64).reshape(-1, np.shape(data)[-1])
+    mean = np.mean(data, axis=0)
+    m2   = np.sum(np.square(data - mean), axis=0)
+    return (data.shape[0], mean, m2)
+
+# mean and (population) std dev from statistics
+def channel_stats_finalize(stats):
+    count, mean, m2 = stats
+    return mean, np.sqrt(m2/count)
+
+# mean and std dev of an in memory dataset 1 chunk at a time
+def channel_stats(data, chunk_size=1000):
+    stats = channel_stats_init(np.shape(data)[-1])
+    for i in range(0, len(data), chunk_size):
+        stats = channel_stats_merge(stats, channel_stats_batch(data[i:i + chunk_size]))
+    return channel_stats_finalize(stats)
+
+
+################################################################################
+#
+# NORMALIZATION
+#
+################################################################################
+
+# scale and shift that map an 8 bit image to (image/255 - mean)/std
+# mean and std are per channel after dividing the image by 255
+def normalization(mean, std):
+    mean  = np.asarray(mean, dtype=np.float64)
+    std   = np.asarray(std,  dtype=np.float64)
+    scale = (1.0/(255.0*std)).astype(np.float32)
+    shift = (-mean/std).astype(np.float32)
+    return scale, shift
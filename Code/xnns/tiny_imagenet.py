@@ -0,0 +1,154 @@
+################################################################################
+#
+# xnns/tiny_imagenet.py
+#
+# DESCRIPTION
+#
+#    Tiny ImageNet classification command line entry point
+#
+# USAGE
+#
+#    python -m xnns.tiny_imagenet --tfrecords-dir DIR [--decoded]
+#                                 [--model resnet|sequential|sequential_bn]
+#                                 [--help]
+#    python -m xnns.tiny_imagenet --source local|synthetic [--source-path ZIP]
+#
+#    DIR holds the tfrecords (and with --decoded the .npy files) written by
+#    xNNs_Data_03_TinyImageNet.py; --source local / synthetic reads the
+#    tiny-imagenet-200.zip archive / synthetic images instead (see
+#    xnns.sources)
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import os
+
+from xnns import data
+from xnns import models
+from xnns import profiler
+from xnns import sources
+from xnns import training
+
+
+################################################################################
+#
+# PARAMETERS
+#
+################################################################################
+
+# data
+DATA_TFRECORDS_DIR     = './data/tiny-imagenet-200/'
+DATA_TFRECORDS_TRAIN   = 'tiny_imagenet_train_{}.tfrecords'
+DATA_TFRECORDS_VAL     = 'tiny_imagenet_val_{}.tfrecords'
+DATA_DECODED_TRAIN     = 'tiny_imagenet_train_{}.npy'
+DATA_DECODED_VAL       = 'tiny_imagenet_val_{}.npy'
+DATA_NUM_SHARDS_TRAIN  = 20
+DATA_NUM_SHARDS_VAL    = 2
+DATA_NUM_CLASSES       = 200
+DATA_NUM_TRAIN         = 500*DATA_NUM_CLASSES
+DATA_NUM_VAL           = 50*DATA_NUM_CLASSES
+DATA_MEAN              = [0.47593436, 0.44813890, 0.39262872]
+DATA_STD_DEV           = [0.27633505, 0.26869268, 0.28134818]
+
+# model
+MODEL_LEVEL_BLOCKS   = [3, 4, 6, 3]
+MODEL_LEVEL_CHANNELS = [32, 64, 128, 256]
+
+# training
+TRAINING_IMAGE_SIZE     = 64
+TRAINING_CROP_SIZE      = 56
+TRAINING_SHUFFLE_BUFFER = 5000
+TRAINING_BATCH_SIZE     = 32
+TRAINING_NUM_EPOCHS     = 112
+TRAINING_LR_INITIAL     = 0.001
+TRAINING_LR_SCALE       = 0.1
+TRAINING_LR_EPOCHS      = 48
+TRAINING_LR_STAIRCASE   = True
+
+# input pipeline
+PIPELINE_NUM_READERS = 8
+PIPELINE_NUM_CALLS   = os.cpu_count() or 1
+PIPELINE_PREFETCH    = 2
+
+
+################################################################################
+#
+# MODEL
+#
+################################################################################
+
+# model function for a --model name and optional --levels specs
+def model_function(model='resnet', levels=None):
+    def model_fn(data_norm, train_state):
+        if model == 'sequential':
+            return models.model_sequential(data_norm, train_state, DATA_NUM_CLASSES, MODEL_LEVEL_CHANNELS)
+        if model == 'sequential_bn':
+            return models.model_sequential_bn(data_norm, train_state, DATA_NUM_CLASSES, MODEL_LEVEL_CHANNELS)
+        if levels is not None:
+            return models.model_resnet_levels(data_norm, train_state, profiler.parse_level_specs(levels), DATA_NUM_CLASSES)
+        return models.model_resnet(data_norm, train_state, MODEL_LEVEL_BLOCKS, DATA_NUM_CLASSES)
+    return model_fn
+
+
+################################################################################
+#
+# MAIN
+#
+################################################################################
+
+# command line arguments
+def argument_parser():
+    parser = training.argument_parser('Tiny ImageNet classification', TRAINING_BATCH_SIZE, TRAINING_NUM_EPOCHS, TRAINING_LR_INITIAL, TRAINING_LR_SCALE, TRAINING_LR_EPOCHS)
+    parser.add_argument('--model',         choices=['resnet', 'sequential', 'sequential_bn'], default='resnet', help='model')
+    parser.add_argument('--levels', nargs='+', default=None, help='resnet width,blocks,strides per level (see xnns.profiler)')
+    parser.add_argument('--tfrecords-dir', default=DATA_TFRECORDS_DIR, help='directory with the tfrecords / decoded .npy files')
+    parser.add_argument('--decoded',       action='store_true', help='memory map pre decoded images instead of reading tfrecords')
+    parser.add_argument('--num-calls',     type=int, default=PIPELINE_NUM_CALLS, help='images decoded at the same time')
+    sources.add_arguments(parser, ['tfrecords', 'local', 'synthetic'], 'tfrecords')
+    return parser
+
+def main(argv=None):
+
+    # arguments
+    parser = argument_parser()
+    args   = parser.parse_args(argv)
+    eval_batch_size = args.batch_size if args.eval_batch_size is None else args.eval_batch_size
+
+    # normalization values
+    scale, shift = data.normalization(DATA_MEAN, DATA_STD_DEV)
+
+    # dataset
+    # local and synthetic sources are decoded once into the memory mapped cache
+    if args.source != 'tfrecords':
+        sources.load('tiny_imagenet', args.source, args.source_path, args.cache_dir, args.source_seed)
+        images_train, labels_train = sources.cache_files(args.cache_dir, 'tiny_imagenet', args.source, 'train')
+        images_val,   labels_val   = sources.cache_files(args.cache_dir, 'tiny_imagenet', args.source, 'test')
+        dataset_train = data.dataset_decoded(images_train, labels_train, TRAINING_CROP_SIZE, args.batch_size, True,  args.num_calls, PIPELINE_PREFETCH, args.shuffle_seed)
+        dataset_val   = data.dataset_decoded(images_val,   labels_val,   TRAINING_CROP_SIZE, eval_batch_size, False, args.num_calls, PIPELINE_PREFETCH)
+    elif args.decoded == True:
+        decoded_train = os.path.join(args.tfrecords_dir, DATA_DECODED_TRAIN)
+        decoded_val   = os.path.join(args.tfrecords_dir, DATA_DECODED_VAL)
+        dataset_train = data.dataset_decoded(decoded_train.format('images'), decoded_train.format('labels'), TRAINING_CROP_SIZE, args.batch_size, True,  args.num_calls, PIPELINE_PREFETCH, args.shuffle_seed)
+        dataset_val   = data.dataset_decoded(decoded_val.format('images'),   decoded_val.format('labels'),   TRAINING_CROP_SIZE, eval_batch_size, False, args.num_calls, PIPELINE_PREFETCH)
+    else:
+        tfrecords_train = data.tfrecord_files(os.path.join(args.tfrecords_dir, DATA_TFRECORDS_TRAIN), DATA_NUM_SHARDS_TRAIN)
+        tfrecords_val   = data.tfrecord_files(os.path.join(args.tfrecords_dir, DATA_TFRECORDS_VAL),   DATA_NUM_SHARDS_VAL)
+        dataset_train   = data.dataset_tfrecords_train(tfrecords_train, TRAINING_IMAGE_SIZE, TRAINING_CROP_SIZE, args.batch_size, TRAINING_SHUFFLE_BUFFER, PIPELINE_NUM_READERS, args.num_calls, PIPELINE_PREFETCH, args.shuffle_seed)
+        dataset_val     = data.dataset_tfrecords_val(tfrecords_val, TRAINING_IMAGE_SIZE, TRAINING_CROP_SIZE, eval_batch_size, args.num_calls, PIPELINE_PREFETCH)
+
+    # model
+    model_fn = model_function(args.model, args.levels)
+
+    # train
+    training.run(dataset_train, dataset_val, model_fn, scale, shift, DATA_NUM_TRAIN, DATA_NUM_VAL, DATA_NUM_CLASSES,
+                 args.batch_size, args.epochs, args.lr_initial, args.lr_scale, args.lr_epochs, TRAINING_LR_STAIRCASE, args.display, args.precision, args.steps_per_run,
+                 args.checkpoint_dir, args.max_checkpoints, checkpoint_batches=args.checkpoint_batches)
+
+if __name__ == '__main__':
+    main()
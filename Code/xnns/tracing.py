@@ -0,0 +1,285 @@
+################################################################################
+#
+# xnns/tracing.py
+#
+# DESCRIPTION
+#
+#    Input pipeline vs compute profiler of the training loop
+#
+#    Step profile: training steps of the real training graph are traced and
+#    each step is split into
+#       iterator wait: time of the IteratorGetNext op (the model waiting for
+#                      the next batch)
+#       compute:       rest of the traced op time span of the step
+#       host overhead: session.run wall time outside the op time span
+#    The same model on a cached batch gives the compute only step time
+#
+#    Pipeline profile: the training pipeline is built up 1 stage at a time
+#    from the first stage of data.dataset_tfrecords_train /
+#    data.dataset_arrays and the images / sec of each prefix is measured
+#       tiny_imagenet: read (global index: permuted pread of the records;
+#                      shuffle buffer: shard interleave and shuffle), decode
+#                      (parse and decode), augment (flip and crop), prefetch
+#       cifar:         gather (global index or shuffle buffer, batches
+#                      gathered from the arrays by index), augment, prefetch
+#    --shuffle-seed (default, as training) traces the global shuffle and
+#    --no-global-shuffle the shuffle buffer pipeline
+#
+# USAGE
+#
+#    python -m xnns.tracing --example tiny_imagenet --tfrecords-dir ./data/tiny-imagenet-200/ --trace timeline.json --csv steps.csv
+#
+#    Open timeline.json (the last traced step) in chrome://tracing
+#
+# OUTPUT
+#
+#    A per component summary (mean / p50 / p90 ms and share of the step), the
+#    per stage pipeline throughput next to the compute only throughput and
+#    which of the 2 bounds the training
+#
+# NOTES
+#
+#    1. Full tracing adds its own overhead so the absolute times are somewhat
+#       higher than an untraced run; the split between the components is what
+#       to look at
+#    2. The stage whose throughput drops most from the previous stage is the
+#       one to scale (readers, --num-calls, prefetch) when the training is
+#       input bound
+#    3. CIFAR comes from --source (see xnns.sources)
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import argparse
+import os
+import time
+
+import numpy      as np
+import tensorflow as tf
+
+from tensorflow.python.client import timeline
+
+from xnns import cifar
+from xnns import data
+from xnns import inference
+from xnns import sources
+from xnns import tiny_imagenet
+from xnns import training
+
+
+################################################################################
+#
+# PARAMETERS
+#
+################################################################################
+
+# defaults
+TIMELINE_STEPS          = 100
+TIMELINE_WARMUP_STEPS   = 10
+TIMELINE_BATCH_SIZE     = 32
+TIMELINE_STAGE_BATCHES  = 100
+TIMELINE_STAGE_WARMUP   = 10
+
+# training graph learning rate schedule (does not affect the timing)
+TIMELINE_LR_INITIAL     = 0.001
+TIMELINE_LR_SCALE       = 0.1
+TIMELINE_LR_EPOCHS      = 48
+TIMELINE_BATCHES_EPOCH  = 1000
+
+# components of a step
+TIMELINE_COMPONENTS = ['wall', 'iterator wait', 'compute', 'host overhead']
+
+
+################################################################################
+#
+# PIPELINE STAGES
+#
+################################################################################
+
+# training pipeline of an example as (name, dataset) prefixes in stage order
+# built from the first stage of the training pipeline (the global shuffle with a
+# shuffle_seed, the shuffle buffer without) so the last stage is the full
+# training pipeline
+# arrays are the cifar (images, labels) training arrays
+def pipeline_stages(example, tfrecords_dir, batch_size, num_calls, arrays=None, shuffle_seed=None):
+    order = 'global index' if shuffle_seed is not None else 'shuffle buffer'
+
+    # tiny imagenet (see data.dataset_tfrecords_train)
+    if example == 'tiny_imagenet':
+        tfrecords = data.tfrecord_files(os.path.join(tfrecords_dir, tiny_imagenet.DATA_TFRECORDS_TRAIN), tiny_imagenet.DATA_NUM_SHARDS_TRAIN)
+        read      = data.dataset_tfrecords_records(tfrecords, batch_size, tiny_imagenet.TRAINING_SHUFFLE_BUFFER, tiny_imagenet.PIPELINE_NUM_READERS, shuffle_seed)
+        decode    = read.apply(tf.data.experimental.map_and_batch(lambda record: data.parse_record(record, tiny_imagenet.TRAINING_IMAGE_SIZE), batch_size, num_parallel_calls=num_calls))
+        augment   = decode.map(lambda images, labels: (data.random_flip_crop_batch(images, tiny_imagenet.TRAINING_CROP_SIZE), labels))
+        return [('read ({0})'.format(order), read.batch(batch_size)), ('decode', decode), ('augment', augment), ('prefetch', augment.prefetch(tiny_imagenet.PIPELINE_PREFETCH))]
+
+    # cifar (see data.dataset_arrays)
+    data_train, labels_train = arrays
+    gather  = data.dataset_arrays_batches(data_train, labels_train, batch_size, True, cifar.TRAINING_SHUFFLE_BUFFER, shuffle_seed)
+    augment = gather.map(lambda images, labels: (data.random_flip_crop_batch(images, cifar.TRAINING_CROP_SIZE), labels))
+    return [('gather ({0})'.format(order), gather), ('augment', augment), ('prefetch', augment.prefetch(1))]
+
+# images / sec of a dataset after num_warmup batches
+def stage_throughput(session, dataset, batch_size, num_batches, num_warmup):
+    iterator = dataset.make_initializable_iterator()
+    batch    = iterator.get_next()
+    session.run(iterator.initializer)
+    for index in range(num_warmup):
+        session.run(batch)
+    time_start = time.time()
+    for index in range(num_batches):
+        session.run(batch)
+    return num_batches*batch_size/(time.time() - time_start)
+
+# images / sec of each stage
+def profile_pipeline(example, tfrecords_dir, batch_size, num_calls, num_batches, num_warmup, arrays=None, shuffle_seed=None):
+    with tf.Graph().as_default():
+        stages = pipeline_stages(example, tfrecords_dir, batch_size, num_calls, arrays, shuffle_seed)
+        with tf.Session() as session:
+            return [(name, stage_throughput(session, dataset, batch_size, num_batches, num_warmup)) for name, dataset in stages]
+
+
+################################################################################
+#
+# STEP PROFILE
+#
+################################################################################
+
+# iterator wait and op time span (seconds) of a traced step
+def step_times(step_stats, get_next_name):
+    starts = []
+    ends   = []
+    wait   = 0
+    for device in step_stats.dev_stats:
+        for node in device.node_stats:
+            start = node.all_start_micros
+            end   = node.all_start_micros + node.all_end_rel_micros
+            starts.append(start)
+            ends.append(end)
+            if node.node_name.split(':')[0] == get_next_name:
+                wait = max(wait, end - start)
+    return wait/1e6, (max(ends) - min(starts))/1e6
+
+# traced training steps of a dataset
+# returns 1 row of TIMELINE_COMPONENTS seconds per step and the run metadata of
+# the last step
+def profile_steps(dataset_fn, model_fn, scale, shift, num_steps, num_warmup):
+
+    # training graph
+    with tf.Graph().as_default():
+        dataset = dataset_fn()
+        graph   = training.build_graph(dataset, dataset, model_fn, scale, shift, TIMELINE_BATCHES_EPOCH, TIMELINE_LR_INITIAL, TIMELINE_LR_SCALE, TIMELINE_LR_EPOCHS)
+        options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+
+        # create a session
+        with tf.Session() as session:
+            session.run(tf.global_variables_initializer())
+            session.run(graph.iterator_init_train)
+
+            # warm up
+            for step in range(num_warmup):
+                session.run(graph.optimizer, feed_dict={graph.train_state: True})
+
+            # traced steps
+            rows = []
+            for step in range(num_steps):
+                run_metadata = tf.RunMetadata()
+                time_start   = time.time()
+                session.run(graph.optimizer, feed_dict={graph.train_state: True}, options=options, run_metadata=run_metadata)
+                wall         = time.time() - time_start
+                wait, span   = step_times(run_metadata.step_stats, graph.images.op.name)
+                rows.append([wall, wait, span - wait, max(wall - span, 0.0)])
+
+    # return
+    return np.array(rows), run_metadata
+
+# display the per component summary of a step profile
+def print_steps(rows):
+    print('{0:14s} {1:>10s} {2:>10s} {3:>10s} {4:>8s}'.format('Component', 'Mean ms', 'p50 ms', 'p90 ms', 'Share %'))
+    for index, name in enumerate(TIMELINE_COMPONENTS):
+        values = 1000.0*rows[:, index]
+        print('{0:14s} {1:10.3f} {2:10.3f} {3:10.3f} {4:8.1f}'.format(name, np.mean(values), np.percentile(values, 50), np.percentile(values, 90), 100.0*np.mean(rows[:, index])/np.mean(rows[:, 0])))
+
+
+################################################################################
+#
+# MAIN
+#
+################################################################################
+
+# command line arguments
+def argument_parser():
+    parser = argparse.ArgumentParser(description='Input pipeline vs compute profiler of the training loop')
+    parser.add_argument('--example',       choices=['cifar', 'tiny_imagenet'], default='tiny_imagenet', help='example')
+    parser.add_argument('--model',         choices=['resnet', 'sequential', 'sequential_bn'], default='resnet', help='model')
+    parser.add_argument('--levels',        nargs='+', default=None, help='resnet width,blocks,strides per level (see xnns.profiler)')
+    parser.add_argument('--tfrecords-dir', default=tiny_imagenet.DATA_TFRECORDS_DIR, help='directory with the Tiny ImageNet tfrecords')
+    parser.add_argument('--batch-size',    type=int, default=TIMELINE_BATCH_SIZE, help='training batch size')
+    parser.add_argument('--num-calls',     type=int, default=tiny_imagenet.PIPELINE_NUM_CALLS, help='images decoded at the same time')
+    parser.add_argument('--steps',         type=int, default=TIMELINE_STEPS, help='traced training steps')
+    parser.add_argument('--stage-batches', type=int, default=TIMELINE_STAGE_BATCHES, help='timed batches per pipeline stage')
+    parser.add_argument('--trace',         default='timeline.json', help='chrome trace of the last traced step')
+    parser.add_argument('--csv',           default=None, help='per step components (seconds) csv file')
+    parser.add_argument('--shuffle-seed',  type=int, default=1, help='seed of the per epoch global shuffle of the training data')
+    parser.add_argument('--no-global-shuffle', dest='shuffle_seed', action='store_const', const=None, help='trace the shuffle buffer training pipeline instead')
+    sources.add_arguments(parser, sources.SOURCES, 'keras')
+    return parser
+
+def main(argv=None):
+
+    # arguments
+    parser = argument_parser()
+    args   = parser.parse_args(argv)
+    if args.example == 'tiny_imagenet' and args.source != 'keras':
+        parser.error('--source selects the cifar data (tiny_imagenet reads --tfrecords-dir)')
+    arrays = sources.load('cifar10', *sources.source_arguments(args))[0] if args.example == 'cifar' else None
+
+    # model
+    model_fn, image_size, crop_size, channels, scale, shift = inference.example_config(args.example, args.model, args.levels)
+
+    # pipeline
+    def dataset_fn():
+        return pipeline_stages(args.example, args.tfrecords_dir, args.batch_size, args.num_calls, arrays, args.shuffle_seed)[-1][1]
+    stages = profile_pipeline(args.example, args.tfrecords_dir, args.batch_size, args.num_calls, args.stage_batches, TIMELINE_STAGE_WARMUP, arrays, args.shuffle_seed)
+
+    # steps with the pipeline and with a cached batch
+    rows, run_metadata = profile_steps(dataset_fn, model_fn, scale, shift, args.steps, TIMELINE_WARMUP_STEPS)
+    rows_compute, _    = profile_steps(lambda: dataset_fn().take(1).cache().repeat(), model_fn, scale, shift, args.steps, TIMELINE_WARMUP_STEPS)
+
+    # export
+    with open(args.trace, 'w') as file:
+        file.write(timeline.Timeline(run_metadata.step_stats).generate_chrome_trace_format())
+    if args.csv is not None:
+        np.savetxt(args.csv, rows, delimiter=',', header=','.join(TIMELINE_COMPONENTS), comments='')
+
+    # display - steps
+    print('Training step ({0:d} traced steps, batch size {1:d})'.format(args.steps, args.batch_size))
+    print_steps(rows)
+    print('')
+
+    # display - throughput
+    print('{0:32s} {1:>12s}'.format('Stage', 'Images / sec'))
+    for name, images_per_sec in stages:
+        print('{0:32s} {1:12.1f}'.format('pipeline ' + name, images_per_sec))
+    compute_per_sec  = args.batch_size/np.mean(rows_compute[:, 0])
+    training_per_sec = args.batch_size/np.mean(rows[:, 0])
+    print('{0:32s} {1:12.1f}'.format('compute (cached batch)', compute_per_sec))
+    print('{0:32s} {1:12.1f}'.format('training', training_per_sec))
+    print('')
+
+    # display - bottleneck
+    drops = [(stages[index - 1][1] - stages[index][1] if index > 0 else 0.0, stages[index][0]) for index in range(len(stages))]
+    if stages[-1][1] < compute_per_sec:
+        print('Input pipeline bound: the pipeline delivers {0:.1f} of the {1:.1f} images / sec the model can compute'.format(stages[-1][1], compute_per_sec))
+        print('Largest stage drop:   {0} (scale this stage first)'.format(max(drops)[1] if max(drops)[0] > 0.0 else stages[0][0]))
+    else:
+        print('Compute bound: the model computes {0:.1f} of the {1:.1f} images / sec the pipeline delivers'.format(compute_per_sec, stages[-1][1]))
+    print('Trace: {0}'.format(args.trace))
+
+if __name__ == '__main__':
+    main()
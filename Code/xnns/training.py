@@ -0,0 +1,277 @@
+################################################################################
+#
+# xnns/training.py
+#
+# DESCRIPTION
+#
+#    Training graph, epoch / session loop and command line arguments shared by
+#    the MNIST, CIFAR and Tiny ImageNet examples
+#
+# DESIGN
+#
+#    1. Iterator: a reinitializable iterator connects the training or testing
+#       dataset (8 bit batches) to the model
+#    2. Model:    maps normalized data to predictions
+#    3. Output:   accuracy (argmax) and loss (softmax cross entropy) and the
+#                 streaming testing metrics (see xnns/evaluation.py)
+#    4. Optimizer: Adam with a staircase exponential learning rate decay
+#                  (float32 or mixed precision, see xnns/precision.py)
+#    5. Training: for num training epochs cycle through an epoch of training
+#                 data then validate on the testing data, running 1 or
+#                 steps_per_run training steps per session.run (see
+#                 xnns/multistep.py), optionally checkpointing after each epoch
+#                 (and every checkpoint_batches batches) and resuming from the
+#                 latest checkpoint (see xnns/checkpoint.py)
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import argparse
+import collections
+
+import tensorflow as tf
+
+from xnns import checkpoint as checkpointing
+from xnns import data
+from xnns import evaluation
+from xnns import multistep
+from xnns import precision as mixed
+
+
+################################################################################
+#
+# GRAPH
+#
+################################################################################
+
+# training graph
+# images are the 8 bit iterator output and data the normalized model input
+TrainingGraph = collections.namedtuple('TrainingGraph', [
+    'images', 'labels', 'data', 'train_state', 'predictions', 'accuracy', 'loss',
+    'global_step', 'batches_trained', 'learning_rate', 'optimizer', 'num_steps', 'metrics', 'iterator_init_train', 'iterator_init_test'])
+
+# counter of the training batches run (checkpointed)
+# unlike global_step it is also incremented by the steps a float16 loss scale
+# optimizer skips so it is the position in the training data and drives the
+# learning rate schedule
+def get_or_create_batches_trained():
+    with tf.variable_scope(tf.get_variable_scope(), reuse=tf.AUTO_REUSE):
+        return tf.get_variable('batches_trained', [], dtype=tf.int64, initializer=tf.zeros_initializer(), trainable=False)
+
+# build the training graph
+# model_fn(data, train_state) returns predictions
+# precision is float32, float16 or bfloat16 (float32 master weights)
+# with steps_per_run > 1 optimizer runs num_steps (default steps_per_run)
+# training steps in an in graph loop
+# the metrics keep the first num_reservoir testing predictions for display
+# the learning rate optionally ramps linearly from lr_warmup_start*lr_initial
+# to lr_initial over the first lr_warmup_epochs epochs
+# gradients_fn(grads_and_vars) optionally transforms the gradients before the
+# update (e.g. the all reduce of xnns/distributed.py)
+def build_graph(dataset_train, dataset_test, model_fn, scale, shift, num_batches_train, lr_initial, lr_scale, lr_epochs, lr_staircase=True, precision='float32', steps_per_run=1, num_reservoir=0,
+                lr_warmup_epochs=0, lr_warmup_start=1.0, gradients_fn=None):
+
+    # iterator
+    iterator            = tf.data.Iterator.from_structure(dataset_train.output_types, dataset_train.output_shapes)
+    iterator_init_train = iterator.make_initializer(dataset_train)
+    iterator_init_test  = iterator.make_initializer(dataset_test)
+
+    # example
+    images, labels = iterator.get_next()
+
+    # normalization on the model device
+    data_norm = data.normalize(images, scale, shift)
+
+    # state
+    train_state = tf.placeholder(tf.bool, name='train_state')
+
+    # model
+    with tf.variable_scope(multistep.MODEL_SCOPE):
+        predictions = mixed.model_precision(model_fn, data_norm, train_state, precision)
+
+    # accuracy
+    accuracy = tf.reduce_sum(tf.cast(tf.equal(tf.argmax(predictions, 1), tf.cast(labels, tf.int64)), tf.float32))
+
+    # loss
+    loss = tf.losses.sparse_softmax_cross_entropy(labels=labels, logits=predictions)
+
+    # testing metrics
+    metrics = evaluation.build_metrics(predictions, labels, predictions.shape.as_list()[-1], num_reservoir)
+
+    # optimizer
+    # the learning rate schedule is a function of the batches trained
+    global_step     = tf.train.get_or_create_global_step()
+    batches_trained = get_or_create_batches_trained()
+    def learning_rate_fn(step):
+        learning_rate = tf.train.exponential_decay(lr_initial, step, lr_epochs*num_batches_train, lr_scale, staircase=lr_staircase)
+        if lr_warmup_epochs > 0:
+            warmup        = tf.minimum(tf.cast(step, tf.float32)/(lr_warmup_epochs*num_batches_train), 1.0)
+            learning_rate = learning_rate*(lr_warmup_start + (1.0 - lr_warmup_start)*warmup)
+        return learning_rate
+    learning_rate = learning_rate_fn(batches_trained)
+    if steps_per_run == 1:
+        num_steps  = None
+        update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
+        with tf.control_dependencies(update_ops):
+            optimizer = mixed.adam_minimize(loss, learning_rate, global_step, precision, gradients_fn)
+        with tf.control_dependencies([optimizer]):
+            optimizer = tf.assign_add(batches_trained, 1)
+    else:
+        num_steps = tf.placeholder_with_default(steps_per_run, [], name='num_steps')
+        optimizer = multistep.train_steps(iterator, model_fn, scale, shift, global_step, learning_rate_fn, num_steps, precision, gradients_fn, batches_trained)
+
+    # return
+    return TrainingGraph(images, labels, data_norm, train_state, predictions, accuracy, loss, global_step, batches_trained, learning_rate, optimizer, num_steps, metrics, iterator_init_train, iterator_init_test)
+
+
+################################################################################
+#
+# TRAINING
+#
+################################################################################
+
+# train
+# initialize the iterator to the training dataset
+# cycle through the training batches
+# example, encoder, decoder, error, gradient computation and update
+# with steps_per_run > 1 each session.run covers steps_per_run batches (fewer
+# for the last run of the epoch)
+# a globally shuffled training pipeline (see data.shuffle_position) starts at
+# batch batch_offset of the permutation of epoch
+# with save_batches > 0 save_fn() is called after every save_batches batches of
+# the epoch (counted from the start of the epoch, not after its last batch)
+def train_epoch(session, graph, num_batches_train, steps_per_run=1, epoch=0, batch_offset=0, save_fn=None, save_batches=0):
+    session.run(graph.iterator_init_train, feed_dict=data.shuffle_feed(epoch, batch_offset))
+    batch_index = 0
+    while batch_index < num_batches_train:
+
+        # 1 session.run (ending at the next save)
+        num_steps = min(steps_per_run, num_batches_train - batch_index)
+        if save_batches > 0:
+            num_steps = min(num_steps, save_batches - (batch_offset + batch_index) % save_batches)
+        if steps_per_run == 1:
+            session.run(graph.optimizer, feed_dict={graph.train_state: True})
+        else:
+            session.run(graph.optimizer, feed_dict={graph.num_steps: num_steps})
+        batch_index += num_steps
+
+        # save
+        if save_fn is not None and save_batches > 0 and (batch_offset + batch_index) % save_batches == 0 and batch_index < num_batches_train:
+            save_fn()
+
+# build the graph, train for num_epochs validating after each epoch, optionally
+# display num_display testing images and return the final testing metrics
+# with a checkpoint_dir a checkpoint is written after each epoch (and every
+# checkpoint_batches batches within it), the last max_checkpoints are kept and
+# training resumes from the latest one: batches_trained (and with it the
+# learning rate decay) is restored and the epoch and batch within the epoch are
+# derived from it
+def run(dataset_train, dataset_test, model_fn, scale, shift, num_train, num_test, num_classes, batch_size, num_epochs, lr_initial, lr_scale, lr_epochs, lr_staircase=True, num_display=0, precision='float32', steps_per_run=1, checkpoint_dir=None, max_checkpoints=5, initial_values=None,
+        checkpoint_batches=0):
+
+    # data
+    # testing is 1 pass over the testing dataset (see evaluation.evaluate)
+    num_batches_train = int(num_train/batch_size)
+
+    # graph
+    graph            = build_graph(dataset_train, dataset_test, model_fn, scale, shift, num_batches_train, lr_initial, lr_scale, lr_epochs, lr_staircase, precision, steps_per_run, num_display)
+
+    # checkpoint
+    if checkpoint_dir is not None:
+        checkpoint = checkpointing.build_checkpoint(checkpoint_dir, max_checkpoints, graph.batches_trained)
+
+    # create a session
+    session = tf.Session()
+
+    # initialize global variables
+    session.run(tf.global_variables_initializer())
+
+    # warm start
+    # initial_values maps model variable names to arrays (see xnns/pruning.py)
+    # optimizer slots (model/.../Adam, Adam_1) keep their initial values and a
+    # value without a model variable is an error
+    if initial_values is not None:
+        loaded = set()
+        for variable in tf.global_variables(scope=multistep.MODEL_SCOPE):
+            if variable.op.name in initial_values:
+                variable.load(initial_values[variable.op.name], session)
+                loaded.add(variable.op.name)
+        if loaded != set(initial_values.keys()):
+            raise ValueError('initial values without a model variable: {0}'.format(sorted(set(initial_values.keys()) - loaded)))
+
+    # resume
+    epoch_start  = 0
+    batch_offset = 0
+    if checkpoint_dir is not None and checkpointing.restore_latest(session, checkpoint) is not None:
+        batches_trained, global_step = session.run([graph.batches_trained, graph.global_step])
+        epoch_start                  = batches_trained // num_batches_train
+        batch_offset                 = batches_trained % num_batches_train
+        print('Resuming at epoch {0:d} batch {1:d} (global step {2:d})'.format(epoch_start, batch_offset, global_step))
+
+    # cycle through the epochs
+    metrics = None
+    for epoch_index in range(epoch_start, num_epochs):
+
+        # train
+        # a resumed epoch only trains its remaining batches
+        if checkpoint_dir is not None and checkpoint_batches > 0:
+            train_epoch(session, graph, num_batches_train - batch_offset, steps_per_run, epoch_index, batch_offset, lambda: checkpointing.save_async(session, checkpoint), checkpoint_batches)
+        else:
+            train_epoch(session, graph, num_batches_train - batch_offset, steps_per_run, epoch_index, batch_offset)
+        batch_offset = 0
+
+        # checkpoint
+        if checkpoint_dir is not None:
+            checkpointing.save_async(session, checkpoint)
+
+        # validate
+        metrics = evaluation.evaluate(session, graph)
+
+        # display
+        print('Epoch {0:3d}: top 1 / top 5 accuracy on the {1:d} test images is {2:5.2f} / {3:5.2f} % and the loss is {4:6.4f}'.format(epoch_index, metrics['count'], 100.0*metrics['top1'], 100.0*metrics['top5'], metrics['loss']))
+        if metrics['count'] != num_test:
+            print('Warning: expected {0:d} test images'.format(num_test))
+
+    # display with the trained variables
+    if num_display > 0 and metrics is not None:
+        evaluation.display(session, graph, metrics['predictions'], num_display)
+
+    # finish the last checkpoint write and close the session
+    if checkpoint_dir is not None:
+        checkpointing.wait(checkpoint)
+    session.close()
+
+    # return
+    return metrics
+
+
+################################################################################
+#
+# COMMAND LINE
+#
+################################################################################
+
+# arguments common to all examples with per example defaults
+def argument_parser(description, batch_size, num_epochs, lr_initial, lr_scale, lr_epochs):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument('--batch-size', type=int,   default=batch_size, help='training batch size')
+    parser.add_argument('--eval-batch-size', type=int, default=None,   help='testing batch size (default --batch-size)')
+    parser.add_argument('--epochs',     type=int,   default=num_epochs, help='number of training epochs')
+    parser.add_argument('--lr-initial', type=float, default=lr_initial, help='initial learning rate')
+    parser.add_argument('--lr-scale',   type=float, default=lr_scale,   help='learning rate scale every --lr-epochs epochs')
+    parser.add_argument('--lr-epochs',  type=int,   default=lr_epochs,  help='epochs between learning rate scales')
+    parser.add_argument('--display',    type=int,   default=0,          help='number of testing images to display after training')
+    parser.add_argument('--precision',  choices=sorted(mixed.PRECISION_DTYPES.keys()), default='float32', help='model compute precision (float32 master weights)')
+    parser.add_argument('--steps-per-run', type=int, default=1, help='training steps per session.run (in graph loop if > 1)')
+    parser.add_argument('--checkpoint-dir', default=None, help='checkpoint after each epoch and resume from the latest checkpoint in this directory')
+    parser.add_argument('--max-checkpoints', type=int, default=5, help='number of checkpoints to keep')
+    parser.add_argument('--checkpoint-batches', type=int, default=0, help='also checkpoint every this many training batches within an epoch (0: only after each epoch)')
+    parser.add_argument('--shuffle-seed', type=int, default=1, help='seed of the per epoch global shuffle of the training data')
+    parser.add_argument('--no-global-shuffle', dest='shuffle_seed', action='store_const', const=None, help='shuffle the training data with a shuffle buffer instead (the order is not reproducible and a resumed epoch restarts the buffer)')
+    return parser
@@ -0,0 +1,119 @@
+################################################################################
+#
+# xnns/weights.py
+#
+# DESCRIPTION
+#
+#    Trained model variable values (name -> numpy array) by layer: the
+#    tf.layers creation order reader of xnns.folding / xnns.quantization and
+#    the structured channel pruning of the resnet bottlenecks of xnns.pruning
+#
+# NOTES
+#
+#    1. numpy only (no tensorflow) so the pruning can be tested without a
+#       tensorflow install
+#
+################################################################################
+
+
+################################################################################
+#
+# IMPORT
+#
+################################################################################
+
+import numpy as np
+
+
+################################################################################
+#
+# PARAMETERS
+#
+################################################################################
+
+# model variable scope (see xnns.multistep)
+MODEL_SCOPE = 'model'
+
+# batch norm variables
+BN_NAMES = ['gamma', 'beta', 'moving_mean', 'moving_variance']
+
+
+################################################################################
+#
+# VARIABLES
+#
+################################################################################
+
+# trained variable reader
+# values maps variable names to arrays and counts the layers read per kind
+def reader_init(values):
+    return {'values': values, 'counts': {'conv2d': 0, 'batch_normalization': 0, 'dense': 0}}
+
+# variable names of the next layer of a kind (in tf.layers creation order)
+def layer_names(reader, kind, names):
+    index                    = reader['counts'][kind]
+    reader['counts'][kind]  += 1
+    layer                    = kind if index == 0 else '{0}_{1:d}'.format(kind, index)
+    return ['{0}/{1}/{2}'.format(MODEL_SCOPE, layer, name) for name in names]
+
+# variables of the next layer of a kind
+def read_layer(reader, kind, names):
+    return [reader['values'][name] for name in layer_names(reader, kind, names)]
+
+
+################################################################################
+#
+# PRUNING
+#
+################################################################################
+
+# importance of the output channels of a conv followed by a bn
+def channel_importance(values, kernel, gamma, criterion):
+    if criterion == 'bn_gamma':
+        return np.abs(values[gamma])
+    return np.sum(np.abs(values[kernel]), axis=(0, 1, 2))
+
+# sorted indices of the keep fraction (at least 1) of the most important
+# channels
+def keep_channels(importance, keep):
+    num_keep = max(1, int(round(keep*len(importance))))
+    return np.sort(np.argsort(-importance)[0:num_keep])
+
+# pruned model_resnet_levels variable values
+# the variables are walked in the per kind creation order of models.bottleneck
+# returns the pruned values and the (width_1, width_2) of each bottleneck
+def prune(values, level_specs, keep, criterion):
+
+    # walk the variables
+    pruned       = dict(values)
+    reader       = reader_init(values)
+    block_widths = []
+    layer_names(reader, 'conv2d', ['kernel'])
+    for width, num_blocks, strides in level_specs:
+        for block in range(num_blocks):
+
+            # bottleneck variables
+            layer_names(reader, 'batch_normalization', BN_NAMES)
+            kernel_1, = layer_names(reader, 'conv2d', ['kernel'])
+            bn_1      = layer_names(reader, 'batch_normalization', BN_NAMES)
+            kernel_2, = layer_names(reader, 'conv2d', ['kernel'])
+            bn_2      = layer_names(reader, 'batch_normalization', BN_NAMES)
+            kernel_3, = layer_names(reader, 'conv2d', ['kernel'])
+            if block == 0:
+                layer_names(reader, 'conv2d', ['kernel'])
+
+            # kept channels
+            keep_1 = keep_channels(channel_importance(values, kernel_1, bn_1[0], criterion), keep)
+            keep_2 = keep_channels(channel_importance(values, kernel_2, bn_2[0], criterion), keep)
+
+            # slices
+            pruned[kernel_1] = values[kernel_1][:, :, :, keep_1]
+            pruned[kernel_2] = values[kernel_2][:, :, keep_1, :][:, :, :, keep_2]
+            pruned[kernel_3] = values[kernel_3][:, :, keep_2, :]
+            for name_1, name_2 in zip(bn_1, bn_2):
+                pruned[name_1] = values[name_1][keep_1]
+                pruned[name_2] = values[name_2][keep_2]
+            block_widths.append((len(keep_1), len(keep_2)))
+
+    # return
+    return pruned, block_widths